@@ -0,0 +1,144 @@
+"""
+Backtest the vectorized baseline forecasters against Prophet.
+
+Holds out the last --horizon days at --folds rolling origins, forecasts them with
+every method from the history before the origin, and reports accuracy (MAE,
+RMSE, sMAPE), interval coverage and wall time per method. Baselines fit all
+series in one call; Prophet fits them one at a time and is skipped when it is
+not installed.
+
+Usage (inside the python container, after loading invoices and refreshing mrr_daily):
+    python benchmarks/backtest_forecasters.py --series currency cohort --horizon 30 --folds 3
+    python benchmarks/backtest_forecasters.py --source csv --horizon 7 --folds 3
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from utils.baselines import BASELINE_METHODS, BaselineModelBuilder
+from utils.forecasting import MIN_HISTORY_DAYS, SERIES_TYPES
+
+INTERVAL_WIDTH = 0.8
+
+
+def load_database_series(series_types: List[str]) -> pd.DataFrame:
+    """Daily MRR series from mrr_daily, one column per series id, NaN outside each series' own span"""
+    from utils.database import get_database_connection
+    from utils.forecasting import load_series
+
+    series = load_series(get_database_connection(), series_types, MIN_HISTORY_DAYS)
+    wide = pd.DataFrame({s.series_id: s.history for s in series})
+    return wide.asfreq('D')
+
+
+def load_csv_series() -> pd.DataFrame:
+    """Daily invoice totals per currency from data/invoices.csv, as in the analysis notebook"""
+    from update_invoices import read_invoice_chunks
+
+    invoices = pd.concat(read_invoice_chunks())
+    invoices = invoices[~invoices['is_forgiven']]
+    daily = invoices.groupby([invoices['created_at'].dt.normalize(), 'currency'])['total'].sum()
+    return daily.unstack().asfreq('D').fillna(0.0)
+
+
+def score(actual: np.ndarray, yhat: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> Dict[str, float]:
+    """
+    Accuracy over (series, horizon) arrays, on the days both an actual value and
+    a forecast exist, i.e. skipping series that ended before the origin.
+    """
+    scored = ~np.isnan(actual) & ~np.isnan(yhat)
+    actual, yhat, lower, upper = actual[scored], yhat[scored], lower[scored], upper[scored]
+    error = yhat - actual
+    denominator = np.abs(actual) + np.abs(yhat)
+    smape = np.divide(2 * np.abs(error), denominator, out=np.zeros_like(error), where=denominator > 0)
+    return {
+        'mae': float(np.abs(error).mean()),
+        'rmse': float(np.sqrt((error ** 2).mean())),
+        'smape_pct': float(100 * smape.mean()),
+        'coverage_pct': float(100 * ((actual >= lower) & (actual <= upper)).mean()),
+    }
+
+
+def to_arrays(forecast: pd.DataFrame, columns: List[str], days: pd.DatetimeIndex) -> List[np.ndarray]:
+    """A long forecast on the held-out days as (series, horizon) arrays, NaN where a series has none"""
+    wide = forecast.pivot(index='ds', columns='series', values=['yhat', 'yhat_lower', 'yhat_upper']).reindex(days)
+    return [wide[name].reindex(columns=columns).to_numpy().T for name in ['yhat', 'yhat_lower', 'yhat_upper']]
+
+
+def run_baseline(train: pd.DataFrame, days: pd.DatetimeIndex, method: str) -> List[np.ndarray]:
+    # Series that ended before the origin get no forecast; the rest forecast from the origin.
+    columns = list(train.columns)
+    builder = BaselineModelBuilder(train.loc[:, train.iloc[-1].notna()], method=method, interval_width=INTERVAL_WIDTH)
+    return to_arrays(builder.forecast(len(days)), columns, days)
+
+
+def run_prophet(train: pd.DataFrame, days: pd.DatetimeIndex) -> List[np.ndarray]:
+    from utils.prophets import ProphetModelBuilder
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+    forecasts = []
+    for column in train.columns[train.iloc[-1].notna()]:
+        history = train[[column]].loc[train[column].first_valid_index():].fillna(0.0)
+        builder = ProphetModelBuilder(data=history, target_column=column, weekly_seasonality=True)
+        forecasts.append(builder.forecast(len(days)).tail(len(days)).assign(series=column))
+    return to_arrays(pd.concat(forecasts), list(train.columns), days)
+
+
+def backtest(wide: pd.DataFrame, horizon: int, folds: int, methods: List[str]) -> pd.DataFrame:
+    """Mean score and total wall time per method over the rolling origins"""
+    origins = [len(wide) - horizon * (fold + 1) for fold in reversed(range(folds))]
+    if origins[0] < 2 * 7:
+        raise ValueError(f"Not enough history for {folds} folds of {horizon} days in {len(wide)} days; lower --horizon or --folds")
+
+    rows = []
+    for method in methods:
+        scores, seconds = [], 0.0
+        for origin in origins:
+            train, held_out = wide.iloc[:origin], wide.iloc[origin:origin + horizon]
+            actual = held_out.to_numpy().T
+            start = time.perf_counter()
+            if method == 'prophet':
+                yhat, lower, upper = run_prophet(train, held_out.index)
+            else:
+                yhat, lower, upper = run_baseline(train, held_out.index, method)
+            seconds += time.perf_counter() - start
+            scores.append(score(actual, yhat, lower, upper))
+        rows.append({'method': method, **pd.DataFrame(scores).mean().to_dict(), 'seconds': seconds})
+    return pd.DataFrame(rows).set_index('method')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare baseline forecasters with Prophet on held-out days')
+    parser.add_argument('--source', choices=['db', 'csv'], default='db', help='Read mrr_daily series or daily invoice totals from the CSV')
+    parser.add_argument('--series', nargs='+', choices=SERIES_TYPES, default=['currency'], help='Series types read from mrr_daily')
+    parser.add_argument('--horizon', type=int, default=30, help='Days held out per fold')
+    parser.add_argument('--folds', type=int, default=3, help='Rolling origins')
+    parser.add_argument('--methods', nargs='+', choices=BASELINE_METHODS + ['prophet'], default=BASELINE_METHODS + ['prophet'])
+    args = parser.parse_args()
+
+    wide = load_csv_series() if args.source == 'csv' else load_database_series(args.series)
+    print(f"{wide.shape[1]} series x {wide.shape[0]} days, {args.folds} folds of {args.horizon} days")
+
+    methods = args.methods
+    if 'prophet' in methods:
+        try:
+            import prophet  # noqa: F401
+        except ImportError:
+            print("prophet is not installed, skipping it")
+            methods = [m for m in methods if m != 'prophet']
+
+    results = backtest(wide, args.horizon, args.folds, methods)
+    print(results.round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
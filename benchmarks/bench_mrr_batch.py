@@ -0,0 +1,71 @@
+"""
+Compare the batch MRR query against the per-customer loop it replaces.
+
+Usage (inside the python container, after loading data):
+    python benchmarks/bench_mrr_batch.py --customers 200 --start-date 2024-01-01 --end-date 2025-12-31
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from calculate_mrr import execute_batch_mrr_query, execute_mrr_query, get_as_of_dates
+from utils.database import get_database_connection
+
+
+def sample_customer_ids(engine, limit: int) -> list:
+    with engine.connect() as conn:
+        result = conn.execute(
+            text("SELECT DISTINCT customer_id FROM invoices ORDER BY customer_id LIMIT :limit"),
+            {'limit': limit}
+        )
+        return [row[0] for row in result]
+
+
+def bench_loop(engine, customer_ids: list, as_of_dates: list) -> float:
+    start = time.perf_counter()
+    for customer_id in customer_ids:
+        for as_of_date in as_of_dates:
+            execute_mrr_query(engine, customer_id, datetime.combine(as_of_date, datetime.min.time()))
+    return time.perf_counter() - start
+
+
+def bench_batch(engine, customer_ids: list, as_of_dates: list) -> float:
+    start = time.perf_counter()
+    execute_batch_mrr_query(engine, customer_ids, as_of_dates)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark batch MRR against the per-customer loop')
+    parser.add_argument('--customers', type=int, default=100, help='Number of customers to sample')
+    parser.add_argument('--start-date', default='2024-01-01', help='First as-of date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', default='2025-12-31', help='Last as-of date (YYYY-MM-DD)')
+    parser.add_argument('--frequency', default='month-end', help='Spacing of as-of dates')
+    args = parser.parse_args()
+
+    engine = get_database_connection()
+    customer_ids = sample_customer_ids(engine, args.customers)
+    as_of_dates = get_as_of_dates(
+        datetime.strptime(args.start_date, '%Y-%m-%d'),
+        datetime.strptime(args.end_date, '%Y-%m-%d'),
+        args.frequency
+    )
+    pairs = len(customer_ids) * len(as_of_dates)
+
+    loop_seconds = bench_loop(engine, customer_ids, as_of_dates)
+    batch_seconds = bench_batch(engine, customer_ids, as_of_dates)
+
+    print(f"{len(customer_ids)} customers x {len(as_of_dates)} as-of dates = {pairs} pairs")
+    print(f"per-customer loop: {loop_seconds:8.3f}s ({pairs / loop_seconds:,.0f} pairs/sec)")
+    print(f"batch query:       {batch_seconds:8.3f}s ({pairs / batch_seconds:,.0f} pairs/sec)")
+    print(f"speed-up:          {loop_seconds / batch_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
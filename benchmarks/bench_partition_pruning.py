@@ -0,0 +1,160 @@
+"""
+Compare last-N-weeks report cost on a flat and a month-partitioned invoices table.
+
+Builds two scratch schemas holding the same synthetic invoices, one plain and one
+range-partitioned by created_at, with the production indexes, then runs the
+weekly metrics and biggest-customer queries unchanged against each through the
+search_path.
+
+Usage (inside the python container):
+    python benchmarks/bench_partition_pruning.py --rows 10000000 --months 36 --weeks 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from calculate_biggest_customer import get_biggest_customers_query
+from calculate_churn import get_weekly_metrics_query
+from utils.database import get_database_connection
+from utils.indexes import INVOICE_INDEXES, get_create_index_queries
+from utils.partitions import add_months, ensure_partitions, get_default_partition_name, get_recent_weeks_start, month_start
+
+SCHEMAS = ['bench_flat', 'bench_partitioned']
+
+TABLE_DDL = """
+    CREATE TABLE invoices (
+        invoice_id VARCHAR(50),
+        customer_id VARCHAR(50),
+        subscription_id VARCHAR(50),
+        currency CHAR(3),
+        total NUMERIC(15,2),
+        created_at TIMESTAMPTZ NOT NULL,
+        period_start TIMESTAMPTZ,
+        period_end TIMESTAMPTZ,
+        max_line_item_period_end TIMESTAMPTZ,
+        is_forgiven BOOLEAN,
+        PRIMARY KEY (invoice_id, created_at)
+    ) {partition_clause}
+"""
+
+INSERT_ROWS = """
+    INSERT INTO invoices
+    SELECT
+        'in_' || g,
+        'cus_' || (g % :customers),
+        'sub_' || (g % (:customers * 2)),
+        CASE WHEN g % 3 = 0 THEN 'usd' ELSE 'eur' END,
+        (g % 500) + 0.99,
+        ts,
+        ts,
+        ts + INTERVAL '1 month',
+        ts + INTERVAL '1 month',
+        g % 50 = 0
+    FROM generate_series(1, :rows) as g
+    CROSS JOIN LATERAL (
+        SELECT CAST(:first_day AS TIMESTAMPTZ) + make_interval(secs => (g - 1) * :seconds_per_row) as ts
+    ) t
+"""
+
+
+def build_schema(engine, schema: str, rows: int, months: int, customers: int) -> float:
+    partitioned = schema == 'bench_partitioned'
+    last_month = month_start(date.today())
+    first_month = add_months(last_month, -(months - 1))
+    span_seconds = (add_months(last_month, 1) - first_month).total_seconds()
+
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+        conn.execute(text(f"SET LOCAL search_path TO {schema}"))
+        conn.execute(text(TABLE_DDL.format(partition_clause="PARTITION BY RANGE (created_at)" if partitioned else "")))
+        if partitioned:
+            conn.execute(text(f"CREATE TABLE {get_default_partition_name('invoices')} PARTITION OF invoices DEFAULT"))
+            ensure_partitions(conn, 'invoices', first_month, last_month)
+        conn.execute(text(INSERT_ROWS), {
+            'rows': rows,
+            'customers': customers,
+            'first_day': first_month,
+            'seconds_per_row': span_seconds / rows,
+        })
+        for query in get_create_index_queries(INVOICE_INDEXES):
+            conn.execute(text(query))
+        conn.commit()
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text(f"VACUUM (ANALYZE) {schema}.invoices"))
+    return time.perf_counter() - start
+
+
+def explain(engine, schema: str, sql: str, params: dict) -> dict:
+    with engine.connect() as conn:
+        conn.execute(text(f"SET LOCAL search_path TO {schema}"))
+        result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params).scalar()
+        conn.rollback()
+    plan = (result if isinstance(result, list) else json.loads(result))[0]
+
+    nodes, stack = [], [plan['Plan']]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get('Plans', []))
+    root = plan['Plan']
+    return {
+        'execution_ms': plan['Execution Time'],
+        'shared_blocks': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'relations_scanned': len({n['Relation Name'] for n in nodes if 'Relation Name' in n}),
+    }
+
+
+def recent_weeks_start(engine, schema: str, weeks: int):
+    with engine.connect() as conn:
+        conn.execute(text(f"SET LOCAL search_path TO {schema}"))
+        return get_recent_weeks_start(conn, weeks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark partition pruning for last-N-weeks reports')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Synthetic invoices per table')
+    parser.add_argument('--months', type=int, default=36, help='Months of history the invoices span')
+    parser.add_argument('--customers', type=int, default=50_000, help='Distinct customers')
+    parser.add_argument('--weeks', type=int, default=4, help='Size of the recent window in weeks')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch schemas after the run')
+    args = parser.parse_args()
+
+    engine = get_database_connection()
+    for schema in SCHEMAS:
+        elapsed = build_schema(engine, schema, args.rows, args.months, args.customers)
+        print(f"Built {schema} with {args.rows:,} rows in {elapsed:.1f}s")
+
+    queries = {
+        'weekly_metrics': get_weekly_metrics_query,
+        'biggest_customers': get_biggest_customers_query,
+    }
+    print(f"{'query':34} {'schema':18} {'ms':>10} {'blocks':>10} {'relations':>10}")
+    for name, build_query in queries.items():
+        for schema in SCHEMAS:
+            since = recent_weeks_start(engine, schema, args.weeks)
+            scenarios = {
+                f"{name} (last {args.weeks} weeks)": (build_query("AND created_at >= :since"), {'since': since}),
+                f"{name} (all history)": (build_query(), {}),
+            }
+            for label, (sql, params) in scenarios.items():
+                stats = explain(engine, schema, sql, params)
+                print(f"{label:34} {schema:18} {stats['execution_ms']:10.1f} {stats['shared_blocks']:10} {stats['relations_scanned']:10}")
+
+    if not args.keep:
+        with engine.connect() as conn:
+            for schema in SCHEMAS:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
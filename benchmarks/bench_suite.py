@@ -0,0 +1,166 @@
+"""
+Time the pipeline end to end on seeded synthetic data and keep the results.
+
+Generates the data set if it is missing, optionally resets the database, then
+runs ingestion, the FX and mrr_daily refreshes, batch MRR, churn, biggest
+customer and forecasting as the real scripts, each in its own process. Every
+run appends one JSON line to output/benchmarks/results.jsonl with the commit,
+data size and seed, the wall-clock seconds of each step and the stage
+breakdown of its run report, and prints the change against the previous run
+of the same size and seed, so regressions show up between commits.
+
+Run against a scratch database only: --reset drops every table.
+
+Usage (inside the python container):
+    python benchmarks/bench_suite.py --invoices 1000000 --seed 42 --reset
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from generate_data import EXPORT_DATE, generate
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+BENCHMARKS_DIR = os.path.join(ROOT, 'output', 'benchmarks')
+RESULTS_FILE = os.path.join(BENCHMARKS_DIR, 'results.jsonl')
+
+# Months of month-end as-of dates the batch MRR step covers, ending at the export date.
+MRR_MONTHS = 12
+
+
+def get_steps(forecast_model: str) -> List[Tuple[str, List[str], bool]]:
+    """Name, command line and whether the script writes a run report, in pipeline order"""
+    export_date = EXPORT_DATE.astype(datetime)
+    start_date = f"{export_date.year - MRR_MONTHS // 12:04d}-{export_date.month:02d}-01"
+    return [
+        ('ingestion', ['src/run_ingestion.py'], True),
+        ('fx_rates', ['src/update_fx_rates.py', '--no-refresh'], True),
+        ('mrr_daily', ['src/refresh_mrr_daily.py', '--full'], True),
+        ('mrr_batch', [
+            'src/calculate_mrr.py', '--all-customers', '--start-date', start_date,
+            '--end-date', export_date.strftime('%Y-%m-%d'),
+            '--output-dir', os.path.join(BENCHMARKS_DIR, 'output'),
+        ], True),
+        ('churn', ['src/calculate_churn.py'], True),
+        ('biggest_customer', ['src/calculate_biggest_customer.py'], True),
+        ('forecast', ['src/forecast_mrr.py', '--model', forecast_model, '--no-model-store'], True),
+    ]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def read_run_report(report_dir: str, script: str) -> Optional[dict]:
+    paths = sorted(glob.glob(os.path.join(report_dir, f"{script}_*.json")), key=os.path.getmtime)
+    if not paths:
+        return None
+    with open(paths[-1]) as f:
+        return json.load(f)
+
+
+def run_step(name: str, argv: List[str], instrumented: bool, env: dict, report_dir: str) -> dict:
+    """Run one script to completion, returning its seconds, exit code and run report summary"""
+    script = os.path.splitext(os.path.basename(argv[0]))[0]
+    command = [sys.executable] + argv + (['--report-dir', report_dir] if instrumented else [])
+    print(f"[{name}] {' '.join(argv)}", flush=True)
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=ROOT, env=env)
+    result = {'seconds': round(time.perf_counter() - start, 3), 'returncode': process.returncode}
+    report = read_run_report(report_dir, script) if instrumented else None
+    if report is not None:
+        result['queries'] = report['queries']
+        result['status'] = report['status']
+        result['stages'] = {stage: round(values['seconds'], 3) for stage, values in report['stages'].items()}
+    return result
+
+
+def previous_result(invoices: int, seed: int) -> Optional[dict]:
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            result = json.loads(line)
+            if result['invoices'] == invoices and result['seed'] == seed:
+                previous = result
+    return previous
+
+
+def print_comparison(result: dict, previous: Optional[dict]) -> None:
+    baseline = previous['steps'] if previous else {}
+    print(f"\n{'step':<18}{'seconds':>10}{'previous':>10}{'change':>9}")
+    for name, step in result['steps'].items():
+        before = baseline.get(name, {}).get('seconds')
+        change = f"{(step['seconds'] - before) / before:+.1%}" if before else ''
+        print(f"{name:<18}{step['seconds']:>10.2f}{before if before is not None else '':>10}{change:>9}")
+    if previous:
+        print(f"compared with {previous['commit']} at {previous['started_at']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time the pipeline end to end on synthetic data and record the results')
+    parser.add_argument('--invoices', type=int, default=100_000, help='Invoices in the generated data set')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated data set')
+    parser.add_argument('--data-dir', help='Existing or target directory of the data set (default output/benchmarks/data/<invoices>_<seed>)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes generating the data set')
+    parser.add_argument('--reset', action='store_true', help='Drop all tables and rerun the migrations first (scratch databases only)')
+    parser.add_argument('--steps', nargs='+', help='Only run these steps, in pipeline order')
+    parser.add_argument('--forecast-model', default='holt_winters', help='Model passed to forecast_mrr.py')
+    args = parser.parse_args()
+
+    steps = get_steps(args.forecast_model)
+    if args.steps:
+        unknown = set(args.steps) - {name for name, _, _ in steps}
+        if unknown:
+            parser.error(f"unknown steps: {', '.join(sorted(unknown))}")
+        steps = [step for step in steps if step[0] in args.steps]
+
+    data_dir = args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', f"{args.invoices}_{args.seed}")
+    if not os.path.exists(os.path.join(data_dir, 'invoices.csv')):
+        print(f"Generating {args.invoices:,} invoices with seed {args.seed} in {data_dir}")
+        generate(args.invoices, args.seed, data_dir, args.workers)
+
+    started_at = datetime.now(timezone.utc)
+    report_dir = os.path.join(BENCHMARKS_DIR, 'run_reports', started_at.strftime('%Y%m%dT%H%M%S'))
+    env = {**os.environ, 'DATA_DIR': os.path.abspath(data_dir), 'PYTHONPATH': ROOT}
+
+    result = {
+        'started_at': started_at.isoformat(),
+        'commit': get_commit(),
+        'invoices': args.invoices,
+        'seed': args.seed,
+        'reset': args.reset,
+        'steps': {},
+    }
+    if args.reset:
+        steps.insert(0, ('reset', ['setup/setup_db.py', '--reset'], False))
+
+    for name, argv, instrumented in steps:
+        step = result['steps'][name] = run_step(name, argv, instrumented, env, report_dir)
+        # The scripts report their own errors and exit normally, so trust the run report where there is one.
+        if step['returncode'] != 0 or step.get('status') == 'failed':
+            print(f"Error: step {name} failed, stopping")
+            break
+
+    previous = previous_result(args.invoices, args.seed)
+    os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    print_comparison(result, previous)
+    print(f"Results appended to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
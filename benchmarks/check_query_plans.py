@@ -0,0 +1,166 @@
+"""
+Query-plan regression check for the calculator queries.
+
+Runs EXPLAIN (ANALYZE, BUFFERS) on each known query and fails when a query
+that should be served by an index sequentially scans invoices, or when its
+shared buffer reads grow beyond the recorded baseline.
+
+Usage (inside the python container, after migrating and loading data):
+    python benchmarks/check_query_plans.py --update-baseline
+    python benchmarks/check_query_plans.py
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime
+from typing import Dict, List
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from calculate_biggest_customer import get_biggest_customers_query
+from calculate_churn import get_weekly_metrics_query
+from calculate_mrr import get_as_of_dates, get_batch_mrr_query, get_mrr_query
+from calculate_subscription_churn import get_subscription_invoices_query
+from utils.database import get_database_connection
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_plan_baseline.json')
+
+WATCHED_TABLES = {'invoices'}
+
+
+def sample_parameters(conn) -> Dict:
+    customer_ids = [row[0] for row in conn.execute(text(
+        "SELECT DISTINCT customer_id FROM invoices ORDER BY customer_id LIMIT 50"
+    ))]
+    last_period = conn.execute(text("SELECT MAX(period_start) FROM invoices")).scalar()
+    last_period = last_period.replace(tzinfo=None) if last_period else datetime.now()
+    return {
+        'customer_id': customer_ids[0] if customer_ids else None,
+        'customer_ids': customer_ids,
+        'as_of_date': last_period,
+        'as_of_dates': get_as_of_dates(datetime(last_period.year - 1, 1, 1), last_period),
+    }
+
+
+def get_known_queries(params: Dict) -> Dict[str, Dict]:
+    """
+    Queries under test. index_only marks the ones with a selective access path;
+    the weekly reports and the full subscription invoice export read all of
+    history, so only their buffers are checked.
+    """
+    return {
+        'mrr': {
+            'sql': get_mrr_query(),
+            'params': {'customer_id': params['customer_id'], 'as_of_date': params['as_of_date']},
+            'index_only': True,
+        },
+        'batch_mrr': {
+            'sql': get_batch_mrr_query(),
+            'params': {'customer_ids': params['customer_ids'], 'as_of_dates': params['as_of_dates']},
+            'index_only': True,
+        },
+        'subscription_invoices': {
+            'sql': get_subscription_invoices_query(),
+            'params': {},
+            'index_only': False,
+        },
+        'weekly_metrics': {
+            'sql': get_weekly_metrics_query(),
+            'params': {},
+            'index_only': False,
+        },
+        'biggest_customers': {
+            'sql': get_biggest_customers_query(),
+            'params': {},
+            'index_only': False,
+        },
+    }
+
+
+def explain(conn, sql: str, params: Dict) -> Dict:
+    result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]
+
+
+def walk(node: Dict) -> List[Dict]:
+    nodes = [node]
+    for child in node.get('Plans', []):
+        nodes.extend(walk(child))
+    return nodes
+
+
+def is_watched(relation: str) -> bool:
+    """Match the watched tables and, when they are partitioned, their partitions"""
+    return any(relation == table or relation.startswith(f"{table}_") for table in WATCHED_TABLES)
+
+
+def summarize(plan: Dict) -> Dict:
+    root = plan['Plan']
+    nodes = walk(root)
+    return {
+        'execution_ms': round(plan['Execution Time'], 3),
+        'shared_blocks': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'seq_scans': sorted({
+            n['Relation Name'] for n in nodes
+            if n['Node Type'] == 'Seq Scan' and is_watched(n.get('Relation Name', ''))
+        }),
+        'scans': sorted({
+            f"{n['Node Type']} on {n.get('Index Name') or n['Relation Name']}"
+            for n in nodes if 'Relation Name' in n
+        }),
+    }
+
+
+def check(summary: Dict, query: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    failures = []
+    if query['index_only'] and summary['seq_scans']:
+        failures.append(f"sequential scan on {', '.join(summary['seq_scans'])}")
+    if baseline:
+        limit = baseline['shared_blocks'] * (1 + tolerance)
+        if summary['shared_blocks'] > limit:
+            failures.append(
+                f"shared buffers {summary['shared_blocks']} exceed baseline {baseline['shared_blocks']} (+{tolerance:.0%})"
+            )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fail when calculator query plans regress')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the recorded buffer counts')
+    parser.add_argument('--update-baseline', action='store_true', help='Record the current plans as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative growth in shared buffers')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    engine = get_database_connection()
+    results = {}
+    failed = False
+    with engine.connect() as conn:
+        for name, query in get_known_queries(sample_parameters(conn)).items():
+            summary = summarize(explain(conn, query['sql'], query['params']))
+            failures = check(summary, query, baseline.get(name), args.tolerance)
+            failed = failed or bool(failures)
+            results[name] = summary
+            status = 'FAIL' if failures else 'ok'
+            print(f"{status:4} {name:24} {summary['execution_ms']:10.2f} ms {summary['shared_blocks']:10} blocks  {'; '.join(summary['scans'])}")
+            for failure in failures:
+                print(f"     {failure}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({**results, '_recorded_at': date.today().isoformat()}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Seeded synthetic Stripe-like export for benchmarks.
+
+Writes customers.csv and invoices.csv in the exact layout of the files in data/:
+the same headers in the same order, comma decimals, '%Y-%m-%d %H:%M' UTC dates,
+TRUE/FALSE flags, and a realistic mix of currencies, statuses (drafts, open,
+void, uncollectible and forgiven invoices), coupons, credit balances and
+one-off invoices without a subscription. Payments and subscriptions are
+derived from the invoices by the loaders, as for the real export.
+
+Each subscription is billed monthly, or yearly for ANNUAL_SHARE of them, from
+its start until it churns or the export date, so MRR, churn and cohort figures
+behave like real data. As in the real export, each invoice is dated at a billing
+cycle boundary: its period is the cycle just ended (zero-length at sign-up for the
+first invoice) and its line items bill the cycle just started. The same
+--invoices and --seed always produce byte-identical files; invoices are generated
+in chunks by a process pool, so 50M rows need no more memory than a few chunks.
+
+Usage:
+    python benchmarks/generate_data.py --invoices 1000000 --seed 42 --output-dir output/benchmarks/data/1m
+    DATA_DIR=output/benchmarks/data/1m python src/run_ingestion.py
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Invoices generated per chunk. Each chunk draws from its own seeded stream, so
+# changing this changes the output.
+CHUNK_ROWS = 200_000
+
+EXPORT_DATE = np.datetime64('2025-02-27T10:00', 'm')
+HISTORY_MONTHS = 36
+
+INVOICES_PER_SUBSCRIPTION = 10
+SUBSCRIPTIONS_PER_CUSTOMER = 1.2
+# Share of customers that signed up but never subscribed, as in the real export.
+INACTIVE_CUSTOMER_SHARE = 0.5
+# Share of subscriptions billed for twelve months at a time.
+ANNUAL_SHARE = 0.2
+
+CURRENCIES = {'eur': 0.55, 'usd': 0.40, 'gbp': 0.05}
+PLAN_PRICES = np.array([9.0, 15.0, 22.5, 29.0, 49.0, 99.0, 199.0, 499.0])
+PLAN_WEIGHTS = np.array([0.10, 0.18, 0.22, 0.18, 0.14, 0.10, 0.06, 0.02])
+TAX_PERCENTS = np.array([0, 19, 20, 21, 23, 27])
+COUPONS = np.array(['JWSURFE5', 'XFSURFE5', 'LETSSURFEAGAIN', 'Jan20', 'VIVIEN20'])
+
+# Status of the invoices of a live period; older periods are all settled.
+STATUSES = {'paid': 0.962, 'open': 0.028, 'void': 0.005, 'draft': 0.004, 'uncollectible': 0.001}
+ONE_OFF_SHARE = 0.005
+COUPON_SHARE = 0.03
+CREDIT_SHARE = 0.02
+
+CUSTOMER_COLUMNS = ['id', 'Created (UTC)', 'Total Spend', 'Payment Count', 'Tax Location Recognized']
+
+INVOICE_COLUMNS = [
+    'id', 'Amount Due', 'Closed', 'Currency', 'Customer', 'Date (UTC)', 'Due Date (UTC)', 'Ending Balance',
+    'Forgiven', 'Paid', 'Paid At (UTC)', 'Marked Uncollectible At (UTC)', 'Voided At (UTC)', 'Finalized At (UTC)',
+    'Minimum Line Item Period Start (UTC)', 'Maximum Line Item Period End (UTC)', 'Period Start (UTC)',
+    'Period End (UTC)', 'Starting Balance', 'Subscription', 'Subtotal', 'Total Discount Amount',
+    'Applied Coupons', 'Tax', 'Tax Percent', 'Total', 'Amount Paid', 'Status', 'Exclusive Tax Amount',
+    'Inclusive Tax Amount',
+]
+
+ALPHABET = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+ID_MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9]
+MINUTES_PER_MONTH = 43_830
+
+
+def id_salt(seed: int, kind: int) -> int:
+    """Offset keeping the numbers of different id kinds and seeds far apart"""
+    return (kind << 56) + seed * 1_000_003
+
+
+def stripe_ids(prefix: str, numbers: np.ndarray, salt: int, length: int) -> np.ndarray:
+    """
+    Unique Stripe-looking ids in base 62.
+
+    The first ten digits scramble each number with an odd multiplier, a bijection
+    modulo 2**64, so ids never collide; later digits come from other multipliers.
+    """
+    numbers = numbers.astype(np.uint64) + np.uint64(salt)
+    digits = np.empty((len(numbers), length), dtype=ALPHABET.dtype)
+    for position in range(length):
+        if position % 10 == 0:
+            value = numbers * np.uint64(ID_MULTIPLIERS[position // 10])
+        digits[:, position] = ALPHABET[(value % np.uint64(62)).astype(np.int64)]
+        value //= np.uint64(62)
+    return np.char.add(prefix, digits.view(f'<U{length}').ravel())
+
+
+def format_dates(minutes: np.ndarray) -> np.ndarray:
+    """Minutes since the epoch as '%Y-%m-%d %H:%M', '' where missing (-1)"""
+    text = np.char.replace(np.datetime_as_string(minutes.astype('datetime64[m]'), unit='m'), 'T', ' ')
+    return np.where(minutes >= 0, text, '')
+
+
+def format_flags(flags: np.ndarray) -> np.ndarray:
+    return np.where(flags, 'TRUE', 'FALSE')
+
+
+class Population:
+    """Customers and their subscriptions, whose monthly billing runs add up to n_invoices"""
+
+    def __init__(self, n_invoices: int, seed: int) -> None:
+        rng = np.random.default_rng([seed, 0])
+        export = EXPORT_DATE.astype(np.int64)
+        history = HISTORY_MONTHS * MINUTES_PER_MONTH
+
+        # Draw subscriptions until their billing runs cover n_invoices, then keep
+        # just enough of them and shorten the last run to hit the count exactly.
+        pool = max(16, 2 * n_invoices // INVOICES_PER_SUBSCRIPTION)
+        while True:
+            # Sign-ups grow over time: the square root skews starts towards the export.
+            start = export - (history * (1 - np.sqrt(rng.random(pool)))).astype(np.int64)
+            months_left = (export - start) // MINUTES_PER_MONTH + 1
+            months = np.where(rng.random(pool) < ANNUAL_SHARE, 12, 1)
+            # Geometric lifetimes, about 6% monthly churn, cut off at the export date;
+            # annual subscriptions are invoiced once per started year.
+            lifetime = (np.minimum(rng.geometric(0.06, pool), months_left) - 1) // months + 1
+            if lifetime.sum() >= n_invoices:
+                break
+            pool *= 2
+        cumulative = np.cumsum(lifetime)
+        n_subscriptions = int(np.searchsorted(cumulative, n_invoices)) + 1
+        start, months, lifetime = start[:n_subscriptions], months[:n_subscriptions], lifetime[:n_subscriptions].copy()
+        lifetime[-1] -= cumulative[n_subscriptions - 1] - n_invoices
+
+        n_active = max(1, int(n_subscriptions / SUBSCRIPTIONS_PER_CUSTOMER))
+        n_inactive = int(n_active * INACTIVE_CUSTOMER_SHARE / (1 - INACTIVE_CUSTOMER_SHARE))
+        customer = rng.integers(0, n_active, n_subscriptions)
+        created = export - (history * (1 - np.sqrt(rng.random(n_active + n_inactive)))).astype(np.int64)
+        # Customers sign up shortly before their first subscription starts.
+        first_start = np.full(n_active + n_inactive, export)
+        np.minimum.at(first_start, customer, start - rng.integers(1, 7 * 24 * 60, n_subscriptions))
+        subscribed = first_start < export
+        created[subscribed] = first_start[subscribed]
+
+        self.n_invoices = n_invoices
+        self.n_customers = n_active + n_inactive
+        self.customer_ids = stripe_ids('cus_', np.arange(self.n_customers), id_salt(seed, 1), 14)
+        self.customer_created = created
+        self.customer_currency = rng.choice(list(CURRENCIES), self.n_customers, p=list(CURRENCIES.values()))
+        self.customer_tax_recognized = rng.random(self.n_customers) < 0.3
+
+        self.subscription_ids = stripe_ids('sub_1', np.arange(n_subscriptions), id_salt(seed, 2), 23)
+        self.subscription_customer = customer
+        self.subscription_start = start
+        self.subscription_months = months
+        self.subscription_first_invoice = np.concatenate([[0], np.cumsum(lifetime)[:-1]])
+        self.subscription_price = rng.choice(PLAN_PRICES, n_subscriptions, p=PLAN_WEIGHTS) * rng.integers(1, 4, n_subscriptions) * months
+        self.subscription_tax = rng.choice(TAX_PERCENTS, n_subscriptions)
+
+    def customers_frame(self, spend: np.ndarray, payments: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({
+            'id': self.customer_ids,
+            'Created (UTC)': format_dates(self.customer_created),
+            'Total Spend': spend,
+            'Payment Count': payments,
+            'Tax Location Recognized': format_flags(self.customer_tax_recognized),
+        }, columns=CUSTOMER_COLUMNS)
+
+
+def invoice_chunk(population: Population, first: int, last: int, seed: int) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Invoices first..last-1 of the billing runs.
+
+    Returns:
+        tuple: The chunk in export layout, and each invoice's customer index and amount paid.
+    """
+    rng = np.random.default_rng([seed, 1, first])
+    n = last - first
+    index = np.arange(first, last)
+    subscription = np.searchsorted(population.subscription_first_invoice, index, side='right') - 1
+    period = index - population.subscription_first_invoice[subscription]
+    customer = population.subscription_customer[subscription]
+    export = EXPORT_DATE.astype(np.int64)
+
+    length = population.subscription_months[subscription] * MINUTES_PER_MONTH
+    # Each invoice closes the cycle ending at its boundary and its line items bill
+    # the next one; the first invoice's own period is zero-length.
+    boundary = population.subscription_start[subscription] + period * length
+    line_item_end = boundary + length
+    period_start = np.where(period == 0, boundary, boundary - length)
+    created = np.minimum(boundary + rng.integers(0, 2, n), export)
+    is_current = line_item_end > export
+
+    status = np.full(n, 'paid', dtype='<U13')
+    statuses = rng.choice(list(STATUSES), n, p=list(STATUSES.values()))
+    status[is_current] = statuses[is_current]
+    # A few settled periods were never paid.
+    settled_unpaid = ~is_current & (rng.random(n) < 0.002)
+    status[settled_unpaid] = rng.choice(['void', 'uncollectible'], int(settled_unpaid.sum()))
+
+    one_off = rng.random(n) < ONE_OFF_SHARE
+    price = population.subscription_price[subscription]
+    subtotal = np.where(one_off, np.round(rng.uniform(5, 300, n), 2), price)
+    coupon = np.where(rng.random(n) < COUPON_SHARE, rng.choice(COUPONS, n), '')
+    discount = np.where(coupon != '', np.round(subtotal * rng.choice([0.05, 0.2], n), 2), 0.0)
+    tax_percent = population.subscription_tax[subscription]
+    tax = np.round((subtotal - discount) * tax_percent / 100, 2)
+    total = subtotal - discount + tax
+
+    draft = status == 'draft'
+    paid = status == 'paid'
+    forgiven = status == 'uncollectible'
+    starting_balance = np.where(rng.random(n) < CREDIT_SHARE, -np.round(rng.uniform(1, 50, n), 2), 0.0)
+    amount_due = np.where(draft, 0.0, np.maximum(total + starting_balance, 0.0))
+    amount_paid = np.where(paid, amount_due, 0.0)
+    ending_balance = np.where(draft, np.nan, np.minimum(total + starting_balance, 0.0))
+
+    finalized = np.where(draft, -1, created + 60)
+    paid_at = np.where(paid, finalized + rng.integers(0, 3 * 24 * 60, n), -1)
+    voided_at = np.where(status == 'void', finalized + rng.integers(60, 14 * 24 * 60, n), -1)
+    uncollectible_at = np.where(forgiven, finalized + 30 * 24 * 60, -1)
+    due = np.where(draft, -1, finalized + 24 * 60)
+
+    frame = pd.DataFrame({
+        'id': stripe_ids('in_1', index, id_salt(seed, 3), 23),
+        'Amount Due': amount_due,
+        'Closed': format_flags(~draft & (status != 'open')),
+        'Currency': population.customer_currency[customer],
+        'Customer': population.customer_ids[customer],
+        'Date (UTC)': format_dates(created),
+        'Due Date (UTC)': format_dates(due),
+        'Ending Balance': ending_balance,
+        'Forgiven': format_flags(forgiven),
+        'Paid': format_flags(paid),
+        'Paid At (UTC)': format_dates(paid_at),
+        'Marked Uncollectible At (UTC)': format_dates(uncollectible_at),
+        'Voided At (UTC)': format_dates(voided_at),
+        'Finalized At (UTC)': format_dates(finalized),
+        'Minimum Line Item Period Start (UTC)': format_dates(np.where(one_off, created, boundary)),
+        'Maximum Line Item Period End (UTC)': format_dates(np.where(one_off, created, line_item_end)),
+        'Period Start (UTC)': format_dates(period_start),
+        'Period End (UTC)': format_dates(boundary),
+        'Starting Balance': starting_balance,
+        'Subscription': np.where(one_off, '', population.subscription_ids[subscription]),
+        'Subtotal': subtotal,
+        'Total Discount Amount': discount,
+        'Applied Coupons': coupon,
+        'Tax': tax,
+        'Tax Percent': tax_percent,
+        'Total': total,
+        'Amount Paid': amount_paid,
+        'Status': status,
+        'Exclusive Tax Amount': tax,
+        'Inclusive Tax Amount': np.zeros(n),
+    }, columns=INVOICE_COLUMNS)
+    return frame, customer, amount_paid
+
+
+def write_csv(frame: pd.DataFrame, f=None, header: bool = True) -> Optional[str]:
+    """Write in the export's format: two comma decimals and empty missing values"""
+    return frame.to_csv(f, index=False, header=header, decimal=',', float_format='%.2f')
+
+
+_population: Optional[Population] = None
+
+
+def _set_population(population: Population) -> None:
+    global _population
+    _population = population
+
+
+def render_chunk(first: int, last: int, seed: int) -> Tuple[str, np.ndarray, np.ndarray]:
+    """CSV text of one invoice chunk, with each invoice's customer and amount paid, in a worker process"""
+    frame, customer, amount_paid = invoice_chunk(_population, first, last, seed)
+    return write_csv(frame, header=first == 0), customer, amount_paid
+
+
+def generate(n_invoices: int, seed: int, output_dir: str, workers: int = 1) -> dict:
+    """
+    Write customers.csv and invoices.csv to output_dir.
+
+    Chunks are generated and formatted by workers processes and written in
+    order, so the files do not depend on the number of workers.
+
+    Returns:
+        dict: Rows written per file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    population = Population(n_invoices, seed)
+    spend = np.zeros(population.n_customers)
+    payments = np.zeros(population.n_customers, dtype=np.int64)
+
+    firsts = list(range(0, population.n_invoices, CHUNK_ROWS))
+    lasts = [min(first + CHUNK_ROWS, population.n_invoices) for first in firsts]
+    invoices_path = os.path.join(output_dir, 'invoices.csv')
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_population, initargs=(population,)) as pool:
+        with open(f"{invoices_path}.tmp", 'w', newline='') as f:
+            for text, customer, amount_paid in pool.map(render_chunk, firsts, lasts, [seed] * len(firsts)):
+                f.write(text)
+                spend += np.bincount(customer, weights=amount_paid, minlength=population.n_customers)
+                payments += np.bincount(customer, weights=amount_paid > 0, minlength=population.n_customers).astype(np.int64)
+    os.replace(f"{invoices_path}.tmp", invoices_path)
+
+    with open(os.path.join(output_dir, 'customers.csv'), 'w', newline='') as f:
+        write_csv(population.customers_frame(spend, payments), f)
+    return {'customers': population.n_customers, 'invoices': population.n_invoices}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Write a seeded synthetic customers and invoices export')
+    parser.add_argument('--invoices', type=int, default=10_000, help='Invoices to generate (10k to 50M)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed and size give identical files')
+    parser.add_argument('--output-dir', help='Directory for the CSV files (default output/benchmarks/data/<invoices>_<seed>)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes generating chunks')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join('output', 'benchmarks', 'data', f"{args.invoices}_{args.seed}")
+    start = time.perf_counter()
+    rows = generate(args.invoices, args.seed, output_dir, args.workers)
+    print(f"Wrote {rows['customers']:,} customers and {rows['invoices']:,} invoices to {output_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
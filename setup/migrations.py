@@ -0,0 +1,326 @@
+"""
+Ordered schema migrations, applied by setup_db.py through src/utils/migrations.py.
+
+Append new steps with the next version number; never edit or reorder a step
+that has been released, since databases record which versions they applied.
+Every step is idempotent so it can also adopt a database created before
+migrations were tracked.
+"""
+from datetime import date
+from sqlalchemy import text
+from src.utils.indexes import INVOICE_INDEXES
+from src.utils.migrations import Migration, backfill_in_batches, create_index_online
+from src.utils.partitions import (
+    PARTITIONED_TABLES, add_months, ensure_partitions, get_default_partition_name, is_partitioned, month_start
+)
+
+def create_base_tables(conn, settings: dict) -> None:
+    """
+    Create the source tables.
+
+    With settings['partitioned'], invoices and payments are range-partitioned by
+    month of created_at. Their primary keys then have to include created_at, and
+    payments can no longer reference invoices with a foreign key.
+    """
+    partitioned = settings.get('partitioned', False)
+    if partitioned:
+        invoice_key = "PRIMARY KEY (invoice_id, created_at)"
+        payment_key = "PRIMARY KEY (payment_id, created_at)"
+        payment_invoice_fk = ""
+        partition_clause = "PARTITION BY RANGE (created_at)"
+    else:
+        invoice_key = "PRIMARY KEY (invoice_id)"
+        payment_key = "PRIMARY KEY (payment_id)"
+        payment_invoice_fk = ",\n            FOREIGN KEY (invoice_id) REFERENCES invoices(invoice_id)"
+        partition_clause = ""
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id VARCHAR(50) PRIMARY KEY,
+            created_at TIMESTAMPTZ,
+            created_date DATE,
+            tax_location_recognized BOOLEAN
+        );
+        CREATE INDEX IF NOT EXISTS idx_customers_created_date ON customers (created_date);
+    """))
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id VARCHAR(50) PRIMARY KEY,
+            customer_id VARCHAR(50),
+            status VARCHAR(20),
+            created_at TIMESTAMPTZ,
+            created_date DATE,
+            current_period_start TIMESTAMPTZ,
+            current_period_end TIMESTAMPTZ,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_customer_id ON subscriptions (customer_id);
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_created_date ON subscriptions (created_date);
+    """))
+
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS invoices (
+            invoice_id VARCHAR(50),
+            customer_id VARCHAR(50),
+            subscription_id VARCHAR(50),
+            status VARCHAR(20),
+            currency CHAR(3),
+            amount_due NUMERIC(15,2),
+            subtotal NUMERIC(15,2),
+            tax NUMERIC(15,2),
+            tax_percent NUMERIC(5,2),
+            total NUMERIC(15,2),
+            amount_paid NUMERIC(15,2),
+            total_discount_amount NUMERIC(15,2),
+            exclusive_tax_amount NUMERIC(15,2),
+            inclusive_tax_amount NUMERIC(15,2),
+            starting_balance NUMERIC(15,2),
+            ending_balance NUMERIC(15,2),
+            created_at TIMESTAMPTZ,
+            created_date DATE,
+            due_date TIMESTAMPTZ,
+            paid_at TIMESTAMPTZ,
+            marked_uncollectible_at TIMESTAMPTZ,
+            voided_at TIMESTAMPTZ,
+            finalized_at TIMESTAMPTZ,
+            period_start TIMESTAMPTZ,
+            period_end TIMESTAMPTZ,
+            min_line_item_period_start TIMESTAMPTZ,
+            max_line_item_period_end TIMESTAMPTZ,
+            is_paid BOOLEAN,
+            is_closed BOOLEAN,
+            is_forgiven BOOLEAN,
+            applied_coupons TEXT,
+            {invoice_key}
+        ) {partition_clause};
+        CREATE INDEX IF NOT EXISTS idx_invoices_customer_id ON invoices (customer_id);
+        CREATE INDEX IF NOT EXISTS idx_invoices_created_date ON invoices (created_date);
+    """))
+
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id VARCHAR(50),
+            customer_id VARCHAR(50),
+            invoice_id VARCHAR(50),
+            amount NUMERIC(15,2),
+            currency CHAR(3),
+            payment_method VARCHAR(50),
+            status VARCHAR(20),
+            created_at TIMESTAMPTZ,
+            created_date DATE,
+            {payment_key},
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id){payment_invoice_fk}
+        ) {partition_clause};
+        CREATE INDEX IF NOT EXISTS idx_payments_customer_id ON payments (customer_id);
+        CREATE INDEX IF NOT EXISTS idx_payments_created_date ON payments (created_date);
+    """))
+
+    if partitioned:
+        current_month = month_start(date.today())
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(conn, table):
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {get_default_partition_name(table)} PARTITION OF {table} DEFAULT"))
+                ensure_partitions(conn, table, current_month, add_months(current_month, settings.get('months_ahead', 3)))
+
+def add_invoices_updated_at(conn, settings: dict) -> None:
+    """Track when each invoice was last rewritten, for incremental fact refreshes"""
+    # No default on ADD COLUMN: a volatile default would rewrite the whole table.
+    conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ"))
+    conn.execute(text("ALTER TABLE invoices ALTER COLUMN updated_at SET DEFAULT NOW()"))
+    backfill_in_batches(conn, 'invoices', 'invoice_id', "updated_at = NOW()", "updated_at IS NULL")
+    create_index_online(
+        conn, 'idx_invoices_updated_at', "ON invoices (updated_at)",
+        concurrently=not is_partitioned(conn, 'invoices')
+    )
+
+def create_ingestion_state_tables(conn, settings: dict) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingestion_watermarks (
+            source VARCHAR(50) PRIMARY KEY,
+            max_created_at TIMESTAMPTZ,
+            max_finalized_at TIMESTAMPTZ,
+            last_run_rows BIGINT,
+            updated_at TIMESTAMPTZ
+        );
+
+        CREATE TABLE IF NOT EXISTS ingestion_row_hashes (
+            source VARCHAR(50),
+            record_id VARCHAR(50),
+            row_hash BIGINT,
+            PRIMARY KEY (source, record_id)
+        );
+    """))
+
+def create_mrr_fact_tables(conn, settings: dict) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS mrr_daily (
+            customer_id VARCHAR(50),
+            subscription_id VARCHAR(50),
+            currency CHAR(3),
+            day DATE,
+            daily_amount NUMERIC(15,6),
+            mrr NUMERIC(15,2),
+            PRIMARY KEY (customer_id, subscription_id, currency, day)
+        );
+        CREATE INDEX IF NOT EXISTS idx_mrr_daily_day ON mrr_daily (day);
+
+        CREATE TABLE IF NOT EXISTS mrr_daily_summary (
+            day DATE,
+            currency CHAR(3),
+            daily_amount NUMERIC(15,6),
+            mrr NUMERIC(15,2),
+            active_customers INTEGER,
+            active_subscriptions INTEGER,
+            PRIMARY KEY (day, currency)
+        );
+    """))
+
+def create_subscription_churn_tables(conn, settings: dict) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS subscription_intervals (
+            subscription_id VARCHAR(50),
+            interval_start TIMESTAMPTZ,
+            customer_id VARCHAR(50),
+            currency CHAR(3),
+            interval_end TIMESTAMPTZ,
+            start_mrr NUMERIC(15,2),
+            end_mrr NUMERIC(15,2),
+            is_open BOOLEAN,
+            PRIMARY KEY (subscription_id, interval_start)
+        );
+        CREATE INDEX IF NOT EXISTS idx_subscription_intervals_currency_end ON subscription_intervals (currency, interval_end);
+        CREATE INDEX IF NOT EXISTS idx_subscription_intervals_currency_start ON subscription_intervals (currency, interval_start);
+
+        CREATE TABLE IF NOT EXISTS churn_periods (
+            period_type VARCHAR(10),
+            period_start DATE,
+            currency CHAR(3),
+            starting_mrr NUMERIC(15,2),
+            new_mrr NUMERIC(15,2),
+            expansion_mrr NUMERIC(15,2),
+            contraction_mrr NUMERIC(15,2),
+            churned_mrr NUMERIC(15,2),
+            starting_customers INTEGER,
+            churned_customers INTEGER,
+            logo_churn_rate NUMERIC(10,6),
+            gross_revenue_churn_rate NUMERIC(10,6),
+            net_revenue_churn_rate NUMERIC(10,6),
+            PRIMARY KEY (period_type, period_start, currency)
+        );
+    """))
+
+def create_invoice_access_indexes(conn, settings: dict) -> None:
+    concurrently = not is_partitioned(conn, 'invoices')
+    for name, definition in INVOICE_INDEXES.items():
+        create_index_online(conn, name, definition, concurrently=concurrently)
+    # Index-only scans need an up-to-date visibility map.
+    conn.execute(text("VACUUM (ANALYZE) invoices"))
+
+def create_ingestion_quarantine(conn, settings: dict) -> None:
+    """Rows rejected by validation during ingestion, with the rules they failed and their raw values"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingestion_quarantine (
+            quarantine_id BIGSERIAL PRIMARY KEY,
+            source VARCHAR(50),
+            record_id VARCHAR(50),
+            reasons TEXT,
+            payload JSONB,
+            quarantined_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_ingestion_quarantine_source ON ingestion_quarantine (source, quarantined_at);
+    """))
+
+def create_mrr_forecasts(conn, settings: dict) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS mrr_forecasts (
+            model VARCHAR(20),
+            series_id VARCHAR(100),
+            series_type VARCHAR(20),
+            currency CHAR(3),
+            series_key VARCHAR(50),
+            ds DATE,
+            yhat NUMERIC(15,2),
+            yhat_lower NUMERIC(15,2),
+            yhat_upper NUMERIC(15,2),
+            generated_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (model, series_id, ds)
+        );
+    """))
+
+def create_fx_tables(conn, settings: dict) -> None:
+    """Dated FX rates, their dense per-day expansion, and reporting-currency columns on the MRR facts"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            rate_date DATE,
+            currency CHAR(3),
+            per_eur NUMERIC(18,8),
+            PRIMARY KEY (currency, rate_date)
+        );
+
+        CREATE TABLE IF NOT EXISTS fx_rates_daily (
+            day DATE,
+            currency CHAR(3),
+            per_eur NUMERIC(18,8),
+            PRIMARY KEY (currency, day)
+        );
+
+        ALTER TABLE mrr_daily ADD COLUMN IF NOT EXISTS reporting_daily_amount NUMERIC(15,6);
+        ALTER TABLE mrr_daily ADD COLUMN IF NOT EXISTS reporting_mrr NUMERIC(15,2);
+        ALTER TABLE mrr_daily_summary ADD COLUMN IF NOT EXISTS reporting_daily_amount NUMERIC(15,6);
+        ALTER TABLE mrr_daily_summary ADD COLUMN IF NOT EXISTS reporting_mrr NUMERIC(15,2);
+    """))
+
+def add_mrr_daily_subscription_index(conn, settings: dict) -> None:
+    """Find the customers holding a subscription's facts, e.g. after its invoices moved customer"""
+    create_index_online(conn, 'idx_mrr_daily_subscription_id', "ON mrr_daily (subscription_id)")
+
+def create_mrr_daily_months(conn, settings: dict) -> None:
+    """When each month's mrr_daily rows last changed, for consumers that cache closed months"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS mrr_daily_months (
+            month DATE PRIMARY KEY,
+            changed_at TIMESTAMPTZ
+        );
+        INSERT INTO mrr_daily_months (month, changed_at)
+        SELECT DISTINCT DATE_TRUNC('month', day)::date, NOW()
+        FROM mrr_daily
+        ON CONFLICT (month) DO NOTHING;
+    """))
+
+def create_top_k_tables(conn, settings: dict) -> None:
+    """
+    The amount each invoice last contributed to the top-k leaderboards, so a
+    rewritten invoice's previous amount can be taken back, and the id of the
+    refresh the persisted leaderboards belong to.
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS top_k_contributions (
+            invoice_id VARCHAR(50) PRIMARY KEY,
+            customer_id VARCHAR(50),
+            currency CHAR(3),
+            day DATE,
+            amount NUMERIC(15,2)
+        );
+
+        CREATE TABLE IF NOT EXISTS top_k_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            refresh_id VARCHAR(32),
+            refreshed_at TIMESTAMPTZ
+        );
+    """))
+
+MIGRATIONS = [
+    Migration(1, 'create_base_tables', create_base_tables),
+    Migration(2, 'add_invoices_updated_at', add_invoices_updated_at, transactional=False),
+    Migration(3, 'create_ingestion_state_tables', create_ingestion_state_tables),
+    Migration(4, 'create_mrr_fact_tables', create_mrr_fact_tables),
+    Migration(5, 'create_subscription_churn_tables', create_subscription_churn_tables),
+    Migration(6, 'create_invoice_access_indexes', create_invoice_access_indexes, transactional=False),
+    Migration(7, 'create_ingestion_quarantine', create_ingestion_quarantine),
+    Migration(8, 'create_mrr_forecasts', create_mrr_forecasts),
+    Migration(9, 'create_fx_tables', create_fx_tables),
+    Migration(10, 'add_mrr_daily_subscription_index', add_mrr_daily_subscription_index, transactional=False),
+    Migration(11, 'create_mrr_daily_months', create_mrr_daily_months),
+    Migration(12, 'create_top_k_tables', create_top_k_tables),
+]
@@ -1,105 +1,89 @@
+import argparse
+from typing import Optional
 from sqlalchemy import create_engine, text
 from src.utils.database import get_database_connection
+from src.utils.indexes import INVOICE_BRIN_INDEXES
+from src.utils.migrations import MIGRATIONS_TABLE, create_index_online, run_migrations
+from src.utils.partitions import is_partitioned
+from setup.migrations import MIGRATIONS
 
-def setup_database():
+MANAGED_TABLES = [
+    'top_k_state',
+    'top_k_contributions',
+    'fx_rates_daily',
+    'fx_rates',
+    'mrr_forecasts',
+    'churn_periods',
+    'subscription_intervals',
+    'mrr_daily_summary',
+    'mrr_daily',
+    'ingestion_quarantine',
+    'ingestion_row_hashes',
+    'ingestion_watermarks',
+    'payments',
+    'invoices',
+    'subscriptions',
+    'customers',
+    MIGRATIONS_TABLE,
+]
+
+def reset_database(engine: create_engine) -> None:
+    """Drop every table the migrations manage, losing all loaded data"""
+    with engine.connect() as conn:
+        for table in MANAGED_TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
+        conn.commit()
+
+def create_brin_indexes(engine: create_engine) -> None:
+    """Optional BRIN indexes on the invoice time columns, kept outside the versioned migrations"""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        concurrently = not is_partitioned(conn, 'invoices')
+        for name, definition in INVOICE_BRIN_INDEXES.items():
+            create_index_online(conn, name, definition, concurrently=concurrently)
+
+def setup_database(
+    reset: bool = False,
+    partitioned: bool = False,
+    months_ahead: int = 3,
+    target: Optional[int] = None,
+    brin: bool = False
+):
+    """
+    Bring the schema up to date by applying the pending migrations.
+
+    Existing tables and data are kept unless reset is given. partitioned only
+    takes effect when the source tables are first created.
+    """
     try:
         engine = get_database_connection()
-        
-        with engine.connect() as conn:
-            conn.execute(text("""
-                DROP TABLE IF EXISTS payments CASCADE;
-                DROP TABLE IF EXISTS invoices CASCADE;
-                DROP TABLE IF EXISTS subscriptions CASCADE;
-                DROP TABLE IF EXISTS customers CASCADE;
-            """))
-            
-            conn.execute(text("""
-                CREATE TABLE customers (
-                    customer_id VARCHAR(50) PRIMARY KEY,
-                    created_at TIMESTAMPTZ,
-                    created_date DATE,
-                    tax_location_recognized BOOLEAN
-                );
-                CREATE INDEX idx_customers_created_date ON customers (created_date);
-            """))
-            
-            conn.execute(text("""
-                CREATE TABLE subscriptions (
-                    subscription_id VARCHAR(50) PRIMARY KEY,
-                    customer_id VARCHAR(50),
-                    status VARCHAR(20),
-                    created_at TIMESTAMPTZ,
-                    created_date DATE,
-                    current_period_start TIMESTAMPTZ,
-                    current_period_end TIMESTAMPTZ,
-                    FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-                );
-                CREATE INDEX idx_subscriptions_customer_id ON subscriptions (customer_id);
-                CREATE INDEX idx_subscriptions_created_date ON subscriptions (created_date);
-            """))
-            
-            conn.execute(text("""
-                CREATE TABLE invoices (
-                    invoice_id VARCHAR(50) PRIMARY KEY,
-                    customer_id VARCHAR(50),
-                    subscription_id VARCHAR(50),
-                    status VARCHAR(20),
-                    currency CHAR(3),
-                    amount_due NUMERIC(15,2),
-                    subtotal NUMERIC(15,2),
-                    tax NUMERIC(15,2),
-                    tax_percent NUMERIC(5,2),
-                    total NUMERIC(15,2),
-                    amount_paid NUMERIC(15,2),
-                    total_discount_amount NUMERIC(15,2),
-                    exclusive_tax_amount NUMERIC(15,2),
-                    inclusive_tax_amount NUMERIC(15,2),
-                    starting_balance NUMERIC(15,2),
-                    ending_balance NUMERIC(15,2),
-                    created_at TIMESTAMPTZ,
-                    created_date DATE,
-                    due_date TIMESTAMPTZ,
-                    paid_at TIMESTAMPTZ,
-                    marked_uncollectible_at TIMESTAMPTZ,
-                    voided_at TIMESTAMPTZ,
-                    finalized_at TIMESTAMPTZ,
-                    period_start TIMESTAMPTZ,
-                    period_end TIMESTAMPTZ,
-                    min_line_item_period_start TIMESTAMPTZ,
-                    max_line_item_period_end TIMESTAMPTZ,
-                    is_paid BOOLEAN,
-                    is_closed BOOLEAN,
-                    is_forgiven BOOLEAN,
-                    applied_coupons TEXT
-                );
-                CREATE INDEX idx_invoices_customer_id ON invoices (customer_id);
-                CREATE INDEX idx_invoices_created_date ON invoices (created_date);
-            """))
-            
-            conn.execute(text("""
-                CREATE TABLE payments (
-                    payment_id VARCHAR(50) PRIMARY KEY,
-                    customer_id VARCHAR(50),
-                    invoice_id VARCHAR(50),
-                    amount NUMERIC(15,2),
-                    currency CHAR(3),
-                    payment_method VARCHAR(50),
-                    status VARCHAR(20),
-                    created_at TIMESTAMPTZ,
-                    created_date DATE,
-                    FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-                    FOREIGN KEY (invoice_id) REFERENCES invoices(invoice_id)
-                );
-                CREATE INDEX idx_payments_customer_id ON payments (customer_id);
-                CREATE INDEX idx_payments_created_date ON payments (created_date);
-            """))
-            
-            conn.commit()
-            
-        print("Database setup completed successfully!")
-        
+
+        if reset:
+            reset_database(engine)
+
+        applied = run_migrations(
+            engine, MIGRATIONS,
+            settings={'partitioned': partitioned, 'months_ahead': months_ahead},
+            target=target
+        )
+
+        if brin:
+            create_brin_indexes(engine)
+
+        if applied:
+            print(f"Database setup completed successfully! Applied {len(applied)} migrations.")
+        else:
+            print("Database schema is already up to date.")
+
     except Exception as e:
         print(f"Error setting up database: {e}")
 
 if __name__ == "__main__":
-    setup_database() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Create or migrate the database schema')
+    parser.add_argument('--reset', action='store_true', help='Drop all tables and data before migrating')
+    parser.add_argument('--partitioned', action='store_true', help='Range-partition invoices and payments by month of created_at when they are created')
+    parser.add_argument('--months-ahead', type=int, default=3, help='Monthly partitions created ahead of the current month')
+    parser.add_argument('--target', type=int, help='Stop after this migration version')
+    parser.add_argument('--brin', action='store_true', help='Also create BRIN indexes on the invoice time columns')
+
+    args = parser.parse_args()
+    setup_database(args.reset, args.partitioned, args.months_ahead, args.target, args.brin)
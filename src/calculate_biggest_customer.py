@@ -1,26 +1,105 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 import pandas as pd
 from datetime import datetime
 from typing import Optional
+from utils.analytics import BACKENDS, DUCKDB, POSTGRES, DuckDbBackend
 from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe, format_cents, from_cents
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.fx import get_fx_join
+from utils.partitions import get_recent_weeks_start
+from utils.snapshots import SNAPSHOT_DIR, get_snapshot_date, write_snapshot
+import argparse
 
-def get_biggest_customers_query() -> str:
-    return """
+# Per-currency spend kept as int64 cents until written out.
+BIGGEST_CUSTOMERS_CENTS = ['top_eur_spend', 'top_usd_spend']
+
+def get_biggest_customers_query(created_filter: str = "") -> str:
+    return f"""
     WITH weekly_customer_spend AS (
         SELECT 
             DATE_TRUNC('week', created_at) as week,
             EXTRACT(YEAR FROM created_at) as year,
             EXTRACT(WEEK FROM created_at) as week_number,
             customer_id,
-            currency,
-            SUM(total) as total_spend
+            invoices.currency,
+            SUM(total) as total_spend,
+            SUM(total / fx.per_eur * rep.per_eur) as reporting_spend
         FROM invoices
+        {get_fx_join('invoices.currency', 'created_at::date')}
         WHERE is_forgiven = FALSE
+        {created_filter}
         GROUP BY 
             DATE_TRUNC('week', created_at),
             EXTRACT(YEAR FROM created_at),
             EXTRACT(WEEK FROM created_at),
             customer_id,
+            invoices.currency
+    ),
+    ranked_customers AS (
+        SELECT 
+            year,
+            week_number,
+            customer_id,
+            currency,
+            total_spend,
+            ROW_NUMBER() OVER (
+                PARTITION BY year, week_number, currency 
+                ORDER BY total_spend DESC
+            ) as rank
+        FROM weekly_customer_spend
+    ),
+    ranked_portfolio AS (
+        SELECT 
+            year,
+            week_number,
+            customer_id,
+            SUM(reporting_spend) as reporting_spend,
+            ROW_NUMBER() OVER (
+                PARTITION BY year, week_number 
+                ORDER BY SUM(reporting_spend) DESC
+            ) as rank
+        FROM weekly_customer_spend
+        WHERE reporting_spend IS NOT NULL
+        GROUP BY year, week_number, customer_id
+    )
+    SELECT 
+        r.year,
+        r.week_number,
+        MAX(CASE WHEN r.currency = 'eur' AND r.rank = 1 THEN r.customer_id END) as top_eur_customer,
+        MAX(CASE WHEN r.currency = 'eur' AND r.rank = 1 THEN r.total_spend END) as top_eur_spend,
+        MAX(CASE WHEN r.currency = 'usd' AND r.rank = 1 THEN r.customer_id END) as top_usd_customer,
+        MAX(CASE WHEN r.currency = 'usd' AND r.rank = 1 THEN r.total_spend END) as top_usd_spend,
+        MAX(p.customer_id) as top_customer,
+        MAX(p.reporting_spend) as top_reporting_spend
+    FROM ranked_customers r
+    LEFT JOIN ranked_portfolio p
+        ON p.year = r.year
+        AND p.week_number = r.week_number
+        AND p.rank = 1
+    GROUP BY r.year, r.week_number
+    ORDER BY r.year, r.week_number;
+    """
+
+def get_biggest_customers_facts_query(day_filter: str = "") -> str:
+    """Weekly top recurring-revenue customer per currency from the mrr_daily fact table"""
+    return f"""
+    WITH weekly_customer_spend AS (
+        SELECT 
+            EXTRACT(YEAR FROM day) as year,
+            EXTRACT(WEEK FROM day) as week_number,
+            customer_id,
+            currency,
+            SUM(daily_amount) as total_spend,
+            SUM(reporting_daily_amount) as reporting_spend
+        FROM mrr_daily
+        {day_filter}
+        GROUP BY 
+            EXTRACT(YEAR FROM day),
+            EXTRACT(WEEK FROM day),
+            customer_id,
             currency
     ),
     ranked_customers AS (
@@ -35,62 +114,168 @@ def get_biggest_customers_query() -> str:
                 ORDER BY total_spend DESC
             ) as rank
         FROM weekly_customer_spend
+    ),
+    ranked_portfolio AS (
+        SELECT 
+            year,
+            week_number,
+            customer_id,
+            SUM(reporting_spend) as reporting_spend,
+            ROW_NUMBER() OVER (
+                PARTITION BY year, week_number 
+                ORDER BY SUM(reporting_spend) DESC
+            ) as rank
+        FROM weekly_customer_spend
+        WHERE reporting_spend IS NOT NULL
+        GROUP BY year, week_number, customer_id
     )
     SELECT 
-        year,
-        week_number,
-        MAX(CASE WHEN currency = 'eur' AND rank = 1 THEN customer_id END) as top_eur_customer,
-        MAX(CASE WHEN currency = 'eur' AND rank = 1 THEN total_spend END) as top_eur_spend,
-        MAX(CASE WHEN currency = 'usd' AND rank = 1 THEN customer_id END) as top_usd_customer,
-        MAX(CASE WHEN currency = 'usd' AND rank = 1 THEN total_spend END) as top_usd_spend
-    FROM ranked_customers
-    GROUP BY year, week_number
-    ORDER BY year, week_number;
+        r.year,
+        r.week_number,
+        MAX(CASE WHEN r.currency = 'eur' AND r.rank = 1 THEN r.customer_id END) as top_eur_customer,
+        MAX(CASE WHEN r.currency = 'eur' AND r.rank = 1 THEN r.total_spend END) as top_eur_spend,
+        MAX(CASE WHEN r.currency = 'usd' AND r.rank = 1 THEN r.customer_id END) as top_usd_customer,
+        MAX(CASE WHEN r.currency = 'usd' AND r.rank = 1 THEN r.total_spend END) as top_usd_spend,
+        MAX(p.customer_id) as top_customer,
+        MAX(p.reporting_spend) as top_reporting_spend
+    FROM ranked_customers r
+    LEFT JOIN ranked_portfolio p
+        ON p.year = r.year
+        AND p.week_number = r.week_number
+        AND p.rank = 1
+    GROUP BY r.year, r.week_number
+    ORDER BY r.year, r.week_number;
     """
 
-def execute_biggest_customers_query(engine: create_engine) -> Optional[pd.DataFrame]:
+@timed('query')
+def execute_biggest_customers_query(engine: create_engine, source: str = "invoices", weeks: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """Run the biggest customers query, over all history or only the last N weeks of invoices"""
     try:
-        query = get_biggest_customers_query()
         with engine.connect() as conn:
-            result = conn.execute(text(query))
-            return pd.DataFrame(result.fetchall(), columns=result.keys())
+            params = {}
+            if weeks:
+                params['since'] = get_recent_weeks_start(conn, weeks)
+            if source == "facts":
+                query = get_biggest_customers_facts_query("WHERE day >= :since" if weeks else "")
+            else:
+                query = get_biggest_customers_query("AND created_at >= :since" if weeks else "")
+            df = fetch_dataframe(conn, query, params, cents=BIGGEST_CUSTOMERS_CENTS)
+            add_rows(len(df))
+            return df
     except Exception as e:
+        record_error(e)
         print(f"Error executing biggest customers query: {e}")
         return None
 
+@timed('query')
+def execute_biggest_customers_duckdb(backend: DuckDbBackend, weeks: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """Run the biggest customers query in-process over the Parquet snapshots"""
+    try:
+        params = {}
+        if weeks:
+            params['since'] = backend.get_recent_weeks_start(weeks)
+        df = backend.query(get_biggest_customers_query("AND created_at >= :since" if weeks else ""), params, cents=BIGGEST_CUSTOMERS_CENTS)
+        add_rows(len(df))
+        return df
+    except Exception as e:
+        record_error(e)
+        print(f"Error executing biggest customers query in DuckDB: {e}")
+        return None
+
+def format_biggest_customers(df: pd.DataFrame) -> pd.DataFrame:
+    df['week_year'] = df['year'].astype('int64').astype(str) + '-W' + df['week_number'].astype('int64').astype(str)
+    
+    df = df[[
+        'week_year',
+        'top_eur_customer',
+        'top_eur_spend',
+        'top_usd_customer',
+        'top_usd_spend',
+        'top_customer',
+        'top_reporting_spend'
+    ]]
+    
+    df['top_reporting_spend'] = df['top_reporting_spend'].astype(float).round(2)
+    return df
+
+@timed('save')
 def save_biggest_customers_to_csv(df: Optional[pd.DataFrame]) -> None:
     if df is not None:
         try:
-            df['week_year'] = df['year'].astype(str) + '-W' + df['week_number'].astype(str)
-            
-            df = df[[
-                'week_year',
-                'top_eur_customer',
-                'top_eur_spend',
-                'top_usd_customer',
-                'top_usd_spend'
-            ]]
-            
-            df['top_eur_spend'] = df['top_eur_spend'].round(2)
-            df['top_usd_spend'] = df['top_usd_spend'].round(2)
+            df = format_biggest_customers(df)
+            for column in BIGGEST_CUSTOMERS_CENTS:
+                df[column] = format_cents(df[column])
             
             date_tag = datetime.now().strftime('%Y%m%d')
             output_file = f"output/biggest_customers_{date_tag}.csv"
             
-            df.to_csv(output_file, index=False)
+            df.to_csv(output_file, index=False, float_format='%.2f')
             print(f"Biggest customers data saved to {output_file}")
         except Exception as e:
+            record_error(e)
             print(f"Error saving biggest customers data to CSV: {e}")
     else:
         print("No biggest customers data available to save.")
 
-def calculate_biggest_customers() -> None:
+@timed('save')
+def save_biggest_customers_to_parquet(df: Optional[pd.DataFrame]) -> None:
+    """Write one row per week and currency, partitioned by snapshot date and currency"""
+    if df is not None:
+        try:
+            df = format_biggest_customers(df)
+            for column in BIGGEST_CUSTOMERS_CENTS:
+                df[column] = from_cents(df[column])
+            long_df = pd.concat([
+                df[['week_year', f'top_{currency}_customer', f'top_{currency}_spend']]
+                .rename(columns={f'top_{currency}_customer': 'customer_id', f'top_{currency}_spend': 'total_spend'})
+                .assign(currency=currency)
+                for currency in ('eur', 'usd')
+            ]).dropna(subset=['customer_id'])
+            long_df['snapshot_date'] = get_snapshot_date()
+            
+            path = write_snapshot(long_df, 'biggest_customers', ['snapshot_date', 'currency'])
+            print(f"Biggest customers data saved to {path}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving biggest customers data to Parquet: {e}")
+    else:
+        print("No biggest customers data available to save.")
+
+def calculate_biggest_customers(
+    source: str = "invoices",
+    output_format: str = "csv",
+    weeks: Optional[int] = None,
+    backend: str = POSTGRES,
+    snapshot_dir: str = SNAPSHOT_DIR
+) -> None:
     try:
-        engine = get_database_connection()
-        df = execute_biggest_customers_query(engine)
-        save_biggest_customers_to_csv(df)
+        if backend == DUCKDB:
+            df = execute_biggest_customers_duckdb(DuckDbBackend(snapshot_dir), weeks)
+        else:
+            engine = get_database_connection()
+            df = execute_biggest_customers_query(engine, source, weeks)
+        if output_format == "parquet":
+            save_biggest_customers_to_parquet(df)
+        else:
+            save_biggest_customers_to_csv(df)
     except Exception as e:
+        record_error(e)
         print(f"Error calculating biggest customers: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Calculate the biggest customer per week and currency')
+    parser.add_argument('--source', choices=['invoices', 'facts'], default='invoices', help='Read raw invoices or the mrr_daily fact table')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Write a dated CSV or a Parquet snapshot')
+    parser.add_argument('--weeks', type=int, help='Only report the last N weeks (prunes partitions of a partitioned invoices table)')
+    parser.add_argument('--backend', choices=BACKENDS, default=POSTGRES, help='Query Postgres, or DuckDB in-process over the Parquet snapshots')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help='Snapshots read by the duckdb backend')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    if args.backend == DUCKDB and args.source == 'facts':
+        parser.error('the duckdb backend reads the invoice snapshots, not the mrr_daily fact table')
+    with run_report('calculate_biggest_customer', **get_instrumentation_options(args)):
+        calculate_biggest_customers(args.source, args.format, args.weeks, args.backend, args.snapshot_dir)
+
 if __name__ == "__main__":
-    calculate_biggest_customers() 
\ No newline at end of file
+    main() 
\ No newline at end of file
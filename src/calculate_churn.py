@@ -1,21 +1,36 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 import pandas as pd
 from datetime import datetime
 from typing import Optional
+from utils.analytics import BACKENDS, DUCKDB, POSTGRES, DuckDbBackend
 from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe, format_cents, from_cents
+from utils.fx import get_fx_join
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.partitions import get_recent_weeks_start
+from utils.snapshots import SNAPSHOT_DIR, get_snapshot_date, write_snapshot
+import argparse
 
-def get_weekly_metrics_query() -> str:
-    return """
+# Per-currency totals kept as int64 cents until written out.
+WEEKLY_METRICS_CENTS = ['eur_total', 'usd_total']
+
+def get_weekly_metrics_query(created_filter: str = "") -> str:
+    return f"""
     WITH weekly_metrics AS (
         SELECT 
             DATE_TRUNC('week', created_at) as week,
             EXTRACT(YEAR FROM created_at) as year,
             EXTRACT(WEEK FROM created_at) as week_number,
-            SUM(CASE WHEN currency = 'eur' THEN total ELSE 0 END) as eur_total,
-            SUM(CASE WHEN currency = 'usd' THEN total ELSE 0 END) as usd_total,
+            SUM(CASE WHEN invoices.currency = 'eur' THEN total ELSE 0 END) as eur_total,
+            SUM(CASE WHEN invoices.currency = 'usd' THEN total ELSE 0 END) as usd_total,
+            SUM(total / fx.per_eur * rep.per_eur) as reporting_total,
             COUNT(DISTINCT customer_id) as unique_customers
         FROM invoices
+        {get_fx_join('invoices.currency', 'created_at::date')}
         WHERE is_forgiven = FALSE
+        {created_filter}
         GROUP BY 
             DATE_TRUNC('week', created_at),
             EXTRACT(YEAR FROM created_at),
@@ -26,6 +41,39 @@ def get_weekly_metrics_query() -> str:
         week_number,
         eur_total,
         usd_total,
+        reporting_total,
+        unique_customers,
+        LAG(unique_customers) OVER (ORDER BY year, week_number) as prev_week_customers,
+        unique_customers - LAG(unique_customers) OVER (ORDER BY year, week_number) as customer_delta
+    FROM weekly_metrics
+    ORDER BY year, week_number;
+    """
+
+def get_weekly_metrics_facts_query(day_filter: str = "") -> str:
+    """Weekly recurring revenue and active customers from the mrr_daily fact table"""
+    return f"""
+    WITH weekly_metrics AS (
+        SELECT 
+            DATE_TRUNC('week', day) as week,
+            EXTRACT(YEAR FROM day) as year,
+            EXTRACT(WEEK FROM day) as week_number,
+            SUM(CASE WHEN currency = 'eur' THEN daily_amount ELSE 0 END) as eur_total,
+            SUM(CASE WHEN currency = 'usd' THEN daily_amount ELSE 0 END) as usd_total,
+            SUM(reporting_daily_amount) as reporting_total,
+            COUNT(DISTINCT customer_id) as unique_customers
+        FROM mrr_daily
+        {day_filter}
+        GROUP BY 
+            DATE_TRUNC('week', day),
+            EXTRACT(YEAR FROM day),
+            EXTRACT(WEEK FROM day)
+    )
+    SELECT 
+        year,
+        week_number,
+        eur_total,
+        usd_total,
+        reporting_total,
         unique_customers,
         LAG(unique_customers) OVER (ORDER BY year, week_number) as prev_week_customers,
         unique_customers - LAG(unique_customers) OVER (ORDER BY year, week_number) as customer_delta
@@ -33,43 +81,118 @@ def get_weekly_metrics_query() -> str:
     ORDER BY year, week_number;
     """
 
-def execute_weekly_metrics_query(engine: create_engine) -> Optional[pd.DataFrame]:
+@timed('query')
+def execute_weekly_metrics_query(engine: create_engine, source: str = "invoices", weeks: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """Run the weekly metrics query, over all history or only the last N weeks of invoices"""
     try:
-        query = get_weekly_metrics_query()
         with engine.connect() as conn:
-            result = conn.execute(text(query))
-            return pd.DataFrame(result.fetchall(), columns=result.keys())
+            params = {}
+            if weeks:
+                params['since'] = get_recent_weeks_start(conn, weeks)
+            if source == "facts":
+                query = get_weekly_metrics_facts_query("WHERE day >= :since" if weeks else "")
+            else:
+                query = get_weekly_metrics_query("AND created_at >= :since" if weeks else "")
+            df = fetch_dataframe(conn, query, params, cents=WEEKLY_METRICS_CENTS)
+            add_rows(len(df))
+            return df
     except Exception as e:
+        record_error(e)
         print(f"Error executing weekly metrics query: {e}")
         return None
 
+@timed('query')
+def execute_weekly_metrics_duckdb(backend: DuckDbBackend, weeks: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """Run the weekly metrics query in-process over the Parquet snapshots"""
+    try:
+        params = {}
+        if weeks:
+            params['since'] = backend.get_recent_weeks_start(weeks)
+        df = backend.query(get_weekly_metrics_query("AND created_at >= :since" if weeks else ""), params, cents=WEEKLY_METRICS_CENTS)
+        add_rows(len(df))
+        return df
+    except Exception as e:
+        record_error(e)
+        print(f"Error executing weekly metrics query in DuckDB: {e}")
+        return None
+
+def format_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    df['week_year'] = df['year'].astype('int64').astype(str) + '-W' + df['week_number'].astype('int64').astype(str)
+    
+    df = df[['week_year', 'eur_total', 'usd_total', 'reporting_total', 'unique_customers', 'prev_week_customers', 'customer_delta']]
+    
+    df['reporting_total'] = df['reporting_total'].astype(float).round(2)
+    return df
+
+@timed('save')
 def save_metrics_to_csv(df: Optional[pd.DataFrame]) -> None:
     if df is not None:
         try:
-            df['week_year'] = df['year'].astype(str) + '-W' + df['week_number'].astype(str)
-            
-            df = df[['week_year', 'eur_total', 'usd_total', 'unique_customers', 'prev_week_customers', 'customer_delta']]
-            
-            df['eur_total'] = df['eur_total'].round(2)
-            df['usd_total'] = df['usd_total'].round(2)
+            df = format_metrics(df)
+            for column in WEEKLY_METRICS_CENTS:
+                df[column] = format_cents(df[column])
             
             date_tag = datetime.now().strftime('%Y%m%d')
             output_file = f"output/weekly_metrics_{date_tag}.csv"
             
-            df.to_csv(output_file, index=False)
+            df.to_csv(output_file, index=False, float_format='%.2f')
             print(f"Weekly metrics saved to {output_file}")
         except Exception as e:
+            record_error(e)
             print(f"Error saving weekly metrics to CSV: {e}")
     else:
         print("No weekly metrics available to save.")
 
-def calculate_weekly_metrics() -> None:
+@timed('save')
+def save_metrics_to_parquet(df: Optional[pd.DataFrame]) -> None:
+    if df is not None:
+        try:
+            df = format_metrics(df).assign(snapshot_date=get_snapshot_date())
+            for column in WEEKLY_METRICS_CENTS:
+                df[column] = from_cents(df[column])
+            path = write_snapshot(df, 'weekly_metrics', ['snapshot_date'])
+            print(f"Weekly metrics saved to {path}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving weekly metrics to Parquet: {e}")
+    else:
+        print("No weekly metrics available to save.")
+
+def calculate_weekly_metrics(
+    source: str = "invoices",
+    output_format: str = "csv",
+    weeks: Optional[int] = None,
+    backend: str = POSTGRES,
+    snapshot_dir: str = SNAPSHOT_DIR
+) -> None:
     try:
-        engine = get_database_connection()
-        df = execute_weekly_metrics_query(engine)
-        save_metrics_to_csv(df)
+        if backend == DUCKDB:
+            df = execute_weekly_metrics_duckdb(DuckDbBackend(snapshot_dir), weeks)
+        else:
+            engine = get_database_connection()
+            df = execute_weekly_metrics_query(engine, source, weeks)
+        if output_format == "parquet":
+            save_metrics_to_parquet(df)
+        else:
+            save_metrics_to_csv(df)
     except Exception as e:
+        record_error(e)
         print(f"Error calculating weekly metrics: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Calculate weekly revenue and customer churn metrics')
+    parser.add_argument('--source', choices=['invoices', 'facts'], default='invoices', help='Read raw invoices or the mrr_daily fact table')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Write a dated CSV or a Parquet snapshot')
+    parser.add_argument('--weeks', type=int, help='Only report the last N weeks (prunes partitions of a partitioned invoices table)')
+    parser.add_argument('--backend', choices=BACKENDS, default=POSTGRES, help='Query Postgres, or DuckDB in-process over the Parquet snapshots')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help='Snapshots read by the duckdb backend')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    if args.backend == DUCKDB and args.source == 'facts':
+        parser.error('the duckdb backend reads the invoice snapshots, not the mrr_daily fact table')
+    with run_report('calculate_churn', **get_instrumentation_options(args)):
+        calculate_weekly_metrics(args.source, args.format, args.weeks, args.backend, args.snapshot_dir)
+
 if __name__ == "__main__":
-    calculate_weekly_metrics() 
\ No newline at end of file
+    main() 
\ No newline at end of file
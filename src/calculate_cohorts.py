@@ -0,0 +1,65 @@
+import pandas as pd
+import argparse
+from datetime import datetime
+from typing import Optional
+from utils.database import get_database_connection
+from utils.cohorts import COHORT_MATRIX_FILE, COHORT_METRICS, refresh_cohort_matrix
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+
+def save_cohorts_to_csv(df: Optional[pd.DataFrame], metric: str, currency: str, output_dir: str = "output") -> None:
+    if df is not None:
+        try:
+            date_tag = datetime.now().strftime('%Y%m%d')
+            output_file = f"{output_dir}/cohort_{metric}_{currency}_{date_tag}.csv"
+            with timed('write_csv'):
+                df.round(4).to_csv(output_file)
+            print(f"Cohort {metric} ({currency}) saved to {output_file}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving cohort matrix to CSV: {e}")
+    else:
+        print("No cohort matrix available to save.")
+
+def calculate_cohorts(
+    metric: str = 'mrr',
+    currency: Optional[str] = None,
+    full: bool = False,
+    matrix_file: str = COHORT_MATRIX_FILE,
+    output_dir: str = "output"
+) -> None:
+    try:
+        engine = get_database_connection()
+        with timed('refresh_cohort_matrix'):
+            matrix = refresh_cohort_matrix(engine, matrix_file, full=full)
+            add_rows(len(matrix.cohort_sizes))
+        if not matrix.currencies:
+            print("No closed months with MRR found.")
+            return
+        print(f"Cohort matrix closed through {matrix.closed_through} ({len(matrix.cohort_sizes)} cohorts)")
+
+        for code in [currency] if currency else matrix.currencies:
+            if code not in matrix.currencies:
+                print(f"No cohort MRR recorded in {code}.")
+                continue
+            save_cohorts_to_csv(matrix.to_frame(metric, code), metric, code, output_dir)
+    except Exception as e:
+        record_error(e)
+        print(f"Error calculating cohorts: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Build the cohort x months-since-joined MRR and retention matrix')
+    parser.add_argument('--metric', choices=COHORT_METRICS, default='mrr', help='Matrix to export')
+    parser.add_argument('--currency', help='Only export this currency (e.g. eur)')
+    parser.add_argument('--full', action='store_true', help='Rebuild every month instead of only newly closed ones')
+    parser.add_argument('--matrix-file', default=COHORT_MATRIX_FILE, help='Where the matrix is persisted between runs')
+    parser.add_argument('--output-dir', default='output', help='Directory to save the output CSV file')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    with run_report('calculate_cohorts', **get_instrumentation_options(args)):
+        calculate_cohorts(args.metric, args.currency, args.full, args.matrix_file, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 import pandas as pd
-from datetime import datetime
-from typing import Optional
+import os
+from datetime import date, datetime
+from typing import List, Optional
+from utils.analytics import BACKENDS, DUCKDB, POSTGRES, DuckDbBackend
 from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.fx import add_reporting_amounts, get_fx_rates
+from utils.snapshots import SNAPSHOT_DIR, write_snapshot
 import argparse
 
 def get_mrr_query() -> str:
@@ -10,7 +18,7 @@ def get_mrr_query() -> str:
     WITH customer_tenure AS (
         SELECT 
             customer_id,
-            EXTRACT(MONTH FROM AGE(:as_of_date, created_at)) as months_since_joined
+            CAST(EXTRACT(MONTH FROM AGE(:as_of_date, created_at)) AS INTEGER) as months_since_joined
         FROM customers
         WHERE customer_id = :customer_id
     ),
@@ -24,7 +32,6 @@ def get_mrr_query() -> str:
         WHERE customer_id = :customer_id
         AND period_start <= :as_of_date
         AND is_forgiven = FALSE 
-        AND currency IN ('eur', 'usd')
         GROUP BY DATE_TRUNC('month', period_start), currency
     )
     SELECT 
@@ -41,22 +48,75 @@ def get_mrr_query() -> str:
     ORDER BY m.month DESC, m.currency;
     """
 
-def execute_mrr_query(engine: create_engine, customer_id: str, as_of_date: datetime) -> Optional[pd.DataFrame]:
+def get_mrr_facts_query() -> str:
+    """
+    Revenue recognised per calendar month, read from the mrr_daily fact table.
+
+    The columns match get_mrr_query, but the figures differ: each month sums the
+    daily amounts spread over billing periods, counting only days up to
+    as_of_date, whereas get_mrr_query sums whole invoice totals by the month of
+    period_start. A partly elapsed month or an annual invoice therefore shows a
+    pro-rated amount here.
+    """
+    return """
+    WITH customer_tenure AS (
+        SELECT 
+            customer_id,
+            CAST(EXTRACT(MONTH FROM AGE(:as_of_date, created_at)) AS INTEGER) as months_since_joined
+        FROM customers
+        WHERE customer_id = :customer_id
+    ),
+    monthly_revenue AS (
+        SELECT 
+            DATE_TRUNC('month', day) as month,
+            currency,
+            SUM(daily_amount) as monthly_revenue,
+            COUNT(DISTINCT subscription_id) as active_subscriptions
+        FROM mrr_daily
+        WHERE customer_id = :customer_id
+        AND day <= :as_of_date
+        GROUP BY DATE_TRUNC('month', day), currency
+    )
+    SELECT 
+        m.month,
+        m.currency,
+        ROUND(m.monthly_revenue, 2) as monthly_revenue,
+        m.active_subscriptions,
+        m.monthly_revenue / NULLIF(m.active_subscriptions, 0) as mrr_per_subscription,
+        ROUND(m.monthly_revenue, 2) as mrr,
+        CASE WHEN m.active_subscriptions > 0 THEN TRUE ELSE FALSE END as has_subscription,
+        c.months_since_joined
+    FROM monthly_revenue m
+    CROSS JOIN customer_tenure c
+    ORDER BY m.month DESC, m.currency;
+    """
+
+@timed('query')
+def execute_mrr_query(engine: create_engine, customer_id: str, as_of_date: datetime, source: str = "invoices") -> Optional[pd.DataFrame]:
     try:
-        query = get_mrr_query()
+        query = get_mrr_facts_query() if source == "facts" else get_mrr_query()
         with engine.connect() as conn:
-            result = conn.execute(
-                text(query),
-                {
-                    'customer_id': customer_id,
-                    'as_of_date': as_of_date
-                }
-            )
-            return pd.DataFrame(result.fetchall(), columns=result.keys())
+            df = fetch_dataframe(conn, query, {'customer_id': customer_id, 'as_of_date': as_of_date})
+            add_rows(len(df))
+        return add_reporting_amounts(df, get_fx_rates(engine), 'mrr', 'month')
     except Exception as e:
+        record_error(e)
         print(f"Error executing MRR query: {e}")
         return None
 
+@timed('query')
+def execute_mrr_duckdb(backend: DuckDbBackend, customer_id: str, as_of_date: datetime) -> Optional[pd.DataFrame]:
+    """Run the MRR query in-process over the Parquet snapshots"""
+    try:
+        df = backend.query(get_mrr_query(), {'customer_id': customer_id, 'as_of_date': as_of_date})
+        add_rows(len(df))
+        return add_reporting_amounts(df, backend.fx, 'mrr', 'month')
+    except Exception as e:
+        record_error(e)
+        print(f"Error executing MRR query in DuckDB: {e}")
+        return None
+
+@timed('save')
 def save_mrr_to_csv(df: Optional[pd.DataFrame], customer_id: str, as_of_date: datetime, output_dir: str = "output") -> None:
     if df is not None:
         try:
@@ -64,33 +124,245 @@ def save_mrr_to_csv(df: Optional[pd.DataFrame], customer_id: str, as_of_date: da
             df.to_csv(f"{output_dir}/mrr_{customer_id}_{date_str}.csv", index=False)
             print(f"MRR data saved to {output_dir}/mrr_{customer_id}_{date_str}.csv")
         except Exception as e:
+            record_error(e)
             print(f"Error saving MRR data to CSV: {e}")
     else:
         print("No MRR data available to save.")
 
-def calculate_mrr(customer_id: str, as_of_date: datetime, output_dir: str = "output") -> None:
+@timed('save')
+def save_mrr_to_parquet(df: Optional[pd.DataFrame], customer_id: str, as_of_date: datetime) -> None:
+    """Add this customer's rows to the mrr snapshot, partitioned by as-of date and currency"""
+    if df is not None:
+        try:
+            df = df.assign(customer_id=customer_id, as_of_date=as_of_date.strftime('%Y-%m-%d'))
+            path = write_snapshot(df, 'mrr', ['as_of_date', 'currency'], part=customer_id)
+            print(f"MRR data saved to {path}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving MRR data to Parquet: {e}")
+    else:
+        print("No MRR data available to save.")
+
+def calculate_mrr(
+    customer_id: str,
+    as_of_date: datetime,
+    output_dir: str = "output",
+    source: str = "invoices",
+    output_format: str = "csv",
+    backend: str = POSTGRES,
+    snapshot_dir: str = SNAPSHOT_DIR
+) -> None:
     try:
-        engine = get_database_connection()
-        df = execute_mrr_query(engine, customer_id, as_of_date)
-        save_mrr_to_csv(df, customer_id, as_of_date, output_dir)
+        if backend == DUCKDB:
+            df = execute_mrr_duckdb(DuckDbBackend(snapshot_dir), customer_id, as_of_date)
+        else:
+            engine = get_database_connection()
+            df = execute_mrr_query(engine, customer_id, as_of_date, source)
+        if output_format == "parquet":
+            save_mrr_to_parquet(df, customer_id, as_of_date)
+        else:
+            save_mrr_to_csv(df, customer_id, as_of_date, output_dir)
     except Exception as e:
+        record_error(e)
         print(f"Error calculating MRR: {e}")
 
+BATCH_FREQUENCIES = {
+    'daily': 'D',
+    'weekly': 'W-SUN',
+    'month-end': 'ME',
+}
+
+def get_batch_mrr_query() -> str:
+    """
+    MRR of every (customer, as-of date) pair in one set-based pass.
+
+    For each as-of date this returns the same figures as the as-of month row of
+    get_mrr_query(): revenue from non-forgiven invoices whose period starts in the
+    as-of month, on or before the as-of date. Pass customer_ids = NULL for all customers.
+    """
+    return """
+    WITH as_of_dates AS (
+        SELECT CAST(as_of_date AS TIMESTAMP) as as_of_date
+        FROM unnest(CAST(:as_of_dates AS DATE[])) as d(as_of_date)
+    ),
+    scoped_customers AS (
+        SELECT customer_id, created_at
+        FROM customers
+        WHERE CAST(:customer_ids AS TEXT[]) IS NULL
+        OR customer_id = ANY(CAST(:customer_ids AS TEXT[]))
+    ),
+    invoice_months AS (
+        SELECT 
+            i.customer_id,
+            i.subscription_id,
+            i.currency,
+            i.total,
+            i.period_start,
+            DATE_TRUNC('month', i.period_start) as month
+        FROM invoices i
+        JOIN scoped_customers c ON c.customer_id = i.customer_id
+        WHERE i.is_forgiven = FALSE
+        AND i.period_start >= DATE_TRUNC('month', (SELECT MIN(as_of_date) FROM as_of_dates))
+        AND i.period_start <= (SELECT MAX(as_of_date) FROM as_of_dates)
+    ),
+    monthly_revenue AS (
+        SELECT 
+            d.as_of_date,
+            m.customer_id,
+            m.month,
+            m.currency,
+            SUM(m.total) as monthly_revenue,
+            COUNT(DISTINCT m.subscription_id) as active_subscriptions
+        FROM as_of_dates d
+        JOIN invoice_months m
+            ON m.month = DATE_TRUNC('month', d.as_of_date)
+            AND m.period_start <= d.as_of_date
+        GROUP BY d.as_of_date, m.customer_id, m.month, m.currency
+    )
+    SELECT 
+        CAST(m.as_of_date AS DATE) as as_of_date,
+        m.customer_id,
+        m.month,
+        m.currency,
+        m.monthly_revenue,
+        m.active_subscriptions,
+        m.monthly_revenue / NULLIF(m.active_subscriptions, 0) as mrr_per_subscription,
+        m.monthly_revenue as mrr,
+        CASE WHEN m.active_subscriptions > 0 THEN TRUE ELSE FALSE END as has_subscription,
+        CAST(EXTRACT(MONTH FROM AGE(m.as_of_date, c.created_at)) AS INTEGER) as months_since_joined
+    FROM monthly_revenue m
+    JOIN scoped_customers c ON c.customer_id = m.customer_id
+    ORDER BY m.as_of_date, m.customer_id, m.currency;
+    """
+
+def get_as_of_dates(start_date: datetime, end_date: datetime, frequency: str = 'month-end') -> List[date]:
+    """Return the as-of dates between start_date and end_date (inclusive) at the given frequency"""
+    dates = pd.date_range(start_date, end_date, freq=BATCH_FREQUENCIES[frequency])
+    return [d.date() for d in dates]
+
+@timed('query')
+def execute_batch_mrr_query(engine: create_engine, customer_ids: Optional[List[str]], as_of_dates: List[date]) -> Optional[pd.DataFrame]:
+    try:
+        query = get_batch_mrr_query()
+        with engine.connect() as conn:
+            df = fetch_dataframe(conn, query, {'customer_ids': customer_ids, 'as_of_dates': as_of_dates})
+            add_rows(len(df))
+        return add_reporting_amounts(df, get_fx_rates(engine), 'mrr', 'as_of_date')
+    except Exception as e:
+        record_error(e)
+        print(f"Error executing batch MRR query: {e}")
+        return None
+
+@timed('query')
+def execute_batch_mrr_duckdb(backend: DuckDbBackend, customer_ids: Optional[List[str]], as_of_dates: List[date]) -> Optional[pd.DataFrame]:
+    """Run the batch MRR query in-process over the Parquet snapshots"""
+    try:
+        df = backend.query(get_batch_mrr_query(), {'customer_ids': customer_ids, 'as_of_dates': as_of_dates})
+        add_rows(len(df))
+        return add_reporting_amounts(df, backend.fx, 'mrr', 'as_of_date')
+    except Exception as e:
+        record_error(e)
+        print(f"Error executing batch MRR query in DuckDB: {e}")
+        return None
+
+@timed('save')
+def save_batch_mrr_to_csv(df: Optional[pd.DataFrame], start_date: datetime, end_date: datetime, output_dir: str = "output") -> None:
+    """Write one dataset partitioned by as-of date: <output_dir>/mrr_batch_<start>_<end>/as_of_date=YYYY-MM-DD/mrr.csv"""
+    if df is not None:
+        try:
+            dataset_dir = os.path.join(output_dir, f"mrr_batch_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}")
+            for as_of_date, partition in df.groupby('as_of_date'):
+                partition_dir = os.path.join(dataset_dir, f"as_of_date={as_of_date:%Y-%m-%d}")
+                os.makedirs(partition_dir, exist_ok=True)
+                partition.drop(columns='as_of_date').to_csv(os.path.join(partition_dir, "mrr.csv"), index=False)
+            print(f"Batch MRR data ({len(df)} rows) saved to {dataset_dir}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving batch MRR data to CSV: {e}")
+    else:
+        print("No batch MRR data available to save.")
+
+@timed('save')
+def save_batch_mrr_to_parquet(df: Optional[pd.DataFrame]) -> None:
+    if df is not None:
+        try:
+            df = df.assign(as_of_date=df['as_of_date'].dt.strftime('%Y-%m-%d'))
+            path = write_snapshot(df, 'mrr_batch', ['as_of_date', 'currency'])
+            print(f"Batch MRR data ({len(df)} rows) saved to {path}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving batch MRR data to Parquet: {e}")
+    else:
+        print("No batch MRR data available to save.")
+
+def calculate_batch_mrr(
+    customer_ids: Optional[List[str]],
+    start_date: datetime,
+    end_date: datetime,
+    frequency: str = 'month-end',
+    output_dir: str = "output",
+    output_format: str = "csv",
+    backend: str = POSTGRES,
+    snapshot_dir: str = SNAPSHOT_DIR
+) -> None:
+    try:
+        as_of_dates = get_as_of_dates(start_date, end_date, frequency)
+        if backend == DUCKDB:
+            df = execute_batch_mrr_duckdb(DuckDbBackend(snapshot_dir), customer_ids, as_of_dates)
+        else:
+            engine = get_database_connection()
+            df = execute_batch_mrr_query(engine, customer_ids, as_of_dates)
+        if output_format == "parquet":
+            save_batch_mrr_to_parquet(df)
+        else:
+            save_batch_mrr_to_csv(df, start_date, end_date, output_dir)
+    except Exception as e:
+        record_error(e)
+        print(f"Error calculating batch MRR: {e}")
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description='Calculate Monthly Recurring Revenue (MRR) for a customer')
-    parser.add_argument('--customer-id', required=True, help='The Stripe customer ID')
-    parser.add_argument('--as-of-date', required=True, help='The date to calculate MRR as of (YYYY-MM-DD)')
+    parser = argparse.ArgumentParser(description='Calculate Monthly Recurring Revenue (MRR) for a customer, or for many customers and dates in batch')
+    parser.add_argument('--customer-id', help='The Stripe customer ID')
+    parser.add_argument('--as-of-date', help='The date to calculate MRR as of (YYYY-MM-DD)')
+    parser.add_argument('--customer-ids', help='Batch mode: comma-separated Stripe customer IDs')
+    parser.add_argument('--all-customers', action='store_true', help='Batch mode: calculate MRR for every customer')
+    parser.add_argument('--start-date', help='Batch mode: first as-of date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Batch mode: last as-of date (YYYY-MM-DD)')
+    parser.add_argument('--frequency', choices=list(BATCH_FREQUENCIES), default='month-end', help='Batch mode: spacing of as-of dates')
     parser.add_argument('--output-dir', default='output', help='Directory to save the output CSV file')
+    parser.add_argument('--source', choices=['invoices', 'facts'], default='invoices', help='Read raw invoices or the mrr_daily fact table (single customer only)')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Write CSV files or a Parquet snapshot')
+    parser.add_argument('--backend', choices=BACKENDS, default=POSTGRES, help='Query Postgres, or DuckDB in-process over the Parquet snapshots')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help='Snapshots read by the duckdb backend')
+    add_instrumentation_arguments(parser)
     
     args = parser.parse_args()
     
-    try:
-        as_of_date = datetime.strptime(args.as_of_date, '%Y-%m-%d')
-        calculate_mrr(args.customer_id, as_of_date, args.output_dir)
-    except ValueError:
-        print("Error: Invalid date format. Please use YYYY-MM-DD format.")
-    except Exception as e:
-        print(f"Error: {e}")
+    batch_mode = args.start_date or args.end_date or args.customer_ids or args.all_customers
+    if batch_mode and not (args.start_date and args.end_date and (args.customer_ids or args.all_customers)):
+        parser.error('batch mode needs --start-date, --end-date and either --customer-ids or --all-customers')
+    if not batch_mode and not (args.customer_id and args.as_of_date):
+        parser.error('--customer-id and --as-of-date are required outside batch mode')
+    if batch_mode and args.source == 'facts':
+        parser.error('batch mode reads raw invoices; --source facts is only supported for a single customer')
+    if args.backend == DUCKDB and args.source == 'facts':
+        parser.error('the duckdb backend reads the invoice snapshots, not the mrr_daily fact table')
+    
+    with run_report('calculate_mrr', **get_instrumentation_options(args)):
+        try:
+            if batch_mode:
+                start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
+                end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+                customer_ids = None if args.all_customers else [c.strip() for c in args.customer_ids.split(',') if c.strip()]
+                calculate_batch_mrr(customer_ids, start_date, end_date, args.frequency, args.output_dir, args.format, args.backend, args.snapshot_dir)
+            else:
+                as_of_date = datetime.strptime(args.as_of_date, '%Y-%m-%d')
+                calculate_mrr(args.customer_id, as_of_date, args.output_dir, args.source, args.format, args.backend, args.snapshot_dir)
+        except ValueError:
+            print("Error: Invalid date format. Please use YYYY-MM-DD format.")
+        except Exception as e:
+            record_error(e)
+            print(f"Error: {e}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+from sqlalchemy import create_engine, text
+import pandas as pd
+import argparse
+from datetime import datetime
+from typing import Optional
+from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe
+from utils.bulk_load import copy_dataframe
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.churn_engine import (
+    GRACE_DAYS, PERIOD_FREQUENCIES, build_customer_intervals, build_subscription_intervals, compute_period_churn
+)
+
+INTERVAL_COLUMNS = [
+    'subscription_id', 'interval_start', 'customer_id', 'currency',
+    'interval_end', 'start_mrr', 'end_mrr', 'is_open'
+]
+
+CHURN_PERIOD_COLUMNS = [
+    'period_type', 'period_start', 'currency', 'starting_mrr', 'new_mrr',
+    'expansion_mrr', 'contraction_mrr', 'churned_mrr', 'starting_customers',
+    'churned_customers', 'logo_churn_rate', 'gross_revenue_churn_rate', 'net_revenue_churn_rate'
+]
+
+def get_subscription_invoices_query() -> str:
+    return """
+    SELECT
+        subscription_id,
+        customer_id,
+        currency,
+        period_start,
+        period_end,
+        min_line_item_period_start,
+        max_line_item_period_end,
+        total,
+        created_at
+    FROM invoices
+    WHERE is_forgiven = FALSE
+    AND subscription_id IS NOT NULL
+    ORDER BY subscription_id, period_start;
+    """
+
+def get_range_churn_query() -> str:
+    """Logo and revenue churn for an arbitrary [period_start, period_end) range, read from subscription_intervals"""
+    return """
+    WITH starting AS (
+        SELECT DISTINCT currency, customer_id
+        FROM subscription_intervals
+        WHERE interval_start < :period_start
+        AND interval_end >= :period_start
+    ),
+    retained AS (
+        SELECT DISTINCT currency, customer_id
+        FROM subscription_intervals
+        WHERE interval_start <= :period_end
+        AND (is_open OR interval_end >= :period_end)
+    ),
+    churned_subscriptions AS (
+        SELECT
+            currency,
+            SUM(end_mrr) as churned_mrr,
+            COUNT(*) as churned_subscriptions
+        FROM subscription_intervals
+        WHERE NOT is_open
+        AND interval_end >= :period_start
+        AND interval_end < :period_end
+        GROUP BY currency
+    )
+    SELECT
+        s.currency,
+        COUNT(*) as starting_customers,
+        COUNT(*) FILTER (WHERE r.customer_id IS NULL) as churned_customers,
+        COUNT(*) FILTER (WHERE r.customer_id IS NULL)::NUMERIC / NULLIF(COUNT(*), 0) as logo_churn_rate,
+        COALESCE(c.churned_mrr, 0) as churned_mrr,
+        COALESCE(c.churned_subscriptions, 0) as churned_subscriptions
+    FROM starting s
+    LEFT JOIN retained r ON r.currency = s.currency AND r.customer_id = s.customer_id
+    LEFT JOIN churned_subscriptions c ON c.currency = s.currency
+    GROUP BY s.currency, c.churned_mrr, c.churned_subscriptions
+    ORDER BY s.currency;
+    """
+
+def load_subscription_invoices(engine: create_engine) -> pd.DataFrame:
+    with engine.connect() as conn:
+        return fetch_dataframe(conn, get_subscription_invoices_query())
+
+def save_intervals(engine: create_engine, intervals: pd.DataFrame, churn: pd.DataFrame, period: str) -> None:
+    """Replace the interval table and this period type's churn rows in one transaction"""
+    with engine.connect() as conn:
+        conn.execute(text("TRUNCATE subscription_intervals"))
+        copy_dataframe(conn, intervals, 'subscription_intervals', INTERVAL_COLUMNS)
+        conn.execute(text("DELETE FROM churn_periods WHERE period_type = :period_type"), {'period_type': period})
+        copy_dataframe(conn, churn.assign(period_type=period), 'churn_periods', CHURN_PERIOD_COLUMNS)
+        conn.commit()
+
+def save_churn_to_csv(df: Optional[pd.DataFrame], period: str, output_dir: str = "output") -> None:
+    if df is not None:
+        try:
+            date_tag = datetime.now().strftime('%Y%m%d')
+            output_file = f"{output_dir}/subscription_churn_{period}_{date_tag}.csv"
+            df.round(4).to_csv(output_file, index=False)
+            print(f"Subscription churn saved to {output_file}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving subscription churn to CSV: {e}")
+    else:
+        print("No subscription churn available to save.")
+
+def calculate_subscription_churn(period: str = 'month', grace_days: int = GRACE_DAYS, output_dir: str = "output") -> None:
+    try:
+        engine = get_database_connection()
+        with timed('load_subscription_invoices'):
+            invoices = load_subscription_invoices(engine)
+            add_rows(len(invoices))
+        if invoices.empty:
+            print("No subscription invoices found.")
+            return
+        horizon = pd.to_datetime(invoices['created_at']).max()
+
+        with timed('build_intervals'):
+            intervals, events = build_subscription_intervals(invoices, horizon, grace_days)
+            customer_intervals = build_customer_intervals(intervals, horizon, grace_days)
+        with timed('compute_period_churn'):
+            churn = compute_period_churn(events, customer_intervals, horizon, period)
+
+        with timed('save_intervals'):
+            save_intervals(engine, intervals, churn, period)
+            add_rows(len(intervals) + len(churn))
+        print(f"Saved {len(intervals)} subscription intervals and {len(churn)} {period}ly churn rows")
+        save_churn_to_csv(churn, period, output_dir)
+    except Exception as e:
+        record_error(e)
+        print(f"Error calculating subscription churn: {e}")
+
+def query_range_churn(period_start: datetime, period_end: datetime) -> None:
+    try:
+        engine = get_database_connection()
+        with timed('query_range_churn'), engine.connect() as conn:
+            df = fetch_dataframe(conn, get_range_churn_query(), {'period_start': period_start, 'period_end': period_end})
+            print(df.to_string(index=False))
+    except Exception as e:
+        record_error(e)
+        print(f"Error querying churn for range: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Calculate logo and revenue churn from subscription active intervals')
+    parser.add_argument('--period', choices=list(PERIOD_FREQUENCIES), default='month', help='Reporting period for the churn table')
+    parser.add_argument('--grace-days', type=int, default=GRACE_DAYS, help='Gap between billing periods still treated as continuous')
+    parser.add_argument('--from', dest='range_start', help='Query churn for [from, to) from the stored intervals (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='range_end', help='End of the range queried with --from (YYYY-MM-DD)')
+    parser.add_argument('--output-dir', default='output', help='Directory to save the output CSV file')
+
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    if bool(args.range_start) != bool(args.range_end):
+        parser.error('--from and --to must be given together')
+
+    with run_report('calculate_subscription_churn', **get_instrumentation_options(args)):
+        if args.range_start:
+            try:
+                period_start = datetime.strptime(args.range_start, '%Y-%m-%d')
+                period_end = datetime.strptime(args.range_end, '%Y-%m-%d')
+            except ValueError as e:
+                record_error(e)
+                print("Error: Invalid date format. Please use YYYY-MM-DD format.")
+                return
+            query_range_churn(period_start, period_end)
+        else:
+            calculate_subscription_churn(args.period, args.grace_days, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import pandas as pd
+import argparse
+from datetime import datetime
+from typing import List, Optional, Sequence
+from utils.database import get_database_connection
+from utils.top_k import DEFAULT_K, DEFAULT_ROLLING_DAYS, GRAINS, TOP_K_STATE_FILE, refresh_top_k
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+
+def save_top_customers_to_csv(df: pd.DataFrame, window: str, output_dir: str = "output") -> None:
+    if not df.empty:
+        try:
+            date_tag = datetime.now().strftime('%Y%m%d')
+            output_file = f"{output_dir}/top_customers_{window}_{date_tag}.csv"
+            with timed('write_csv'):
+                df.round({'total_spend': 2}).to_csv(output_file, index=False)
+            print(f"Top customers ({window}) saved to {output_file}")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving top customers to CSV: {e}")
+    else:
+        print("No top customers data available to save.")
+
+def calculate_top_customers(
+    k: int = DEFAULT_K,
+    window: str = 'week',
+    days: Optional[int] = None,
+    currencies: Optional[List[str]] = None,
+    rolling_days: Sequence[int] = DEFAULT_ROLLING_DAYS,
+    full: bool = False,
+    state_file: str = TOP_K_STATE_FILE,
+    output_dir: str = "output"
+) -> None:
+    try:
+        engine = get_database_connection()
+        if days is not None and days not in rolling_days:
+            rolling_days = list(rolling_days) + [days]
+        with timed('refresh_top_k'):
+            top_k = refresh_top_k(engine, state_file, full, k, rolling_days)
+        if not top_k.currencies:
+            print("No invoices found.")
+            return
+        print(f"Leaderboards up to {top_k.last_day} in {', '.join(top_k.currencies)}")
+
+        with timed('rank'):
+            df = top_k.to_frame(window, days, currencies, k)
+            add_rows(len(df))
+        save_top_customers_to_csv(df, f"rolling_{days}d" if days else window, output_dir)
+    except Exception as e:
+        record_error(e)
+        print(f"Error calculating top customers: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Top K customers by invoiced total per currency over any window')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='Customers per leaderboard')
+    parser.add_argument('--window', choices=GRAINS, default='week', help='Calendar buckets to rank within')
+    parser.add_argument('--days', type=int, help='Rank the trailing N days instead of calendar buckets')
+    parser.add_argument('--currency', nargs='+', help='Only these currencies (default: every currency invoiced)')
+    parser.add_argument('--rolling-days', type=int, nargs='+', default=list(DEFAULT_ROLLING_DAYS), help='Rolling windows kept up to date in the state')
+    parser.add_argument('--full', action='store_true', help='Rebuild the leaderboards from all invoices')
+    parser.add_argument('--state-file', default=TOP_K_STATE_FILE, help='Where the leaderboards are persisted between runs')
+    parser.add_argument('--output-dir', default='output', help='Directory to save the output CSV file')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    with run_report('calculate_top_customers', **get_instrumentation_options(args)):
+        calculate_top_customers(
+            args.k, args.window, args.days, args.currency, args.rolling_days,
+            args.full, args.state_file, args.output_dir
+        )
+
+if __name__ == "__main__":
+    main()
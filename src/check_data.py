@@ -1,23 +1,40 @@
-from sqlalchemy import create_engine
-import pandas as pd
+import argparse
 from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_instrumentation_options, record_error, run_report, timed
+)
 
-def check_data() -> None:
+TABLES = ['customers', 'subscriptions', 'invoices', 'payments']
+
+def check_data(rows: int = 10) -> None:
+    """Print the row count and the first rows of every table, without reading whole tables into memory"""
     try:
         engine = get_database_connection()
         
-        tables = ['customers', 'subscriptions', 'invoices', 'payments']
-        
-        for table in tables:
-            df = pd.read_sql_query(f"SELECT * FROM {table}", engine)
-            
-            print(f"\nData from {table} table:")
-            print("-" * 50)
-            print(df)
-            print("\n")
+        with engine.connect() as conn:
+            for table in TABLES:
+                with timed(table):
+                    count = fetch_dataframe(conn, f"SELECT COUNT(*) as row_count FROM {table}")['row_count'].iloc[0]
+                    df = fetch_dataframe(conn, f"SELECT * FROM {table} LIMIT :rows", {'rows': rows})
+                
+                print(f"\nData from {table} table ({count} rows, first {len(df)} shown):")
+                print("-" * 50)
+                print(df)
+                print("\n")
         
     except Exception as e:
+        record_error(e)
         print(f"Error checking data: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Print row counts and sample rows of the loaded tables')
+    parser.add_argument('--rows', type=int, default=10, help='Rows shown per table')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('check_data', **get_instrumentation_options(args)):
+        check_data(args.rows)
+
 if __name__ == "__main__":
-    check_data() 
\ No newline at end of file
+    main()
@@ -0,0 +1,190 @@
+from sqlalchemy import create_engine
+import pandas as pd
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional
+from utils.database import get_database_connection
+from utils.fetch import fetch_dataframe
+from utils.change_detection import ChangeDetector, DEFAULT_WINDOW, detect_changes
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+
+DEFAULT_STATE_FILE = 'output/mrr_change_state.json'
+
+def get_daily_series_query() -> str:
+    return """
+    SELECT
+        day,
+        currency,
+        mrr
+    FROM mrr_daily_summary
+    WHERE CAST(:after_day AS DATE) IS NULL
+    OR day > CAST(:after_day AS DATE)
+    ORDER BY currency, day;
+    """
+
+def get_attribution_query() -> str:
+    """Top customers by absolute MRR change between each flagged day and the day before"""
+    return """
+    WITH flagged AS (
+        SELECT
+            unnest(CAST(:days AS DATE[])) as day,
+            unnest(CAST(:currencies AS TEXT[])) as currency
+    )
+    SELECT
+        f.day,
+        f.currency,
+        c.customer_id,
+        c.mrr_change
+    FROM flagged f
+    CROSS JOIN LATERAL (
+        SELECT
+            d.customer_id,
+            SUM(CASE WHEN d.day = f.day THEN d.mrr ELSE -d.mrr END) as mrr_change
+        FROM mrr_daily d
+        WHERE d.currency = f.currency
+        AND d.day IN (f.day, f.day - 1)
+        GROUP BY d.customer_id
+        ORDER BY ABS(SUM(CASE WHEN d.day = f.day THEN d.mrr ELSE -d.mrr END)) DESC
+        LIMIT :top_n
+    ) c
+    ORDER BY f.day, f.currency, ABS(c.mrr_change) DESC;
+    """
+
+def load_daily_series(engine: create_engine, after_day: Optional[str] = None) -> pd.DataFrame:
+    """Return portfolio MRR per currency and day, with missing days filled as 0"""
+    with engine.connect() as conn:
+        df = fetch_dataframe(conn, get_daily_series_query(), {'after_day': after_day})
+    if df.empty:
+        return df
+    df['day'] = pd.to_datetime(df['day'])
+    df['mrr'] = df['mrr'].astype(float)
+    series = df.pivot(index='day', columns='currency', values='mrr')
+    first_day = series.index.min() if after_day is None else pd.Timestamp(after_day) + pd.Timedelta(days=1)
+    series = series.reindex(pd.date_range(first_day, series.index.max(), freq='D')).fillna(0.0)
+    series.index.name = 'day'
+    return series.reset_index().melt(id_vars='day', var_name='currency', value_name='mrr')
+
+def score_full_history(series: pd.DataFrame, detectors: Dict[str, ChangeDetector], window: int) -> pd.DataFrame:
+    """Score every day in one vectorized pass per currency and seed the incremental detectors"""
+    frames = []
+    for currency, group in series.groupby('currency', sort=True):
+        group = group.sort_values('day').reset_index(drop=True)
+        values = group['mrr'].to_numpy()
+        scores = detect_changes(values, window=window)
+        last_day = group['day'].iloc[-1].strftime('%Y-%m-%d')
+        detectors[currency] = ChangeDetector.from_scores(values, scores, last_day, window=window)
+        frames.append(pd.concat([group, scores], axis=1))
+    return pd.concat(frames, ignore_index=True) if frames else series
+
+def score_new_days(series: pd.DataFrame, detectors: Dict[str, ChangeDetector], window: int) -> pd.DataFrame:
+    rows = []
+    for record in series.sort_values(['currency', 'day']).to_dict('records'):
+        detector = detectors.setdefault(record['currency'], ChangeDetector(window=window))
+        day = record['day'].strftime('%Y-%m-%d')
+        rows.append({**record, **detector.update(record['mrr'], day)})
+    return pd.DataFrame(rows)
+
+def attribute_changes(engine: create_engine, scored: pd.DataFrame, top_n: int) -> pd.DataFrame:
+    """Add a top_customers column naming the biggest contributors to each flagged day"""
+    scored['top_customers'] = ''
+    flagged = scored[scored['is_significant']]
+    if flagged.empty:
+        return scored
+    with engine.connect() as conn:
+        contributors = fetch_dataframe(
+            conn,
+            get_attribution_query(),
+            {
+                'days': [d.date() for d in flagged['day']],
+                'currencies': flagged['currency'].tolist(),
+                'top_n': top_n
+            }
+        )
+    if contributors.empty:
+        return scored
+    contributors['day'] = pd.to_datetime(contributors['day'])
+    contributors['label'] = contributors['customer_id'] + ':' + contributors['mrr_change'].astype(float).round(2).astype(str)
+    labels = contributors.groupby(['day', 'currency'])['label'].agg(';'.join)
+    keys = pd.MultiIndex.from_frame(scored[['day', 'currency']])
+    scored['top_customers'] = labels.reindex(keys).fillna('').to_numpy()
+    return scored
+
+def load_state(state_file: str) -> Dict[str, ChangeDetector]:
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return {currency: ChangeDetector.from_dict(state) for currency, state in json.load(f).items()}
+
+def save_state(state_file: str, detectors: Dict[str, ChangeDetector]) -> None:
+    with open(state_file, 'w') as f:
+        json.dump({currency: detector.to_dict() for currency, detector in detectors.items()}, f)
+
+def save_changes_to_csv(df: Optional[pd.DataFrame], output_dir: str = "output") -> None:
+    if df is not None and not df.empty:
+        try:
+            date_tag = datetime.now().strftime('%Y%m%d')
+            output_file = f"{output_dir}/mrr_changes_{date_tag}.csv"
+            df.to_csv(output_file, index=False)
+            print(f"MRR change detection saved to {output_file} ({int(df['is_significant'].sum())} significant days)")
+        except Exception as e:
+            record_error(e)
+            print(f"Error saving MRR change detection to CSV: {e}")
+    else:
+        print("No MRR change detection results to save.")
+
+def detect_mrr_changes(
+    incremental: bool = False,
+    state_file: str = DEFAULT_STATE_FILE,
+    window: int = DEFAULT_WINDOW,
+    top_n: int = 5,
+    output_dir: str = "output"
+) -> None:
+    try:
+        engine = get_database_connection()
+        detectors = load_state(state_file) if incremental else {}
+
+        if detectors:
+            after_day = min(d.last_day for d in detectors.values() if d.last_day)
+            with timed('load_daily_series'):
+                series = load_daily_series(engine, after_day)
+                add_rows(len(series))
+            if not series.empty:
+                last_days = {c: pd.Timestamp(d.last_day) for c, d in detectors.items() if d.last_day}
+                series = series[series['day'] > series['currency'].map(last_days).fillna(pd.Timestamp.min)]
+            with timed('score_new_days'):
+                scored = score_new_days(series, detectors, window) if not series.empty else series
+        else:
+            with timed('load_daily_series'):
+                series = load_daily_series(engine)
+                add_rows(len(series))
+            with timed('score_full_history'):
+                scored = score_full_history(series, detectors, window)
+
+        if not scored.empty:
+            with timed('attribute_changes'):
+                scored = attribute_changes(engine, scored, top_n)
+        save_changes_to_csv(scored, output_dir)
+        save_state(state_file, detectors)
+    except Exception as e:
+        record_error(e)
+        print(f"Error detecting MRR changes: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Flag days with significant changes in portfolio MRR per currency')
+    parser.add_argument('--incremental', action='store_true', help='Only score days after the ones recorded in the state file')
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE, help='Where detector state is kept between runs')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='Trailing days used as the baseline')
+    parser.add_argument('--top-n', type=int, default=5, help='Customers attributed to each flagged day')
+    parser.add_argument('--output-dir', default='output', help='Directory to save the output CSV file')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    with run_report('detect_mrr_changes', **get_instrumentation_options(args)):
+        detect_mrr_changes(args.incremental, args.state_file, args.window, args.top_n, args.output_dir)
+
+if __name__ == "__main__":
+    main()
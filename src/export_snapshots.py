@@ -0,0 +1,51 @@
+import argparse
+from update_customers import read_customers
+from update_invoices import CHUNK_SIZE, read_invoice_chunks
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.snapshots import SNAPSHOT_DIR, clear_snapshot, write_snapshot
+
+@timed('export_invoices')
+def export_invoices(snapshot_dir: str = SNAPSHOT_DIR, chunksize: int = CHUNK_SIZE) -> int:
+    """Write the cleaned invoice export partitioned by created month and currency"""
+    clear_snapshot('invoices', snapshot_dir)
+    rows = 0
+    for i, chunk in enumerate(read_invoice_chunks(chunksize=chunksize)):
+        chunk['created_month'] = chunk['created_at'].dt.strftime('%Y-%m')
+        with timed('write_snapshot'):
+            write_snapshot(chunk, 'invoices', ['created_month', 'currency'], snapshot_dir, part=f"chunk{i:05d}")
+        rows += len(chunk)
+    return rows
+
+@timed('export_customers')
+def export_customers(snapshot_dir: str = SNAPSHOT_DIR) -> int:
+    """Write the cleaned customer export partitioned by created month"""
+    df = read_customers()
+    df['created_month'] = df['created_at'].dt.strftime('%Y-%m')
+    
+    clear_snapshot('customers', snapshot_dir)
+    write_snapshot(df, 'customers', ['created_month'], snapshot_dir)
+    add_rows(len(df))
+    return len(df)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export the cleaned source CSVs as partitioned Parquet snapshots')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help='Directory holding the snapshot datasets')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='Number of invoice rows written per batch')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    with run_report('export_snapshots', **get_instrumentation_options(args)):
+        try:
+            customers = export_customers(args.snapshot_dir)
+            print(f"Exported {customers} customer records to {args.snapshot_dir}/customers")
+            invoices = export_invoices(args.snapshot_dir, args.chunksize)
+            print(f"Exported {invoices} invoice records to {args.snapshot_dir}/invoices")
+        except Exception as e:
+            record_error(e)
+            print(f"Error exporting snapshots: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from utils.baselines import BASELINE_METHODS, BaselineModelBuilder
+from utils.database import dispose_engines, get_database_connection
+from utils.forecasting import (
+    MIN_HISTORY_DAYS, SERIES_TYPES, Series, load_series, save_forecasts, summarize_forecasts
+)
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.model_store import HIT, MISS, MODEL_STORE_DIR, WARM, ModelStore
+
+MODEL_NAME = 'prophet'
+
+def fit_series(series: Series, seasonality: dict, store: Optional[ModelStore]):
+    """
+    Fit one series, reusing the store's model when the series is unchanged and
+    warm-starting from it when days were only appended.
+
+    Returns:
+        Tuple[ProphetModelBuilder, str]: The fitted builder and HIT, WARM or MISS.
+    """
+    from prophet.serialize import model_from_json
+    from utils.prophets import ProphetModelBuilder, warm_start_params
+
+    data = series.history.to_frame('y')
+    params = {'model': MODEL_NAME, **seasonality}
+    status, model_json = store.lookup(series.series_id, series.history, params) if store else (MISS, None)
+
+    if status == HIT:
+        return ProphetModelBuilder(data=data, target_column='y', model=model_from_json(model_json), **seasonality), HIT
+
+    builder = None
+    if status == WARM:
+        try:
+            init = warm_start_params(model_from_json(model_json))
+            builder = ProphetModelBuilder(data=data, target_column='y', init=init, **seasonality)
+        except Exception:
+            # The number of changepoints grows with short histories, so old parameters may not fit.
+            status = MISS
+    if builder is None:
+        builder = ProphetModelBuilder(data=data, target_column='y', **seasonality)
+    if store:
+        store.save(series.series_id, series.history, params, builder.to_json())
+    return builder, status
+
+def forecast_series(
+    series: Series,
+    periods: int,
+    seasonality: dict,
+    model_dir: Optional[str] = MODEL_STORE_DIR
+) -> Tuple[pd.DataFrame, float, str]:
+    """
+    Fit one series and forecast it, in a worker process.
+
+    Returns:
+        Tuple[pd.DataFrame, float, str]: The forecast days after the history, the fit
+        time in seconds, and whether the model store was a HIT, WARM start or MISS.
+    """
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+    start = time.perf_counter()
+    builder, status = fit_series(series, seasonality, ModelStore(model_dir) if model_dir else None)
+    elapsed = time.perf_counter() - start
+    forecast = builder.forecast(periods).tail(periods)
+
+    forecast = forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].assign(
+        series_id=series.series_id,
+        series_type=series.series_type,
+        currency=series.currency,
+        series_key=series.series_key,
+    )
+    forecast['ds'] = forecast['ds'].dt.date
+    return forecast, elapsed, status
+
+def forecast_all(
+    series: List[Series],
+    periods: int,
+    seasonality: dict,
+    workers: int,
+    model_dir: Optional[str] = MODEL_STORE_DIR
+) -> pd.DataFrame:
+    """Fit every series in a process pool; a failing series is reported and left out"""
+    forecasts = []
+    statuses = {HIT: 0, WARM: 0, MISS: 0}
+    # Workers fit from the pickled series and never query, so they drop the parent's forked engine.
+    with ProcessPoolExecutor(max_workers=workers, initializer=dispose_engines) as pool:
+        futures = {pool.submit(forecast_series, s, periods, seasonality, model_dir): s for s in series}
+        for future in as_completed(futures):
+            series_id = futures[future].series_id
+            try:
+                forecast, elapsed, status = future.result()
+                forecasts.append(forecast)
+                statuses[status] += 1
+                print(f"  {series_id:40} {status:5} fit {elapsed:6.2f}s")
+            except Exception as e:
+                record_error(e)
+                print(f"  {series_id:40} failed: {e}")
+    if model_dir:
+        fitted = sum(statuses.values())
+        hit_rate = statuses[HIT] / fitted if fitted else 0.0
+        print(f"Model store hit rate {hit_rate:.0%} ({statuses[HIT]} unchanged, {statuses[WARM]} warm-started, {statuses[MISS]} fitted from scratch)")
+    return pd.concat(forecasts, ignore_index=True) if forecasts else pd.DataFrame()
+
+def forecast_baseline(series: List[Series], periods: int, method: str) -> pd.DataFrame:
+    """
+    Forecast every series with a vectorized baseline in a single fit.
+
+    The builder masks the days before each series' first day instead of padding
+    them with zeros, so every series is fitted on its own span and forecast from
+    its own last day.
+    """
+    wide = pd.DataFrame({s.series_id: s.history for s in series}).asfreq('D')
+    last_days = pd.Series({s.series_id: s.history.index[-1] for s in series})
+    forecast = BaselineModelBuilder(wide, method=method).forecast(periods)
+    forecast = forecast[forecast['ds'] > forecast['series'].map(last_days)]
+    forecast = forecast.rename(columns={'series': 'series_id'}).reset_index(drop=True)
+    forecast['ds'] = forecast['ds'].dt.date
+
+    keys = pd.DataFrame(
+        [(s.series_id, s.series_type, s.currency, s.series_key) for s in series],
+        columns=['series_id', 'series_type', 'currency', 'series_key']
+    )
+    return forecast.merge(keys, on='series_id')
+
+def forecast_mrr(
+    series_types: List[str] = SERIES_TYPES,
+    periods: int = 30,
+    workers: int = os.cpu_count() or 1,
+    min_history_days: int = MIN_HISTORY_DAYS,
+    seasonality: dict = None,
+    model_dir: Optional[str] = MODEL_STORE_DIR,
+    model: str = MODEL_NAME
+) -> None:
+    try:
+        engine = get_database_connection()
+        with timed('load_series'):
+            series = load_series(engine, series_types, min_history_days)
+            add_rows(len(series))
+        if not series:
+            print("No MRR series with enough history to forecast.")
+            return
+        start = time.perf_counter()
+        if model == MODEL_NAME:
+            print(f"Forecasting {len(series)} series {periods} days ahead with {workers} workers")
+            with timed('forecast_all'):
+                forecasts = forecast_all(series, periods, seasonality or {}, workers, model_dir)
+        else:
+            print(f"Forecasting {len(series)} series {periods} days ahead with {model}")
+            with timed('forecast_baseline'):
+                forecasts = forecast_baseline(series, periods, model)
+        elapsed = time.perf_counter() - start
+        if forecasts.empty:
+            print(f"Every series failed to forecast after {elapsed:.1f}s; mrr_forecasts left unchanged.")
+            return
+
+        with timed('save_forecasts'):
+            rows = save_forecasts(engine, forecasts, model)
+            add_rows(rows)
+        print(f"Saved {rows} forecast rows to mrr_forecasts in {elapsed:.1f}s")
+        for currency, mrr in summarize_forecasts(forecasts).items():
+            print(f"  {currency}: {mrr:,.2f} MRR forecast in {periods} days")
+    except Exception as e:
+        record_error(e)
+        print(f"Error forecasting MRR: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Forecast daily MRR per currency, cohort and segment into mrr_forecasts')
+    parser.add_argument('--series', nargs='+', choices=SERIES_TYPES, default=SERIES_TYPES, help='Series types to forecast')
+    parser.add_argument('--model', choices=[MODEL_NAME] + BASELINE_METHODS, default=MODEL_NAME, help='Prophet, or a vectorized baseline fitting all series at once')
+    parser.add_argument('--periods', type=int, default=30, help='Days to forecast')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Models fitted concurrently')
+    parser.add_argument('--min-history-days', type=int, default=MIN_HISTORY_DAYS, help='Skip series with fewer days of history')
+    parser.add_argument('--yearly-seasonality', action='store_true', help='Fit a yearly seasonal component')
+    parser.add_argument('--no-weekly-seasonality', action='store_true', help='Do not fit a weekly seasonal component')
+    parser.add_argument('--model-dir', default=MODEL_STORE_DIR, help='Where fitted models are kept between runs')
+    parser.add_argument('--no-model-store', action='store_true', help='Fit every series from scratch and keep nothing')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    seasonality = {
+        'yearly_seasonality': args.yearly_seasonality,
+        'weekly_seasonality': not args.no_weekly_seasonality,
+    }
+    model_dir = None if args.no_model_store else args.model_dir
+    with run_report('forecast_mrr', **get_instrumentation_options(args)):
+        forecast_mrr(args.series, args.periods, args.workers, args.min_history_days, seasonality, model_dir, args.model)
+
+if __name__ == "__main__":
+    main()
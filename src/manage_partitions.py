@@ -0,0 +1,56 @@
+import argparse
+from datetime import date, datetime
+from typing import Optional
+from utils.database import get_database_connection
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.partitions import (
+    ARCHIVE_SCHEMA, PARTITIONED_TABLES, add_months, detach_partitions, ensure_partitions, is_partitioned, month_start
+)
+
+def manage_partitions(months_ahead: int = 3, archive_before: Optional[date] = None, drop: bool = False) -> None:
+    """Create upcoming monthly partitions and detach the ones older than archive_before"""
+    try:
+        engine = get_database_connection()
+        current_month = month_start(date.today())
+
+        with engine.connect() as conn:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(conn, table):
+                    print(f"{table} is not partitioned, skipping (see setup_db.py --partitioned)")
+                    continue
+                with timed('ensure_partitions'):
+                    created = ensure_partitions(conn, table, current_month, add_months(current_month, months_ahead))
+                print(f"{table}: created {len(created)} partitions {', '.join(created)}")
+                if archive_before:
+                    with timed('detach_partitions'):
+                        detached = detach_partitions(conn, table, archive_before, None if drop else ARCHIVE_SCHEMA)
+                    action = 'dropped' if drop else f'moved to schema {ARCHIVE_SCHEMA}'
+                    print(f"{table}: detached and {action} {len(detached)} partitions {', '.join(detached)}")
+            conn.commit()
+
+    except Exception as e:
+        record_error(e)
+        print(f"Error managing partitions: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Maintain the monthly partitions of invoices and payments')
+    parser.add_argument('--months-ahead', type=int, default=3, help='Monthly partitions to keep created ahead of the current month')
+    parser.add_argument('--archive-before', help='Detach partitions of months before this one (YYYY-MM)')
+    parser.add_argument('--drop', action='store_true', help='Drop detached partitions instead of archiving them')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+
+    with run_report('manage_partitions', **get_instrumentation_options(args)):
+        try:
+            archive_before = datetime.strptime(args.archive_before, '%Y-%m').date() if args.archive_before else None
+        except ValueError as e:
+            record_error(e)
+            print("Error: Invalid month format. Please use YYYY-MM format.")
+            return
+        manage_partitions(args.months_ahead, archive_before, args.drop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+import asyncpg
+from aiohttp import web
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from calculate_biggest_customer import get_biggest_customers_facts_query, get_biggest_customers_query
+from calculate_churn import get_weekly_metrics_facts_query, get_weekly_metrics_query
+from calculate_mrr import get_mrr_facts_query, get_mrr_query
+from utils.database import get_database_url, get_pool_settings
+from utils.incremental import INGESTION_CHANNEL
+from utils.instrumentation import add_instrumentation_arguments, count, get_instrumentation_options, record_error, run_report
+from utils.result_cache import ResultCache, make_cache_key
+
+QUERIES = {
+    'mrr': {'invoices': get_mrr_query, 'facts': get_mrr_facts_query},
+    'weekly_metrics': {'invoices': get_weekly_metrics_query, 'facts': get_weekly_metrics_facts_query},
+    'biggest_customers': {'invoices': get_biggest_customers_query, 'facts': get_biggest_customers_facts_query},
+}
+
+MAX_LISTEN_RETRY_SECONDS = 30.0
+
+def get_async_engine() -> AsyncEngine:
+    """Return an asyncpg-backed engine using the same URL and pool settings as the CLI scripts"""
+    url = get_database_url().replace('postgresql://', 'postgresql+asyncpg://', 1)
+    return create_async_engine(url, **get_pool_settings())
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def json_response(payload) -> web.Response:
+    return web.Response(text=json.dumps(payload, default=_to_json), content_type='application/json')
+
+async def load_into_cache(app: web.Application, key: tuple, name: str, source: str, params: Optional[dict]) -> list:
+    cache: ResultCache = app['cache']
+    invalidations = cache.invalidations
+    async with app['engine'].connect() as conn:
+        result = await conn.execute(text(QUERIES[name][source]()), params or {})
+        rows = [dict(row) for row in result.mappings().all()]
+    # Rows read across an invalidation may predate that ingestion run: answer with them, but don't keep them.
+    if cache.invalidations == invalidations:
+        cache.set(key, rows)
+    return rows
+
+async def run_cached_query(app: web.Application, name: str, source: str, params: Optional[dict] = None) -> list:
+    """
+    Return the rows of a metric query, serving repeated requests from the result
+    cache. Concurrent misses of one key wait on a single query instead of each
+    running their own.
+    """
+    cache: ResultCache = app['cache']
+    key = make_cache_key(f"{name}:{source}", params)
+    rows = cache.get(key)
+    count(f"{name}_cache_{'hits' if rows is not None else 'misses'}")
+    if rows is not None:
+        return rows
+
+    in_flight = app['in_flight']
+    task = in_flight.get(key)
+    if task is None:
+        task = in_flight[key] = asyncio.create_task(load_into_cache(app, key, name, source, params))
+
+        def forget(done: asyncio.Task) -> None:
+            if in_flight.get(key) is done:
+                del in_flight[key]
+
+        task.add_done_callback(forget)
+    # Shielded, so a client that goes away doesn't cancel the query for the others waiting on it.
+    return await asyncio.shield(task)
+
+def get_source(request: web.Request) -> str:
+    source = request.query.get('source', 'invoices')
+    if source not in ('invoices', 'facts'):
+        raise web.HTTPBadRequest(text="source must be 'invoices' or 'facts'")
+    return source
+
+@web.middleware
+async def record_errors(request: web.Request, handler) -> web.Response:
+    """Keep unexpected handler errors in the run report; HTTP errors are answers, not failures"""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        record_error(e)
+        raise
+
+async def handle_mrr(request: web.Request) -> web.Response:
+    customer_id = request.query.get('customer_id')
+    as_of_date = request.query.get('as_of_date')
+    if not customer_id or not as_of_date:
+        raise web.HTTPBadRequest(text='customer_id and as_of_date are required')
+    try:
+        as_of_date = datetime.strptime(as_of_date, '%Y-%m-%d')
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid date format. Please use YYYY-MM-DD format.')
+    rows = await run_cached_query(
+        request.app, 'mrr', get_source(request), {'customer_id': customer_id, 'as_of_date': as_of_date}
+    )
+    return json_response(rows)
+
+async def handle_weekly_metrics(request: web.Request) -> web.Response:
+    return json_response(await run_cached_query(request.app, 'weekly_metrics', get_source(request)))
+
+async def handle_biggest_customers(request: web.Request) -> web.Response:
+    return json_response(await run_cached_query(request.app, 'biggest_customers', get_source(request)))
+
+async def handle_health(request: web.Request) -> web.Response:
+    return json_response({'status': 'ok', 'cache': request.app['cache'].stats()})
+
+def invalidate_cache(app: web.Application, reason: str) -> None:
+    app['cache'].invalidate()
+    # Queries already running may read pre-ingestion rows, so later misses start their own.
+    app['in_flight'].clear()
+    count('cache_invalidations')
+    print(f"{reason}, result cache invalidated")
+
+async def keep_listening(app: web.Application) -> None:
+    """
+    LISTEN on the ingestion channel, reconnecting with backoff whenever the
+    connection drops. Runs announced while nobody listened are missed, so the
+    cache is invalidated when the connection is lost and again once it is back.
+    """
+    def on_notify(connection, pid, channel, payload):
+        invalidate_cache(app, f"Ingestion completed ({payload})")
+
+    delay = 1.0
+    first_attempt = True
+    while True:
+        lost = asyncio.Event()
+        connection = None
+        try:
+            connection = await asyncpg.connect(get_database_url())
+            connection.add_termination_listener(lambda _: lost.set())
+            await connection.add_listener(INGESTION_CHANNEL, on_notify)
+            if not first_attempt:
+                invalidate_cache(app, 'Listening for ingestion runs again')
+            delay = 1.0
+            await lost.wait()
+            invalidate_cache(app, 'Lost the ingestion channel connection')
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            record_error(e)
+            print(f"Could not listen for ingestion runs ({e}), retrying in {delay:.0f}s")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        first_attempt = False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MAX_LISTEN_RETRY_SECONDS)
+
+async def listen_for_ingestion(app: web.Application):
+    """Invalidate the result cache whenever a loader announces a completed ingestion run"""
+    listener = asyncio.create_task(keep_listening(app))
+    yield
+    listener.cancel()
+    try:
+        await listener
+    except asyncio.CancelledError:
+        pass
+
+async def manage_engine(app: web.Application):
+    app['engine'] = get_async_engine()
+    yield
+    await app['engine'].dispose()
+
+def create_app(cache_ttl: float = 300.0, cache_entries: int = 256) -> web.Application:
+    app = web.Application(middlewares=[record_errors])
+    app['cache'] = ResultCache(max_entries=cache_entries, ttl_seconds=cache_ttl)
+    app['in_flight'] = {}
+    app.cleanup_ctx.append(manage_engine)
+    app.cleanup_ctx.append(listen_for_ingestion)
+    app.router.add_get('/mrr', handle_mrr)
+    app.router.add_get('/weekly-metrics', handle_weekly_metrics)
+    app.router.add_get('/biggest-customers', handle_biggest_customers)
+    app.router.add_get('/health', handle_health)
+    return app
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve MRR, weekly metrics and biggest customers over HTTP')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=int(os.getenv('METRICS_SERVICE_PORT', '8080')), help='Port to listen on')
+    parser.add_argument('--cache-ttl', type=float, default=300.0, help='Seconds a cached result stays valid')
+    parser.add_argument('--cache-entries', type=int, default=256, help='Maximum number of cached results')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    # Requests interleave on one thread, so the report counts cache use and errors rather than timing stages.
+    with run_report('metrics_service', **get_instrumentation_options(args)):
+        web.run_app(create_app(args.cache_ttl, args.cache_entries), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
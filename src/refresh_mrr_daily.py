@@ -0,0 +1,23 @@
+import argparse
+from utils.database import get_database_connection
+from utils.instrumentation import add_instrumentation_arguments, get_instrumentation_options, record_error, run_report
+from utils.mrr_facts import refresh_mrr_daily
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Refresh the mrr_daily fact table and its daily summary')
+    parser.add_argument('--full', action='store_true', help='Rebuild from all invoices instead of only changed customers')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    with run_report('refresh_mrr_daily', **get_instrumentation_options(args)):
+        try:
+            engine = get_database_connection()
+            customers = refresh_mrr_daily(engine, full=args.full)
+            print(f"Refreshed mrr_daily for {customers} customers")
+        except Exception as e:
+            record_error(e)
+            print(f"Error refreshing mrr_daily: {e}")
+
+if __name__ == "__main__":
+    main()
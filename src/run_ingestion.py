@@ -0,0 +1,147 @@
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional
+from utils.database import dispose_engines, get_database_connection
+from utils.bulk_load import rows_per_second
+from utils.incremental import notify_ingestion_complete
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_current_report, get_instrumentation_options, record_error, run_report
+)
+from utils.mrr_facts import refresh_mrr_daily
+from update_customers import load_customers
+from update_invoices import CHUNK_SIZE, load_invoices
+from update_payments import load_payments
+from update_subscriptions import load_subscriptions
+
+class Stage(NamedTuple):
+    name: str
+    depends_on: List[str]
+    run: Callable[[dict], int]
+
+def run_customers(options: dict) -> int:
+    rows, _ = load_customers(get_database_connection())
+    return rows
+
+def run_subscriptions(options: dict) -> int:
+    rows, _ = load_subscriptions(get_database_connection())
+    return rows
+
+def run_invoices(options: dict) -> int:
+    _, rows, _ = load_invoices(get_database_connection(), options['incremental'], options['chunksize'])
+    return rows
+
+def run_payments(options: dict) -> int:
+    rows, _ = load_payments(get_database_connection())
+    return rows
+
+# Foreign-key order: subscriptions and payments reference customers and are derived from invoices.
+STAGES = [
+    Stage('customers', [], run_customers),
+    Stage('invoices', ['customers'], run_invoices),
+    Stage('subscriptions', ['customers', 'invoices'], run_subscriptions),
+    Stage('payments', ['customers', 'invoices'], run_payments),
+]
+
+def run_stage(stage: Stage, options: dict) -> dict:
+    """Run one stage in a worker process and time it, collecting its own run report"""
+    start = time.perf_counter()
+    try:
+        with run_report(stage.name, explain=options.get('explain', False), directory=None) as report:
+            rows = stage.run(options)
+    finally:
+        # The worker may sit idle or exit next; don't leave its connections open on the server.
+        dispose_engines()
+    return {'rows': rows, 'seconds': time.perf_counter() - start, 'report': report.to_dict()}
+
+def run_stages(stages: List[Stage], options: dict, workers: int) -> Dict[str, dict]:
+    """
+    Run stages in a process pool as soon as their dependencies have succeeded.
+
+    A failed stage marks every stage depending on it, directly or not, as skipped.
+    """
+    results: Dict[str, dict] = {}
+    pending = {stage.name: stage for stage in stages}
+    running: Dict[Future, Stage] = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=dispose_engines) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(results.get(dep, {}).get('status') in ('failed', 'skipped') for dep in stage.depends_on):
+                    results[name] = {'status': 'skipped'}
+                    del pending[name]
+                elif all(results.get(dep, {}).get('status') == 'ok' for dep in stage.depends_on):
+                    running[pool.submit(run_stage, stage, options)] = stage
+                    del pending[name]
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = {'status': 'ok', **future.result()}
+                except Exception as e:
+                    record_error(e)
+                    results[stage.name] = {'status': 'failed', 'error': str(e)}
+                    continue
+                report = get_current_report()
+                if report is not None:
+                    report.merge(results[stage.name]['report'], stage.name)
+                    report.add_time(stage.name, results[stage.name]['seconds'])
+    return results
+
+def print_report(results: Dict[str, dict], elapsed: float) -> None:
+    print(f"{'stage':15} {'status':8} {'rows':>10} {'seconds':>9} {'rows/sec':>12}")
+    for name, result in results.items():
+        if result['status'] == 'ok':
+            throughput = rows_per_second(result['rows'], result['seconds'])
+            print(f"{name:15} {'ok':8} {result['rows']:10,} {result['seconds']:9.2f} {throughput:12,.0f}")
+        else:
+            print(f"{name:15} {result['status']:8} {result.get('error', '')}")
+    print(f"Total wall time {elapsed:.2f}s")
+
+def run_ingestion(
+    incremental: bool = False,
+    chunksize: int = CHUNK_SIZE,
+    workers: int = 2,
+    only: Optional[List[str]] = None,
+    explain: bool = False
+) -> None:
+    try:
+        stages = [stage for stage in STAGES if not only or stage.name in only]
+        names = {stage.name for stage in stages}
+        # Dependencies outside the selection are assumed to be loaded already.
+        stages = [stage._replace(depends_on=[d for d in stage.depends_on if d in names]) for stage in stages]
+        options = {'incremental': incremental, 'chunksize': chunksize, 'explain': explain}
+
+        start = time.perf_counter()
+        results = run_stages(stages, options, workers)
+        print_report(results, time.perf_counter() - start)
+
+        engine = get_database_connection()
+        if results.get('invoices', {}).get('status') == 'ok':
+            customers = refresh_mrr_daily(engine)
+            print(f"Refreshed mrr_daily for {customers} customers")
+        for name, result in results.items():
+            if result['status'] == 'ok':
+                notify_ingestion_complete(engine, name)
+
+    except Exception as e:
+        record_error(e)
+        print(f"Error running ingestion: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load customers, subscriptions, invoices and payments in dependency order')
+    parser.add_argument('--incremental', action='store_true', help='Only stage invoices that are new or changed since the last run')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='Number of CSV rows read and loaded per chunk')
+    parser.add_argument('--workers', type=int, default=2, help='Stages run concurrently')
+    parser.add_argument('--only', nargs='+', choices=[stage.name for stage in STAGES], help='Run only these stages')
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args()
+    with run_report('run_ingestion', **get_instrumentation_options(args)):
+        run_ingestion(args.incremental, args.chunksize, args.workers, args.only, args.explain)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,31 @@
-import os
-import psycopg2
+import argparse
+from sqlalchemy import text
+from utils.database import get_database_connection, get_pool_stats
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_instrumentation_options, record_error, run_report, timed
+)
 
 def test_connection() -> None:
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cur = conn.cursor()
+        engine = get_database_connection()
         
-        cur.execute('SELECT version();')
-        version = cur.fetchone()
-        print(f"Connected to PostgreSQL: {version[0]}")
+        with timed('connect'), engine.connect() as conn:
+            version = conn.execute(text('SELECT version();')).scalar()
+            print(f"Connected to PostgreSQL: {version}")
         
-        cur.close()
-        conn.close()
+        print(f"Pool stats: {get_pool_stats(engine)}")
         
     except Exception as e:
+        record_error(e)
         print(f"Error: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Check the database connection and print the pool stats')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('test_connection', **get_instrumentation_options(args)):
+        test_connection()
+
 if __name__ == "__main__":
-    test_connection() 
\ No newline at end of file
+    main()
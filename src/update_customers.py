@@ -1,18 +1,33 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 import pandas as pd
+import argparse
 from datetime import datetime
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from utils.database import get_database_connection
+from utils.exports import get_data_path
+from utils.bulk_load import bulk_upsert, get_merge_query
+from utils.incremental import notify_ingestion_complete
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, count, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.validation import Rule, parse_flags, parsed, required, save_quarantine, validate
+
+CSV_DTYPES = {'id': 'string', 'Tax Location Recognized': 'string'}
 
 def clean_datetime_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Convert datetime columns and handle NaT values"""
-    df['created_at'] = pd.to_datetime(df['created_at'])
+    df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce')
     df['created_date'] = df['created_at'].dt.date
     return df
 
 def clean_boolean_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert boolean columns"""
-    df['tax_location_recognized'] = df['tax_location_recognized'].astype(bool)
+    """Convert TRUE/FALSE flags, leaving missing and malformed flags as NA"""
+    df['tax_location_recognized'] = parse_flags(df['tax_location_recognized'])
+    return df
+
+def fill_missing_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Treat a missing flag as FALSE once the rows are validated"""
+    df['tax_location_recognized'] = df['tax_location_recognized'].fillna(False).astype(bool)
     return df
 
 def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
@@ -24,47 +39,79 @@ def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
     }
     return df.rename(columns=column_mapping)
 
+CUSTOMER_COLUMNS = ['customer_id', 'created_at', 'created_date', 'tax_location_recognized']
+
 def get_upsert_query() -> str:
-    """Return the SQL upsert query"""
-    return """
-        INSERT INTO customers (customer_id, created_at, created_date, tax_location_recognized)
-        VALUES (:customer_id, :created_at, :created_date, :tax_location_recognized)
-        ON CONFLICT (customer_id) 
-        DO UPDATE SET
-            created_at = EXCLUDED.created_at,
-            created_date = EXCLUDED.created_date,
-            tax_location_recognized = EXCLUDED.tax_location_recognized
+    """Return the SQL merging the staged customers into the customers table"""
+    return get_merge_query('customers', 'customers_staging', CUSTOMER_COLUMNS, ['customer_id'])
+
+CUSTOMER_RULES: List[Rule] = [
+    required('customer_id'),
+    required('created_at'),
+    parsed('created_at'),
+    parsed('tax_location_recognized'),
+]
+
+def read_customers(
+    path: Optional[str] = None,
+    on_rejected: Optional[Callable[[pd.DataFrame], None]] = None
+) -> pd.DataFrame:
+    """Read, clean and validate the customers; rows failing CUSTOMER_RULES go to on_rejected"""
+    with timed('read_csv'):
+        raw = rename_columns(pd.read_csv(path or get_data_path('customers.csv'), dtype=CSV_DTYPES))
+        add_rows(len(raw))
+    with timed('clean'):
+        df = clean_datetime_columns(raw.copy(deep=False))
+        df = clean_boolean_columns(df)
+    with timed('validate'):
+        valid, rejected = validate(df, raw, CUSTOMER_RULES, 'customer_id')
+        if on_rejected is not None and not rejected.empty:
+            count('customers_rejected', len(rejected))
+            on_rejected(rejected)
+        return fill_missing_values(df[valid] if not valid.all() else df)
+
+def load_customers(engine: create_engine) -> Tuple[int, float]:
+    """
+    Merge data/customers.csv into the customers table.
+
+    Customers failing validation are written to ingestion_quarantine instead.
+
+    Returns:
+        Tuple[int, float]: Rows loaded and throughput in rows per second.
     """
+    def quarantine(rejected: pd.DataFrame) -> None:
+        with engine.begin() as conn:
+            save_quarantine(conn, rejected, 'customers')
+
+    df = read_customers(on_rejected=quarantine)
+    upsert_query = get_upsert_query()
+    with timed('merge'):
+        rows_per_sec = bulk_upsert(engine, df, 'customers', CUSTOMER_COLUMNS, ['customer_id'], upsert_query)
+        add_rows(len(df))
+    return len(df), rows_per_sec
 
 def update_customers() -> None:
     try:
         engine = get_database_connection()
         
-        df = pd.read_csv('data/customers.csv')
-        
-        df = rename_columns(df)
-        df = clean_datetime_columns(df)
-        df = clean_boolean_columns(df)
-        
-        upsert_query = get_upsert_query()
-        
-        with engine.connect() as conn:
-            for _, row in df.iterrows():
-                conn.execute(
-                    text(upsert_query),
-                    {
-                        'customer_id': row['customer_id'],
-                        'created_at': row['created_at'],
-                        'created_date': row['created_date'],
-                        'tax_location_recognized': row['tax_location_recognized']
-                    }
-                )
-            conn.commit()
+        with timed('load_customers'):
+            rows, rows_per_sec = load_customers(engine)
             
-        print(f"Successfully processed {len(df)} customer records")
+        print(f"Successfully processed {rows} customer records ({rows_per_sec:,.0f} rows/sec)")
+        
+        notify_ingestion_complete(engine, 'customers')
         
     except Exception as e:
+        record_error(e)
         print(f"Error updating customers: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load customers from data/customers.csv into the database')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('update_customers', **get_instrumentation_options(args)):
+        update_customers()
+
 if __name__ == "__main__":
-    update_customers() 
\ No newline at end of file
+    main() 
\ No newline at end of file
@@ -0,0 +1,40 @@
+import argparse
+from utils.database import get_database_connection
+from utils.fx import FX_RATES_FILE, DAILY_RATES_HORIZON_DAYS, get_reporting_currency, read_fx_rates_csv, save_fx_rates
+from utils.incremental import notify_ingestion_complete
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.mrr_facts import refresh_mrr_daily
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load dated FX rates and rebuild the reporting-currency MRR facts')
+    parser.add_argument('--file', default=FX_RATES_FILE, help='CSV of date, currency and per_eur (units of currency per EUR)')
+    parser.add_argument('--horizon-days', type=int, default=DAILY_RATES_HORIZON_DAYS, help='Days the last rate is carried forward past today')
+    parser.add_argument('--no-refresh', action='store_true', help='Only load the rates, leaving mrr_daily as it is')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    with run_report('update_fx_rates', **get_instrumentation_options(args)):
+        try:
+            engine = get_database_connection()
+            with timed('read_csv'):
+                rates = read_fx_rates_csv(args.file)
+                add_rows(len(rates))
+            with timed('save_fx_rates'):
+                days = save_fx_rates(engine, rates, args.horizon_days)
+            print(f"Loaded {len(rates)} rates for {rates['currency'].nunique()} currencies ({days} daily rates)")
+            if not args.no_refresh:
+                # Every fact row may convert differently, so the refresh cannot be incremental.
+                with timed('refresh_mrr_daily'):
+                    customers = refresh_mrr_daily(engine, full=True)
+                print(f"Rebuilt mrr_daily for {customers} customers in {get_reporting_currency()}")
+            # Cached reporting amounts are stale once the rates, and any facts rebuilt from them, are committed.
+            notify_ingestion_complete(engine, 'fx_rates')
+        except Exception as e:
+            record_error(e)
+            print(f"Error updating FX rates: {e}")
+
+if __name__ == "__main__":
+    main()
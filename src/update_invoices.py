@@ -1,41 +1,90 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 import pandas as pd
 import numpy as np
+import argparse
+import time
 from datetime import datetime
+from typing import Callable, Collection, Iterator, List, Optional, Sequence, Tuple
 from utils.database import get_database_connection
+from utils.exports import get_data_path
+from utils.instrumentation import (
+    add_instrumentation_arguments, add_rows, count, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.bulk_load import get_existing_keys, get_merge_query, get_primary_key_columns, merge_dataframe, rows_per_second
+from utils.mrr_facts import refresh_mrr_daily
+from utils.partitions import ensure_partitions_for
+from utils.validation import (
+    Rule, between, not_after, one_of, parse_flags, parsed, references, required, save_quarantine, validate
+)
+from utils.incremental import (
+    compute_row_hashes, filter_changed_rows, latest, notify_ingestion_complete, save_row_hashes, update_watermark
+)
+
+CHUNK_SIZE = 50_000
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
+NUMERIC_COLUMNS = [
+    'amount_due', 'subtotal', 'tax', 'tax_percent', 'total',
+    'amount_paid', 'total_discount_amount', 'exclusive_tax_amount',
+    'inclusive_tax_amount', 'starting_balance', 'ending_balance'
+]
+
+DATETIME_COLUMNS = [
+    'created_at', 'due_date', 'paid_at', 'marked_uncollectible_at',
+    'voided_at', 'finalized_at', 'period_start', 'period_end',
+    'min_line_item_period_start', 'max_line_item_period_end'
+]
+
+BOOLEAN_COLUMNS = ['is_paid', 'is_closed', 'is_forgiven']
+
+ACCEPTED_CURRENCIES = ['eur', 'usd', 'gbp']
+
+# Explicit CSV dtypes; amounts are left to the C parser with decimal=',' so they
+# arrive as float64 directly. Tax Percent is exported with '.' decimals and is
+# normalised in clean_numeric_columns. Flags are parsed in clean_boolean_columns
+# so that malformed values can be quarantined instead of failing the read.
+CSV_DTYPES = {
+    'id': 'string',
+    'Customer': 'string',
+    'Subscription': 'string',
+    'Status': 'string',
+    'Currency': 'string',
+    'Applied Coupons': 'string',
+    'Tax Percent': 'string',
+    'Paid': 'string',
+    'Closed': 'string',
+    'Forgiven': 'string',
+}
 
 def clean_numeric_columns(df):
-    """Convert numeric columns from string with commas to float"""
-    numeric_columns = [
-        'amount_due', 'subtotal', 'tax', 'tax_percent', 'total',
-        'amount_paid', 'total_discount_amount', 'exclusive_tax_amount',
-        'inclusive_tax_amount', 'starting_balance', 'ending_balance'
-    ]
-    for col in numeric_columns:
-        df[col] = df[col].astype(str)
-        df[col] = df[col].str.replace(',', '.')
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+    """Convert numeric columns from string with commas to float, leaving malformed values as NaN"""
+    for col in NUMERIC_COLUMNS:
+        if not pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype(str).str.replace(',', '.')
+            df[col] = pd.to_numeric(df[col], errors='coerce')
     return df
 
 def clean_datetime_columns(df):
-    """Convert datetime columns and handle NaT values"""
-    datetime_columns = [
-        'created_at', 'due_date', 'paid_at', 'marked_uncollectible_at',
-        'voided_at', 'finalized_at', 'period_start', 'period_end',
-        'min_line_item_period_start', 'max_line_item_period_end'
-    ]
-    for col in datetime_columns:
-        df[col] = pd.to_datetime(df[col])
-        df[col] = df[col].replace({pd.NaT: None})
+    """Convert datetime columns, keeping NaT so the columns stay datetime64"""
+    for col in DATETIME_COLUMNS:
+        df[col] = pd.to_datetime(df[col], format=DATETIME_FORMAT, errors='coerce')
     
-    df['created_date'] = df['created_at'].dt.date
+    df['created_date'] = df['created_at'].dt.normalize()
     return df
 
 def clean_boolean_columns(df):
-    """Convert boolean columns"""
-    boolean_columns = ['is_paid', 'is_closed', 'is_forgiven']
-    for col in boolean_columns:
-        df[col] = df[col].astype(bool)
+    """Convert TRUE/FALSE flags, leaving missing and malformed flags as NA"""
+    for col in BOOLEAN_COLUMNS:
+        df[col] = parse_flags(df[col])
+    return df
+
+def fill_missing_values(df):
+    """Default the optional amounts to 0 and the flags to FALSE, once the rows are validated"""
+    for col in NUMERIC_COLUMNS:
+        df[col] = df[col].fillna(0.0)
+    for col in BOOLEAN_COLUMNS:
+        df[col] = df[col].fillna(False).astype(bool)
     return df
 
 def clean_string_columns(df):
@@ -79,85 +128,166 @@ def rename_columns(df):
     }
     return df.rename(columns=column_mapping)
 
-def get_upsert_query():
-    """Return the SQL upsert query"""
-    return """
-        INSERT INTO invoices (
-            invoice_id, customer_id, subscription_id, status, currency,
-            amount_due, subtotal, tax, tax_percent, total,
-            amount_paid, total_discount_amount, exclusive_tax_amount, inclusive_tax_amount,
-            starting_balance, ending_balance, created_at, created_date,
-            due_date, paid_at, marked_uncollectible_at, voided_at,
-            finalized_at, period_start, period_end,
-            min_line_item_period_start, max_line_item_period_end,
-            is_paid, is_closed, is_forgiven, applied_coupons
-        )
-        VALUES (
-            :invoice_id, :customer_id, :subscription_id, :status, :currency,
-            :amount_due, :subtotal, :tax, :tax_percent, :total,
-            :amount_paid, :total_discount_amount, :exclusive_tax_amount, :inclusive_tax_amount,
-            :starting_balance, :ending_balance, :created_at, :created_date,
-            :due_date, :paid_at, :marked_uncollectible_at, :voided_at,
-            :finalized_at, :period_start, :period_end,
-            :min_line_item_period_start, :max_line_item_period_end,
-            :is_paid, :is_closed, :is_forgiven, :applied_coupons
-        )
-        ON CONFLICT (invoice_id) 
-        DO UPDATE SET
-            customer_id = EXCLUDED.customer_id,
-            subscription_id = EXCLUDED.subscription_id,
-            status = EXCLUDED.status,
-            currency = EXCLUDED.currency,
-            amount_due = EXCLUDED.amount_due,
-            subtotal = EXCLUDED.subtotal,
-            tax = EXCLUDED.tax,
-            tax_percent = EXCLUDED.tax_percent,
-            total = EXCLUDED.total,
-            amount_paid = EXCLUDED.amount_paid,
-            total_discount_amount = EXCLUDED.total_discount_amount,
-            exclusive_tax_amount = EXCLUDED.exclusive_tax_amount,
-            inclusive_tax_amount = EXCLUDED.inclusive_tax_amount,
-            starting_balance = EXCLUDED.starting_balance,
-            ending_balance = EXCLUDED.ending_balance,
-            created_at = EXCLUDED.created_at,
-            created_date = EXCLUDED.created_date,
-            due_date = EXCLUDED.due_date,
-            paid_at = EXCLUDED.paid_at,
-            marked_uncollectible_at = EXCLUDED.marked_uncollectible_at,
-            voided_at = EXCLUDED.voided_at,
-            finalized_at = EXCLUDED.finalized_at,
-            period_start = EXCLUDED.period_start,
-            period_end = EXCLUDED.period_end,
-            min_line_item_period_start = EXCLUDED.min_line_item_period_start,
-            max_line_item_period_end = EXCLUDED.max_line_item_period_end,
-            is_paid = EXCLUDED.is_paid,
-            is_closed = EXCLUDED.is_closed,
-            is_forgiven = EXCLUDED.is_forgiven,
-            applied_coupons = EXCLUDED.applied_coupons
+INVOICE_COLUMNS = [
+    'invoice_id', 'customer_id', 'subscription_id', 'status', 'currency',
+    'amount_due', 'subtotal', 'tax', 'tax_percent', 'total',
+    'amount_paid', 'total_discount_amount', 'exclusive_tax_amount', 'inclusive_tax_amount',
+    'starting_balance', 'ending_balance', 'created_at', 'created_date',
+    'due_date', 'paid_at', 'marked_uncollectible_at', 'voided_at',
+    'finalized_at', 'period_start', 'period_end',
+    'min_line_item_period_start', 'max_line_item_period_end',
+    'is_paid', 'is_closed', 'is_forgiven', 'applied_coupons'
+]
+
+def get_upsert_query(key_columns: Sequence[str] = ('invoice_id',)):
+    """
+    Return the SQL merging the staged invoices into the invoices table.
+
+    key_columns is the conflict target; a partitioned invoices table is keyed on
+    (invoice_id, created_at).
     """
+    return get_merge_query(
+        'invoices', 'invoices_staging', INVOICE_COLUMNS, key_columns,
+        skip_unchanged=True, touch_column='updated_at'
+    )
 
-def update_invoices():
+def get_invoice_rules(customer_ids: Optional[Collection[str]] = None) -> List[Rule]:
+    """
+    Rules every invoice must pass before it is loaded.
+
+    Negative totals and balances are legitimate credit notes, so only the amounts
+    that can never be negative are range-checked. The customer reference is only
+    checked when customer_ids is given.
+    """
+    rules = [required('invoice_id'), required('customer_id'), required('currency'), required('created_at')]
+    rules += [parsed(col) for col in NUMERIC_COLUMNS + DATETIME_COLUMNS + BOOLEAN_COLUMNS]
+    rules += [
+        one_of('currency', ACCEPTED_CURRENCIES),
+        between('amount_due', 0, np.inf),
+        between('amount_paid', 0, np.inf),
+        between('tax_percent', 0, 100),
+        not_after('period_start', 'period_end'),
+    ]
+    if customer_ids is not None:
+        rules.append(references('customer_id', customer_ids))
+    return rules
+
+def read_invoice_chunks(
+    path: Optional[str] = None,
+    chunksize: int = CHUNK_SIZE,
+    customer_ids: Optional[Collection[str]] = None,
+    on_rejected: Optional[Callable[[pd.DataFrame], None]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield cleaned and validated invoice chunks of at most chunksize rows.
+
+    path defaults to invoices.csv in DATA_DIR. Rows failing get_invoice_rules
+    are dropped; on_rejected, when given, receives them per chunk as record_id,
+    reasons, payload.
+    """
+    rules = get_invoice_rules(customer_ids)
+    reader = iter(pd.read_csv(path or get_data_path('invoices.csv'), chunksize=chunksize, dtype=CSV_DTYPES, decimal=','))
+    while True:
+        with timed('read_csv'):
+            raw = next(reader, None)
+            if raw is None:
+                return
+            add_rows(len(raw))
+        with timed('clean'):
+            raw = rename_columns(raw)
+            # A shallow copy: cleaning replaces whole columns, so raw keeps only the
+            # original values of the converted ones, and shares the rest with chunk.
+            chunk = clean_numeric_columns(raw.copy(deep=False))
+            chunk = clean_datetime_columns(chunk)
+            chunk = clean_boolean_columns(chunk)
+            chunk = clean_string_columns(chunk)
+        with timed('validate'):
+            valid, rejected = validate(chunk, raw, rules, 'invoice_id')
+            if on_rejected is not None and not rejected.empty:
+                count('invoices_rejected', len(rejected))
+                on_rejected(rejected)
+            # The payloads of the rejected rows are built; drop the raw values before yielding.
+            del raw, rejected
+            chunk = fill_missing_values(chunk[valid] if not valid.all() else chunk)
+        yield chunk
+
+def load_invoices(engine: create_engine, incremental: bool = False, chunksize: int = CHUNK_SIZE) -> Tuple[int, int, int]:
+    """
+    Merge data/invoices.csv into the invoices table, chunk by chunk, in one transaction.
+
+    Invoices failing validation, including those referencing unknown customers,
+    are written to ingestion_quarantine instead.
+
+    Returns:
+        Tuple[int, int, int]: Rows loaded, rows new or changed, and rows quarantined.
+    """
+    total_rows = 0
+    rows = 0
+    quarantined = 0
+    max_created_at = None
+    max_finalized_at = None
+    
+    with engine.connect() as conn:
+        key_columns = get_primary_key_columns(conn, 'invoices')
+        upsert_query = get_upsert_query(key_columns)
+        customer_ids = get_existing_keys(conn, 'customers', 'customer_id')
+
+        def quarantine(rejected: pd.DataFrame) -> None:
+            nonlocal quarantined
+            quarantined += save_quarantine(conn, rejected, 'invoices')
+
+        for df in read_invoice_chunks(chunksize=chunksize, customer_ids=customer_ids, on_rejected=quarantine):
+            total_rows += len(df)
+            with timed('filter_changed'):
+                if incremental:
+                    df = filter_changed_rows(conn, df, 'invoices', 'invoice_id', INVOICE_COLUMNS)
+                else:
+                    df = df.assign(row_hash=compute_row_hashes(df, INVOICE_COLUMNS))
+            with timed('merge'):
+                ensure_partitions_for(conn, 'invoices', df['created_at'])
+                merged = merge_dataframe(conn, df, 'invoices', INVOICE_COLUMNS, key_columns, upsert_query)
+                add_rows(merged)
+                rows += merged
+            with timed('save_row_hashes'):
+                save_row_hashes(conn, df, 'invoices', 'invoice_id')
+            max_created_at = latest(max_created_at, df['created_at'].max())
+            max_finalized_at = latest(max_finalized_at, df['finalized_at'].max())
+        update_watermark(conn, 'invoices', max_created_at, max_finalized_at, rows)
+        conn.commit()
+    return total_rows, rows, quarantined
+
+def update_invoices(incremental: bool = False, chunksize: int = CHUNK_SIZE):
     try:
         engine = get_database_connection()
         
-        df = pd.read_csv('data/invoices.csv')
-        df = rename_columns(df)
-        df = clean_numeric_columns(df)
-        df = clean_datetime_columns(df)
-        df = clean_boolean_columns(df)
-        df = clean_string_columns(df)
+        start = time.perf_counter()
+        with timed('load_invoices'):
+            total_rows, rows, quarantined = load_invoices(engine, incremental, chunksize)
+        rows_per_sec = rows_per_second(rows, time.perf_counter() - start)
+        count('invoices_quarantined', quarantined)
+            
+        print(f"Successfully processed {total_rows} invoice records, {rows} new or changed ({rows_per_sec:,.0f} rows/sec)")
+        if quarantined:
+            print(f"Quarantined {quarantined} invalid invoice records, see ingestion_quarantine")
         
-        upsert_query = get_upsert_query()
+        customers = refresh_mrr_daily(engine)
+        print(f"Refreshed mrr_daily for {customers} customers")
         
-        with engine.connect() as conn:
-            for _, row in df.iterrows():
-                conn.execute(text(upsert_query), row.to_dict())
-            conn.commit()
-            
-        print(f"Successfully processed {len(df)} invoice records")
+        notify_ingestion_complete(engine, 'invoices')
         
     except Exception as e:
+        record_error(e)
         print(f"Error updating invoices: {e}")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load invoices from data/invoices.csv into the database')
+    parser.add_argument('--incremental', action='store_true', help='Only stage invoices that are new or changed since the last run')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='Number of CSV rows read and loaded per chunk')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('update_invoices', **get_instrumentation_options(args)):
+        update_invoices(incremental=args.incremental, chunksize=args.chunksize)
+
 if __name__ == "__main__":
-    update_invoices() 
\ No newline at end of file
+    main()
\ No newline at end of file
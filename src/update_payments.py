@@ -0,0 +1,104 @@
+from sqlalchemy import create_engine, text
+import argparse
+import pandas as pd
+import time
+from typing import Tuple
+from utils.database import get_database_connection
+from utils.bulk_load import get_merge_query, get_primary_key_columns, get_staging_table_query, rows_per_second
+from utils.incremental import notify_ingestion_complete
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_instrumentation_options, record_error, run_report, timed
+)
+from utils.partitions import ensure_partitions_for
+
+PAYMENT_COLUMNS = [
+    'payment_id', 'customer_id', 'invoice_id', 'amount', 'currency',
+    'payment_method', 'status', 'created_at', 'created_date'
+]
+
+def get_derive_payments_query() -> str:
+    """
+    Return the SQL staging one succeeded payment per paid invoice of the invoices table.
+
+    The invoice export carries no payment records, so the payment is dated at
+    paid_at for amount_paid, and its id is the invoice id with a py_ prefix.
+    The payment method is not exported and stays NULL.
+    """
+    return f"""
+    INSERT INTO payments_staging ({', '.join(PAYMENT_COLUMNS)})
+    SELECT
+        'py_' || CASE WHEN LEFT(invoice_id, 3) = 'in_' THEN SUBSTRING(invoice_id FROM 4) ELSE invoice_id END,
+        customer_id,
+        invoice_id,
+        amount_paid,
+        currency,
+        NULL,
+        'succeeded',
+        paid_at,
+        paid_at::date
+    FROM invoices
+    WHERE is_paid
+    AND paid_at IS NOT NULL
+    AND amount_paid > 0;
+    """
+
+def get_upsert_query(key_columns=('payment_id',)) -> str:
+    """Return the SQL merging the staged payments into the payments table"""
+    return get_merge_query(
+        'payments', 'payments_staging', PAYMENT_COLUMNS, key_columns,
+        skip_unchanged=True
+    )
+
+def load_payments(engine: create_engine) -> Tuple[int, int]:
+    """
+    Derive payments from the invoices table and merge them into the payments table.
+
+    Must run after customers and invoices are loaded. The derivation runs in
+    Postgres, so invoices.csv is not read again; payments of unknown customers
+    are skipped.
+
+    Returns:
+        Tuple[int, int]: Payments loaded and payments skipped.
+    """
+    with engine.connect() as conn:
+        key_columns = get_primary_key_columns(conn, 'payments')
+        conn.execute(text(get_staging_table_query('payments', 'payments_staging')))
+        staged = conn.execute(text(get_derive_payments_query())).rowcount
+        skipped = conn.execute(text("""
+            DELETE FROM payments_staging p
+            WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.customer_id = p.customer_id)
+        """)).rowcount
+        first, last = conn.execute(text("SELECT MIN(created_at), MAX(created_at) FROM payments_staging")).one()
+        ensure_partitions_for(conn, 'payments', pd.Series([first, last]))
+        conn.execute(text(get_upsert_query(key_columns)))
+        conn.execute(text("DROP TABLE payments_staging"))
+        conn.commit()
+    return staged - skipped, skipped
+
+def update_payments() -> None:
+    try:
+        engine = get_database_connection()
+        
+        start = time.perf_counter()
+        with timed('load_payments'):
+            rows, skipped = load_payments(engine)
+        rows_per_sec = rows_per_second(rows, time.perf_counter() - start)
+        
+        print(f"Successfully processed {rows} payments, skipped {skipped} of unknown customers ({rows_per_sec:,.0f} rows/sec)")
+        
+        notify_ingestion_complete(engine, 'payments')
+        
+    except Exception as e:
+        record_error(e)
+        print(f"Error updating payments: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Derive payments from the loaded invoices and merge them into the payments table')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('update_payments', **get_instrumentation_options(args)):
+        update_payments()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from sqlalchemy import create_engine, text
+import argparse
+import time
+from typing import Tuple
+from utils.database import get_database_connection
+from utils.bulk_load import get_merge_query, get_staging_table_query, rows_per_second
+from utils.churn_engine import GRACE_DAYS
+from utils.incremental import notify_ingestion_complete
+from utils.instrumentation import (
+    add_instrumentation_arguments, get_instrumentation_options, record_error, run_report, timed
+)
+
+SUBSCRIPTION_COLUMNS = [
+    'subscription_id', 'customer_id', 'status', 'created_at', 'created_date',
+    'current_period_start', 'current_period_end'
+]
+
+def get_derive_subscriptions_query() -> str:
+    """
+    Return the SQL staging one row per subscription, derived from the loaded invoices.
+
+    A subscription invoice is created at the end of a period and its line items
+    bill the next one, so the current period is the line-item period of the
+    latest invoice. Subscriptions whose current period ends more than GRACE_DAYS
+    before the horizon (the latest invoice) are canceled.
+    """
+    return f"""
+    INSERT INTO subscriptions_staging ({', '.join(SUBSCRIPTION_COLUMNS)})
+    SELECT
+        subscription_id,
+        customer_id,
+        CASE WHEN current_period_end >= horizon - INTERVAL '{GRACE_DAYS} days' THEN 'active' ELSE 'canceled' END,
+        created_at,
+        created_at::date,
+        current_period_start,
+        current_period_end
+    FROM (
+        SELECT DISTINCT ON (subscription_id)
+            subscription_id,
+            customer_id,
+            MIN(LEAST(period_start, created_at)) OVER (PARTITION BY subscription_id) as created_at,
+            COALESCE(min_line_item_period_start, period_start) as current_period_start,
+            COALESCE(max_line_item_period_end, period_end) as current_period_end,
+            MAX(created_at) OVER () as horizon
+        FROM invoices
+        WHERE subscription_id IS NOT NULL
+        AND created_at IS NOT NULL
+        ORDER BY subscription_id, created_at DESC, invoice_id DESC
+    ) as latest;
+    """
+
+def get_upsert_query() -> str:
+    """Return the SQL merging the staged subscriptions into the subscriptions table"""
+    return get_merge_query(
+        'subscriptions', 'subscriptions_staging', SUBSCRIPTION_COLUMNS, ['subscription_id'],
+        skip_unchanged=True
+    )
+
+def load_subscriptions(engine: create_engine) -> Tuple[int, int]:
+    """
+    Derive subscriptions from the invoices table and merge them into the subscriptions table.
+
+    Must run after invoices are loaded. The derivation runs in Postgres, so
+    invoices.csv is not read again. Subscriptions of customers missing from the
+    customers table are skipped, as they would violate the foreign key.
+
+    Returns:
+        Tuple[int, int]: Subscriptions loaded and subscriptions skipped.
+    """
+    with engine.connect() as conn:
+        conn.execute(text(get_staging_table_query('subscriptions', 'subscriptions_staging')))
+        staged = conn.execute(text(get_derive_subscriptions_query())).rowcount
+        skipped = conn.execute(text("""
+            DELETE FROM subscriptions_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.customer_id = s.customer_id)
+        """)).rowcount
+        conn.execute(text(get_upsert_query()))
+        conn.execute(text("DROP TABLE subscriptions_staging"))
+        conn.commit()
+    return staged - skipped, skipped
+
+def update_subscriptions() -> None:
+    try:
+        engine = get_database_connection()
+        
+        start = time.perf_counter()
+        with timed('load_subscriptions'):
+            rows, skipped = load_subscriptions(engine)
+        rows_per_sec = rows_per_second(rows, time.perf_counter() - start)
+        
+        print(f"Successfully processed {rows} subscriptions, skipped {skipped} of unknown customers ({rows_per_sec:,.0f} rows/sec)")
+        
+        notify_ingestion_complete(engine, 'subscriptions')
+        
+    except Exception as e:
+        record_error(e)
+        print(f"Error updating subscriptions: {e}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Derive subscriptions from the loaded invoices and merge them into the subscriptions table')
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args()
+    with run_report('update_subscriptions', **get_instrumentation_options(args)):
+        update_subscriptions()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.fetch import BIND_PARAMETER, to_cents
+from utils.fx import EARLIEST_INVOICE_DAY_QUERY, FX_RATES_FILE, FxRates, read_fx_rates_csv
+from utils.instrumentation import record_query
+from utils.snapshots import SNAPSHOT_DIR, get_snapshot_path
+
+POSTGRES = 'postgres'
+DUCKDB = 'duckdb'
+BACKENDS = [POSTGRES, DUCKDB]
+
+# Snapshots written by export_snapshots.py, exposed as tables of the same name,
+# with the money columns the snapshots hold as floats cast back to the
+# NUMERIC(15,2) of the Postgres tables, so sums come out exact to the cent.
+SNAPSHOT_TABLES = {
+    'invoices': [
+        'amount_due', 'subtotal', 'tax', 'total', 'amount_paid', 'total_discount_amount',
+        'exclusive_tax_amount', 'inclusive_tax_amount', 'starting_balance', 'ending_balance',
+    ],
+    'customers': [],
+}
+
+# Arrow types read into the nullable pandas types utils.fetch gives Postgres results.
+_PANDAS_TYPES = {
+    pa.int16(): pd.Int64Dtype(),
+    pa.int32(): pd.Int64Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
+
+
+def to_duckdb_parameters(query: str) -> str:
+    """Rewrite SQLAlchemy-style :name parameters as DuckDB's $name"""
+    return BIND_PARAMETER.sub(r'$\1', query)
+
+
+class DuckDbBackend:
+    """
+    In-process DuckDB over the Parquet snapshots, for batch reports that should
+    not need Postgres.
+
+    The snapshots are exposed as views named like the Postgres tables, and the
+    FX rates file as fx_rates_daily, so the calculators' queries run unchanged.
+    Results come back as Arrow tables and are handed to pandas without building
+    a Python object per row. Postgres remains the system of record: re-export
+    the snapshots to pick up newly loaded data.
+    """
+
+    def __init__(self, snapshot_dir: str = SNAPSHOT_DIR, fx_file: str = FX_RATES_FILE) -> None:
+        import duckdb
+
+        self.conn = duckdb.connect()
+        for name, money_columns in SNAPSHOT_TABLES.items():
+            path = get_snapshot_path(name, snapshot_dir)
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"No {name} snapshot in {snapshot_dir}; run src/export_snapshots.py first")
+            pattern = os.path.join(path, '**', '*.parquet').replace("'", "''")
+            replace = ', '.join(f"CAST({column} AS DECIMAL(15, 2)) AS {column}" for column in money_columns)
+            self.conn.execute(
+                f"CREATE VIEW {name} AS SELECT *{f' REPLACE ({replace})' if replace else ''} "
+                f"FROM read_parquet('{pattern}', hive_partitioning = true)"
+            )
+
+        rates = read_fx_rates_csv(fx_file) if os.path.exists(fx_file) else pd.DataFrame(columns=['rate_date', 'currency', 'per_eur'])
+        self.fx = FxRates(rates)
+        if self.fx.empty:
+            daily = pa.table({'currency': pa.array([], pa.string()), 'day': pa.array([], pa.date32()), 'per_eur': pa.array([], pa.float64())})
+        else:
+            first_day = self.conn.execute(EARLIEST_INVOICE_DAY_QUERY).fetchone()[0]
+            daily = pa.Table.from_pandas(self.fx.daily_to_horizon(first_day=first_day), preserve_index=False)
+        self.conn.register('fx_rates_daily', daily)
+
+    def query(self, query: str, params: Optional[dict] = None, cents: Iterable[str] = ()) -> pd.DataFrame:
+        """
+        Run a query written for Postgres and return its result with the column
+        types of utils.fetch.fetch_dataframe: DECIMAL columns as float64, or
+        int64 cents for those named in cents.
+        """
+        start = time.perf_counter()
+        table = self.conn.execute(to_duckdb_parameters(query), params or {}).to_arrow_table()
+        record_query(time.perf_counter() - start, query)
+        cents = tuple(cents)
+        # DECIMAL columns kept as cents go through their exact text, like NUMERIC in fetch_dataframe.
+        table = pa.table(
+            [
+                column.cast(pa.string() if name in cents else pa.float64()) if pa.types.is_decimal(column.type) else column
+                for name, column in zip(table.column_names, table.columns)
+            ],
+            names=table.column_names,
+        )
+        df = table.to_pandas(types_mapper=_PANDAS_TYPES.get, date_as_object=False)
+        for column in cents:
+            df[column] = to_cents(df[column])
+        return df
+
+    def get_recent_weeks_start(self, weeks: int) -> Optional[datetime]:
+        """Same as utils.partitions.get_recent_weeks_start, over the invoices snapshot"""
+        return self.conn.execute("""
+            SELECT DATE_TRUNC('week', MAX(created_at)) - to_weeks(CAST($weeks AS INTEGER) - 1)
+            FROM invoices
+            WHERE is_forgiven = FALSE
+        """, {'weeks': weeks}).fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
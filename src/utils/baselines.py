@@ -0,0 +1,295 @@
+from itertools import product
+from statistics import NormalDist
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.timeseries import check_timeseries_index
+
+BASELINE_METHODS = ["seasonal_naive", "holt_winters", "linear_trend"]
+
+# Smoothing parameters tried for every series at once; each series keeps the
+# combination with the lowest one-step-ahead squared error.
+HOLT_WINTERS_GRID = {
+    "alpha": [0.1, 0.3, 0.5, 0.8],
+    "beta": [0.01, 0.1, 0.3],
+    "gamma": [0.05, 0.2, 0.4],
+}
+
+
+def series_starts(values: np.ndarray) -> np.ndarray:
+    """Column of each series' first value; series shorter than the array lead with NaN"""
+    return np.isnan(values).argmin(axis=1)
+
+
+def seasonal_naive(values: np.ndarray, forecast_periods: int, season_length: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Repeat the last season of every series.
+
+    Parameters:
+        values (np.ndarray): History, one row per series and one column per period,
+            NaN before a series starts.
+        forecast_periods (int): Number of periods to forecast.
+        season_length (int): Periods per season, e.g. 7 for weekly seasonality in daily data.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Fitted history (NaN for each series' first season) and forecasts.
+    """
+    n_series, n_periods = values.shape
+    fitted = np.full_like(values, np.nan)
+    fitted[:, season_length:] = values[:, :-season_length]
+    last_season = values[:, n_periods - season_length:]
+    forecasts = last_season[:, np.arange(forecast_periods) % season_length]
+    return fitted, forecasts
+
+
+def _smooth(
+    values: np.ndarray,
+    alpha: np.ndarray,
+    beta: np.ndarray,
+    gamma: np.ndarray,
+    season_length: int,
+    keep_fitted: bool = True,
+):
+    """
+    Run the additive Holt-Winters recursion once over time.
+
+    alpha, beta and gamma broadcast against (series,), so a leading grid axis
+    smooths every series with every parameter combination in the same pass.
+    Each series' states are initialised from its own first seasons and only
+    updated from its first value on, so series of different lengths share the
+    pass without being padded.
+
+    Returns:
+        tuple: Final level, trend and seasonal states, the one-step-ahead fitted
+        values (None unless keep_fitted), and the squared errors summed after the
+        first season.
+    """
+    n_series, n_periods = values.shape
+    shape = np.broadcast_shapes(alpha.shape, (n_series,))
+    start = series_starts(values)
+    rows = np.arange(n_series)[:, None]
+    offsets = np.arange(season_length)
+
+    first_season = values[rows, np.minimum(start[:, None] + offsets, n_periods - 1)]
+    second_season = values[rows, np.minimum(start[:, None] + season_length + offsets, n_periods - 1)]
+    first = first_season.mean(axis=1)
+    trend0 = np.where(
+        n_periods - start >= 2 * season_length, (second_season.mean(axis=1) - first) / season_length, 0.0
+    )
+    initial_seasonal = np.empty((n_series, season_length))
+    initial_seasonal[rows, (start[:, None] + offsets) % season_length] = first_season - first[:, None]
+    level = np.broadcast_to(first, shape).copy()
+    trend = np.broadcast_to(trend0, shape).copy()
+    seasonal = np.broadcast_to(initial_seasonal, shape + (season_length,)).copy()
+
+    fitted = np.empty(shape + (n_periods,)) if keep_fitted else None
+    errors = np.zeros(shape)
+    for t in range(n_periods):
+        active = t >= start
+        season = seasonal[..., t % season_length]
+        prediction = level + trend + season
+        y = values[:, t]
+        if keep_fitted:
+            fitted[..., t] = np.where(active, prediction, np.nan)
+        errors += np.where(t >= start + season_length, (prediction - y) ** 2, 0.0)
+        previous_level = level
+        level = np.where(active, alpha * (y - season) + (1 - alpha) * (level + trend), level)
+        trend = np.where(active, beta * (level - previous_level) + (1 - beta) * trend, trend)
+        seasonal[..., t % season_length] = np.where(active, gamma * (y - level) + (1 - gamma) * season, season)
+
+    return level, trend, seasonal, fitted, errors
+
+
+def holt_winters(values: np.ndarray, forecast_periods: int, season_length: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Additive Holt-Winters exponential smoothing for every series at once.
+
+    A first pass smooths all series with every HOLT_WINTERS_GRID combination to
+    pick each series' parameters; a second pass refits with the chosen ones. The
+    recursion loops over time only, so the cost grows with the history length,
+    not with the number of series.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Fitted history (one-step-ahead) and forecasts.
+    """
+    n_periods = values.shape[1]
+    grid = np.array(list(product(*HOLT_WINTERS_GRID.values())))
+    *_, errors = _smooth(values, grid[:, 0, None], grid[:, 1, None], grid[:, 2, None], season_length, keep_fitted=False)
+    alpha, beta, gamma = grid[errors.argmin(axis=0)].T
+
+    level, trend, seasonal, fitted, _ = _smooth(values, alpha, beta, gamma, season_length)
+    steps = np.arange(1, forecast_periods + 1)
+    season_index = (n_periods + steps - 1) % season_length
+    forecasts = level[:, None] + trend[:, None] * steps + seasonal[:, season_index]
+    return fitted, forecasts
+
+
+def linear_trend(values: np.ndarray, forecast_periods: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Least-squares line through every series, over each series' own values.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Fitted history (NaN before each series starts) and forecasts.
+    """
+    n_periods = values.shape[1]
+    t = np.arange(n_periods)
+    observed = ~np.isnan(values)
+    weights = observed.astype(float)
+    count = weights.sum(axis=1)
+    t_mean = weights @ t / count
+    y = np.nan_to_num(values)
+    y_mean = (weights * y).sum(axis=1) / count
+    t_centered = (t - t_mean[:, None]) * weights
+    spread = (t_centered ** 2).sum(axis=1)
+    slope = np.divide(((y - y_mean[:, None]) * t_centered).sum(axis=1), spread, out=np.zeros_like(spread), where=spread > 0)
+    intercept = y_mean - slope * t_mean
+    fitted = np.where(observed, intercept[:, None] + slope[:, None] * t, np.nan)
+    future = np.arange(n_periods, n_periods + forecast_periods)
+    return fitted, intercept[:, None] + slope[:, None] * future
+
+
+class BaselineModelBuilder:
+    """
+    Vectorized baseline forecasters over many series at once.
+
+    Mirrors ProphetModelBuilder: data has a DatetimeIndex, each horizon is
+    predicted once and cached, and generate_forecasts / generate_confidence_intervals return
+    'ds' with 'yhat' or 'lower_bound' / 'upper_bound', covering the history and the
+    forecast periods, with a 'series' column naming the target column.
+
+    Each column is a series from its first to its last value; missing days in
+    between carry no revenue. Series are right-aligned on their last day into
+    one 2-D array, NaN before each series starts, so all of them are fitted in
+    the same pass, each on its own span, and each forecast starts after its own
+    last day.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        target_columns: Optional[list[str]] = None,
+        method: str = "holt_winters",
+        season_length: int = 7,
+        interval_width: float = 0.8,
+        n_bootstrap: int = 200,
+        seed: int = 0,
+    ):
+        check_timeseries_index(data)
+        if method not in BASELINE_METHODS:
+            raise ValueError(f"Unknown method {method}, expected one of {BASELINE_METHODS}")
+        self.data = data
+        self.target_columns = target_columns or list(data.columns)
+        self.method = method
+        self.season_length = season_length
+        self.interval_width = interval_width
+        self.n_bootstrap = n_bootstrap
+        self.rng = np.random.default_rng(seed)
+        raw = data[self.target_columns].to_numpy(dtype=float, na_value=np.nan).T
+        observed = ~np.isnan(raw)
+        if not observed.any(axis=1).all():
+            empty = [c for c, has_values in zip(self.target_columns, observed.any(axis=1)) if not has_values]
+            raise ValueError(f"Series without values: {', '.join(map(str, empty))}")
+        self.first = observed.argmax(axis=1)
+        self.last = raw.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+        n_periods = int((self.last - self.first).max()) + 1
+        # Column j of a series holds its value n_periods - 1 - j days before its last one.
+        source = self.last[:, None] - (n_periods - 1 - np.arange(n_periods))
+        aligned = np.take_along_axis(np.nan_to_num(raw, nan=0.0), np.maximum(source, 0), axis=1)
+        self.values = np.where(source >= self.first[:, None], aligned, np.nan)
+        self.start = series_starts(self.values)
+        self._forecasts: dict[int, pd.DataFrame] = {}
+
+    def _predict(self, forecast_periods: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple: Point values, lower and upper bounds over the history and the forecast periods.
+        """
+        if self.method == "seasonal_naive":
+            fitted, forecasts = seasonal_naive(self.values, forecast_periods, self.season_length)
+        elif self.method == "holt_winters":
+            fitted, forecasts = holt_winters(self.values, forecast_periods, self.season_length)
+        else:
+            fitted, forecasts = linear_trend(self.values, forecast_periods)
+
+        residuals = self.values - fitted
+        z = NormalDist().inv_cdf(0.5 + self.interval_width / 2)
+        sigma = np.nanstd(residuals, axis=1, keepdims=True)
+        if self.method == "linear_trend":
+            lower, upper = self._bootstrap_bounds(forecasts, np.nan_to_num(residuals))
+        else:
+            # Errors compound with the horizon; seasonal naive only steps once per season.
+            steps = np.arange(1, forecast_periods + 1)
+            if self.method == "seasonal_naive":
+                steps = (steps - 1) // self.season_length + 1
+            spread = z * sigma * np.sqrt(steps)
+            lower, upper = forecasts - spread, forecasts + spread
+
+        return (
+            np.hstack([fitted, forecasts]),
+            np.hstack([fitted - z * sigma, lower]),
+            np.hstack([fitted + z * sigma, upper]),
+        )
+
+    def _bootstrap_bounds(self, forecasts: np.ndarray, residuals: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Resample each series' residuals onto its forecasts and take the interval quantiles"""
+        n_series, n_periods = residuals.shape
+        # Draw only from each series' own span.
+        draws = self.start[None, :, None] + self.rng.integers(
+            0, (n_periods - self.start)[None, :, None], size=(self.n_bootstrap, n_series, forecasts.shape[1])
+        )
+        samples = forecasts[None] + np.take_along_axis(residuals[None], draws, axis=2)
+        tail = (1 - self.interval_width) / 2
+        lower, upper = np.quantile(samples, [tail, 1 - tail], axis=0)
+        return lower, upper
+
+    def forecast(self, forecast_periods: int) -> pd.DataFrame:
+        """
+        Predict the history and the next forecast_periods of every series in a single pass.
+
+        Returns:
+            pd.DataFrame: 'series', 'ds', 'yhat', 'yhat_lower' and 'yhat_upper', from
+            each series' first day to forecast_periods past its last day.
+        """
+        if forecast_periods not in self._forecasts:
+            yhat, lower, upper = self._predict(forecast_periods)
+            freq = self.data.index.freq or "D"
+            dates = pd.date_range(self.data.index[0], periods=len(self.data.index) + forecast_periods, freq=freq)
+            n_periods = self.values.shape[1]
+            positions = np.arange(yhat.shape[1])
+            kept = positions[None, :] >= self.start[:, None]
+            day_index = self.last[:, None] - (n_periods - 1) + positions[None, :]
+            self._forecasts[forecast_periods] = pd.DataFrame({
+                "series": np.repeat(self.target_columns, kept.sum(axis=1)),
+                "ds": dates[day_index[kept]],
+                "yhat": yhat[kept],
+                "yhat_lower": lower[kept],
+                "yhat_upper": upper[kept],
+            })
+        return self._forecasts[forecast_periods]
+
+    def generate_forecasts(self, forecast_periods: int) -> pd.DataFrame:
+        """
+        Generate forecasts for every series.
+
+        Parameters:
+            forecast_periods (int): Number of periods to forecast.
+
+        Returns:
+            pd.DataFrame: Forecasted values.
+        """
+        return self.forecast(forecast_periods)[["series", "ds", "yhat"]]
+
+    def generate_confidence_intervals(self, forecast_periods: int) -> pd.DataFrame:
+        """
+        Generate confidence intervals for the forecasts of every series.
+
+        Parameters:
+            forecast_periods (int): Number of periods to forecast.
+
+        Returns:
+            pd.DataFrame: DataFrame with 'lower_bound' and 'upper_bound' columns.
+        """
+        conf_int = self.forecast(forecast_periods)[["series", "ds", "yhat_lower", "yhat_upper"]]
+        return conf_int.rename(columns={"yhat_lower": "lower_bound", "yhat_upper": "upper_bound"})
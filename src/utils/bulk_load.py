@@ -0,0 +1,146 @@
+import io
+import time
+from typing import List, Optional, Sequence, Set
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+NULL_MARKER = '\\N'
+
+
+def get_staging_table_query(table: str, staging_table: str) -> str:
+    """Return the SQL creating a transaction-scoped staging copy of a table"""
+    return f"""
+        CREATE TEMP TABLE {staging_table}
+        (LIKE {table} INCLUDING DEFAULTS)
+        ON COMMIT DROP
+    """
+
+
+def get_merge_query(
+    table: str,
+    staging_table: str,
+    columns: Sequence[str],
+    key_columns: Sequence[str],
+    skip_unchanged: bool = False,
+    touch_column: Optional[str] = None,
+) -> str:
+    """
+    Return a set-based upsert from the staging table into the target table.
+
+    With skip_unchanged, conflicting rows are only rewritten when at least one
+    column differs from the stored row, so re-loading identical data produces no
+    dead tuples. touch_column, if given, is set to NOW() on every rewritten row.
+    """
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+    value_columns = [col for col in columns if col not in key_columns]
+    updates = [f"{col} = EXCLUDED.{col}" for col in value_columns]
+    if touch_column:
+        updates.append(f"{touch_column} = NOW()")
+    update_list = ',\n            '.join(updates)
+    query = f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list}
+        FROM {staging_table}
+        ON CONFLICT ({key_list})
+        DO UPDATE SET
+            {update_list}
+    """
+    if skip_unchanged:
+        stored = ', '.join(f"{table}.{col}" for col in value_columns)
+        excluded = ', '.join(f"EXCLUDED.{col}" for col in value_columns)
+        query += f"""
+        WHERE ({stored})
+            IS DISTINCT FROM ({excluded})
+    """
+    return query
+
+
+def get_primary_key_columns(conn, table: str) -> List[str]:
+    """Return a table's primary key columns in key order, e.g. to pick the ON CONFLICT target"""
+    result = conn.execute(text("""
+        SELECT a.attname
+        FROM pg_index i
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY as k(attnum, position)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = to_regclass(:table)
+        AND i.indisprimary
+        ORDER BY k.position
+    """), {'table': table})
+    return [row[0] for row in result]
+
+
+def get_existing_keys(conn, table: str, column: str) -> Set[str]:
+    """Return the values of a key column, e.g. to drop rows that would violate a foreign key"""
+    return {row[0] for row in conn.execute(text(f"SELECT {column} FROM {table}"))}
+
+
+def copy_dataframe(conn, df: pd.DataFrame, table: str, columns: Sequence[str]) -> None:
+    """Stream a DataFrame into a table with COPY FROM STDIN"""
+    buffer = io.StringIO()
+    df[list(columns)].to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+    buffer.seek(0)
+
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')"
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+
+def merge_dataframe(
+    conn,
+    df: pd.DataFrame,
+    table: str,
+    columns: List[str],
+    key_columns: List[str],
+    upsert_query: str,
+) -> int:
+    """
+    Stage a DataFrame and merge it into a table on an open connection.
+
+    Rows are deduplicated on the key columns (last row wins, as with the previous
+    row-by-row upsert), copied into a temporary staging table and merged with a
+    single INSERT ... ON CONFLICT statement. The caller owns the transaction.
+
+    Returns:
+        int: Number of rows staged.
+    """
+    staging_table = f"{table}_staging"
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+
+    conn.execute(text(get_staging_table_query(table, staging_table)))
+    copy_dataframe(conn, df, staging_table, columns)
+    conn.execute(text(upsert_query))
+    conn.execute(text(f"DROP TABLE {staging_table}"))
+    return len(df)
+
+
+def bulk_upsert(
+    engine: create_engine,
+    df: pd.DataFrame,
+    table: str,
+    columns: List[str],
+    key_columns: List[str],
+    upsert_query: str,
+) -> float:
+    """
+    Load a DataFrame into a table through a temporary staging table.
+
+    Returns:
+        float: Throughput of the load in rows per second.
+    """
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        rows = merge_dataframe(conn, df, table, columns, key_columns, upsert_query)
+        conn.commit()
+    elapsed = time.perf_counter() - start
+
+    return rows_per_second(rows, elapsed)
+
+
+def rows_per_second(rows: int, elapsed: float) -> float:
+    """Return a load throughput, guarding against a zero elapsed time"""
+    return rows / elapsed if elapsed > 0 else float('inf')
@@ -0,0 +1,245 @@
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOW = 28
+DEFAULT_MIN_PERIODS = 7
+DEFAULT_Z_THRESHOLD = 3.0
+DEFAULT_MAD_THRESHOLD = 3.5
+DEFAULT_CUSUM_DRIFT = 0.5
+DEFAULT_CUSUM_THRESHOLD = 5.0
+
+# Scale factor making the MAD a consistent estimator of the standard deviation.
+MAD_SCALE = 0.6745
+STD_FLOOR = 1e-9
+
+
+def _cusum(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized one-sided CUSUM, S_t = max(0, S_{t-1} + x_t) with S_0 = 0.
+
+    The recursion unrolls to S_t = C_t - min(0, min_{j<=t} C_j) where C is the
+    cumulative sum of x, so it needs no Python loop.
+    """
+    c = np.cumsum(x)
+    return c - np.minimum(np.minimum.accumulate(c), 0.0)
+
+
+def detect_changes(
+    values: np.ndarray,
+    window: int = DEFAULT_WINDOW,
+    min_periods: int = DEFAULT_MIN_PERIODS,
+    z_threshold: float = DEFAULT_Z_THRESHOLD,
+    mad_threshold: float = DEFAULT_MAD_THRESHOLD,
+    cusum_drift: float = DEFAULT_CUSUM_DRIFT,
+    cusum_threshold: float = DEFAULT_CUSUM_THRESHOLD,
+) -> pd.DataFrame:
+    """
+    Score every day of a daily series for significant changes in one NumPy pass.
+
+    Each day-over-day delta is compared with the deltas of the trailing window
+    (excluding itself) using a rolling z-score and a robust z-score based on the
+    median absolute deviation. A two-sided CUSUM over the z-scores catches slow
+    drifts that no single day would flag. Days before min_periods deltas are
+    available score 0.
+
+    Parameters:
+        values (np.ndarray): Daily values, oldest first, without gaps.
+
+    Returns:
+        pd.DataFrame: delta, zscore, robust_z, cusum_pos, cusum_neg and
+        is_significant per input position.
+    """
+    values = np.asarray(values, dtype='float64')
+    n = len(values)
+    delta = np.diff(values, prepend=values[:1]) if n else values.copy()
+    if n:
+        delta[0] = 0.0
+
+    zscore = np.zeros(n)
+    robust_z = np.zeros(n)
+
+    # Deltas 1..n-1 are real; history for position t is delta[max(1, t - window):t].
+    padded = np.concatenate([np.full(window, np.nan), delta[1:]])
+    if n > 1:
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)[:n - 1]
+        counts = np.sum(~np.isnan(windows), axis=1)
+        valid = counts >= min_periods
+        # Rows without enough history are zeroed so the nan-reductions stay quiet; they are masked below.
+        history = np.where(valid[:, None], windows, 0.0)
+        mean = np.nanmean(history, axis=1)
+        std = np.nanstd(history, axis=1)
+        median = np.nanmedian(history, axis=1)
+        mad = np.nanmedian(np.abs(history - median[:, None]), axis=1)
+        current = delta[1:]
+        z = (current - mean) / np.maximum(std, STD_FLOOR)
+        rz = MAD_SCALE * (current - median) / np.maximum(mad, STD_FLOOR)
+        zscore[1:] = np.where(valid, z, 0.0)
+        robust_z[1:] = np.where(valid, rz, 0.0)
+
+    cusum_pos = _cusum(zscore - cusum_drift)
+    cusum_neg = _cusum(-zscore - cusum_drift)
+    prev_pos = np.concatenate([[0.0], cusum_pos[:-1]])
+    prev_neg = np.concatenate([[0.0], cusum_neg[:-1]])
+    cusum_alarm = ((cusum_pos > cusum_threshold) & (prev_pos <= cusum_threshold)) | \
+        ((cusum_neg > cusum_threshold) & (prev_neg <= cusum_threshold))
+
+    return pd.DataFrame({
+        'delta': delta,
+        'zscore': zscore,
+        'robust_z': robust_z,
+        'cusum_pos': cusum_pos,
+        'cusum_neg': cusum_neg,
+        'is_significant': (np.abs(zscore) > z_threshold) | (np.abs(robust_z) > mad_threshold) | cusum_alarm,
+    })
+
+
+class ChangeDetector:
+    """
+    Incremental counterpart of detect_changes().
+
+    Keeps only the trailing window of deltas, their running mean and sum of
+    squared deviations, and the CUSUM accumulators, so the z-score and CUSUM of a
+    new day cost O(1). The running moments are updated as a delta enters and the
+    oldest leaves the window, and recomputed from the window once per window
+    length of updates so rounding cannot build up.
+
+    The robust z-score still scans the window: a median has no running-sum form,
+    and the MAD is a median of deviations from that median, so every deviation
+    changes whenever the median moves. With windows of a few weeks the scan is a
+    small np.median call.
+
+    Feeding a series through update() yields the same scores as detect_changes().
+    """
+
+    def __init__(
+        self,
+        window: int = DEFAULT_WINDOW,
+        min_periods: int = DEFAULT_MIN_PERIODS,
+        z_threshold: float = DEFAULT_Z_THRESHOLD,
+        mad_threshold: float = DEFAULT_MAD_THRESHOLD,
+        cusum_drift: float = DEFAULT_CUSUM_DRIFT,
+        cusum_threshold: float = DEFAULT_CUSUM_THRESHOLD,
+    ) -> None:
+        self.window = window
+        self.min_periods = min_periods
+        self.z_threshold = z_threshold
+        self.mad_threshold = mad_threshold
+        self.cusum_drift = cusum_drift
+        self.cusum_threshold = cusum_threshold
+        self.deltas: deque = deque(maxlen=window)
+        self.last_value: Optional[float] = None
+        self.last_day: Optional[str] = None
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.updates_since_resync = 0
+
+    def _resync(self) -> None:
+        """Recompute the running moments from the window"""
+        history = np.fromiter(self.deltas, dtype='float64')
+        self.mean = float(history.mean()) if len(history) else 0.0
+        self.m2 = float(np.sum((history - self.mean) ** 2))
+        self.updates_since_resync = 0
+
+    def _push(self, delta: float) -> None:
+        """Append a delta, evicting the oldest once the window is full, and update the moments (Welford)"""
+        if len(self.deltas) == self.window:
+            evicted = self.deltas[0]
+            self.deltas.append(delta)
+            mean = self.mean + (delta - evicted) / self.window
+            self.m2 += (delta - evicted) * (delta - mean + evicted - self.mean)
+            self.mean = mean
+        else:
+            self.deltas.append(delta)
+            mean = self.mean + (delta - self.mean) / len(self.deltas)
+            self.m2 += (delta - self.mean) * (delta - mean)
+            self.mean = mean
+        self.updates_since_resync += 1
+        if self.updates_since_resync >= self.window:
+            self._resync()
+
+    def update(self, value: float, day: Optional[str] = None) -> dict:
+        """Score the next day of the series and fold it into the state"""
+        value = float(value)
+        delta = 0.0 if self.last_value is None else value - self.last_value
+        zscore = 0.0
+        robust_z = 0.0
+
+        if self.last_value is not None and len(self.deltas) >= self.min_periods:
+            std = np.sqrt(max(self.m2, 0.0) / len(self.deltas))
+            zscore = (delta - self.mean) / max(std, STD_FLOOR)
+            history = np.fromiter(self.deltas, dtype='float64')
+            median = np.median(history)
+            robust_z = MAD_SCALE * (delta - median) / max(np.median(np.abs(history - median)), STD_FLOOR)
+
+        prev_pos, prev_neg = self.cusum_pos, self.cusum_neg
+        self.cusum_pos = max(0.0, prev_pos + zscore - self.cusum_drift)
+        self.cusum_neg = max(0.0, prev_neg - zscore - self.cusum_drift)
+        cusum_alarm = (self.cusum_pos > self.cusum_threshold >= prev_pos) or \
+            (self.cusum_neg > self.cusum_threshold >= prev_neg)
+
+        if self.last_value is not None:
+            self._push(delta)
+        self.last_value = value
+        self.last_day = day
+
+        return {
+            'delta': delta,
+            'zscore': zscore,
+            'robust_z': robust_z,
+            'cusum_pos': self.cusum_pos,
+            'cusum_neg': self.cusum_neg,
+            'is_significant': bool(
+                abs(zscore) > self.z_threshold or abs(robust_z) > self.mad_threshold or cusum_alarm
+            ),
+        }
+
+    @classmethod
+    def from_scores(cls, values: np.ndarray, scores: pd.DataFrame, last_day: Optional[str] = None, **params) -> 'ChangeDetector':
+        """Build the state reached after a series scored by detect_changes(), without replaying it"""
+        detector = cls(**params)
+        if len(values):
+            detector.deltas.extend(scores['delta'].to_numpy()[1:][-detector.window:].tolist())
+            detector.last_value = float(values[-1])
+            detector.last_day = last_day
+            detector.cusum_pos = float(scores['cusum_pos'].iloc[-1])
+            detector.cusum_neg = float(scores['cusum_neg'].iloc[-1])
+            detector._resync()
+        return detector
+
+    def to_dict(self) -> dict:
+        return {
+            'window': self.window,
+            'min_periods': self.min_periods,
+            'z_threshold': self.z_threshold,
+            'mad_threshold': self.mad_threshold,
+            'cusum_drift': self.cusum_drift,
+            'cusum_threshold': self.cusum_threshold,
+            'deltas': list(self.deltas),
+            'last_value': self.last_value,
+            'last_day': self.last_day,
+            'cusum_pos': self.cusum_pos,
+            'cusum_neg': self.cusum_neg,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'ChangeDetector':
+        detector = cls(
+            window=state['window'],
+            min_periods=state['min_periods'],
+            z_threshold=state['z_threshold'],
+            mad_threshold=state['mad_threshold'],
+            cusum_drift=state['cusum_drift'],
+            cusum_threshold=state['cusum_threshold'],
+        )
+        detector.deltas.extend(state['deltas'])
+        detector.last_value = state['last_value']
+        detector.last_day = state['last_day']
+        detector.cusum_pos = state['cusum_pos']
+        detector.cusum_neg = state['cusum_neg']
+        detector._resync()
+        return detector
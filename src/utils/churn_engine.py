@@ -0,0 +1,208 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.mrr_facts import DAYS_PER_MONTH
+
+GRACE_DAYS = 3
+
+PERIOD_FREQUENCIES = {
+    'month': 'MS',
+    'week': 'W-MON',
+}
+
+MRR_EVENT_KINDS = ['new', 'expansion', 'contraction', 'churn']
+
+
+def _merge_intervals(df: pd.DataFrame, key_columns: List[str], start_column: str, end_column: str, grace_days: int) -> pd.Series:
+    """
+    Number the runs of overlapping or adjacent periods within each key, in one sorted pass.
+
+    df must be sorted by key_columns then start_column. A row opens a new run when
+    it starts more than grace_days after the latest end seen so far for its key.
+    """
+    run_end = df.groupby(key_columns, sort=False)[end_column].cummax()
+    prev_run_end = run_end.groupby([df[c] for c in key_columns], sort=False).shift()
+    opens_run = prev_run_end.isna() | (df[start_column] > prev_run_end + pd.Timedelta(days=grace_days))
+    return opens_run.cumsum()
+
+
+def build_subscription_intervals(
+    invoices: pd.DataFrame,
+    horizon: Optional[pd.Timestamp] = None,
+    grace_days: int = GRACE_DAYS,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Derive each subscription's active intervals and MRR events from its invoices.
+
+    Invoices are merged into intervals on period_start/period_end. A subscription
+    invoice is created at its period_end and bills the next cycle, so an
+    interval stays covered until the latest max_line_item_period_end, when that
+    column is present. MRR is the invoice total over its billing period; invoices
+    with a zero-length period bill their line-item period instead, when
+    min_line_item_period_start and max_line_item_period_end are present.
+
+    Parameters:
+        invoices (pd.DataFrame): subscription_id, customer_id, currency,
+            period_start, period_end and total of non-forgiven invoices, plus
+            optionally min_line_item_period_start, max_line_item_period_end
+            and created_at.
+        horizon (pd.Timestamp): End of the observed data. Intervals reaching it
+            (within grace_days) are still open and do not churn. Defaults to
+            the latest invoice created_at, i.e. when the export was taken.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: One row per subscription interval, and
+        one row per MRR event (new, expansion, contraction, churn).
+    """
+    df = invoices.dropna(subset=['subscription_id', 'period_start', 'period_end']).copy()
+    df['period_start'] = pd.to_datetime(df['period_start'])
+    df['period_end'] = pd.to_datetime(df['period_end'])
+    df['covered_until'] = df['period_end']
+    if 'max_line_item_period_end' in df.columns:
+        df['covered_until'] = pd.to_datetime(df['max_line_item_period_end']).fillna(df['period_end']).clip(lower=df['period_end'])
+    if horizon is None:
+        horizon = pd.to_datetime(df['created_at']).max() if 'created_at' in df.columns else df['period_end'].max()
+
+    billed_start, billed_end = df['period_start'], df['period_end']
+    if 'min_line_item_period_start' in df.columns and 'max_line_item_period_end' in df.columns:
+        zero_length = billed_end.dt.normalize() <= billed_start.dt.normalize()
+        billed_start = billed_start.mask(zero_length, pd.to_datetime(df['min_line_item_period_start'])).fillna(df['period_start'])
+        billed_end = billed_end.mask(zero_length, pd.to_datetime(df['max_line_item_period_end'])).fillna(df['period_end'])
+    period_days = (billed_end.dt.normalize() - billed_start.dt.normalize()).dt.days.clip(lower=1)
+    df['mrr'] = df['total'].astype(float) / period_days * DAYS_PER_MONTH
+
+    df = df.sort_values(['subscription_id', 'period_start'], kind='mergesort').reset_index(drop=True)
+    df['interval_no'] = _merge_intervals(df, ['subscription_id'], 'period_start', 'covered_until', grace_days)
+
+    grouped = df.groupby('interval_no', sort=False)
+    intervals = grouped.agg(
+        subscription_id=('subscription_id', 'first'),
+        customer_id=('customer_id', 'last'),
+        currency=('currency', 'last'),
+        interval_start=('period_start', 'first'),
+        interval_end=('covered_until', 'max'),
+        start_mrr=('mrr', 'first'),
+        end_mrr=('mrr', 'last'),
+    ).reset_index(drop=True)
+    intervals['is_open'] = intervals['interval_end'] >= horizon - pd.Timedelta(days=grace_days)
+
+    first_in_interval = df['interval_no'].ne(df['interval_no'].shift())
+    level_change = df['mrr'] - df['mrr'].shift()
+    changes = df[~first_in_interval & level_change.ne(0)]
+    changes = pd.DataFrame({
+        'currency': changes['currency'],
+        'customer_id': changes['customer_id'],
+        'event_date': changes['period_start'],
+        'kind': np.where(level_change[changes.index] > 0, 'expansion', 'contraction'),
+        'mrr_delta': level_change[changes.index],
+    })
+    starts = pd.DataFrame({
+        'currency': intervals['currency'],
+        'customer_id': intervals['customer_id'],
+        'event_date': intervals['interval_start'],
+        'kind': 'new',
+        'mrr_delta': intervals['start_mrr'],
+    })
+    closed = intervals[~intervals['is_open']]
+    ends = pd.DataFrame({
+        'currency': closed['currency'],
+        'customer_id': closed['customer_id'],
+        'event_date': closed['interval_end'],
+        'kind': 'churn',
+        'mrr_delta': -closed['end_mrr'],
+    })
+    events = pd.concat([starts, changes, ends], ignore_index=True)
+    return intervals, events
+
+
+def build_customer_intervals(intervals: pd.DataFrame, horizon: pd.Timestamp, grace_days: int = GRACE_DAYS) -> pd.DataFrame:
+    """Merge subscription intervals into the periods each customer had any active subscription, per currency"""
+    df = intervals.sort_values(['customer_id', 'currency', 'interval_start'], kind='mergesort').reset_index(drop=True)
+    df['run_no'] = _merge_intervals(df, ['customer_id', 'currency'], 'interval_start', 'interval_end', grace_days)
+    customers = df.groupby('run_no', sort=False).agg(
+        customer_id=('customer_id', 'first'),
+        currency=('currency', 'first'),
+        interval_start=('interval_start', 'first'),
+        interval_end=('interval_end', 'max'),
+    ).reset_index(drop=True)
+    customers['is_open'] = customers['interval_end'] >= horizon - pd.Timedelta(days=grace_days)
+    return customers
+
+
+def compute_period_churn(
+    events: pd.DataFrame,
+    customer_intervals: pd.DataFrame,
+    horizon: pd.Timestamp,
+    period: str = 'month',
+) -> pd.DataFrame:
+    """
+    Sweep the sorted MRR and customer events into per-period churn metrics.
+
+    Starting MRR and starting customers of a period are the running totals of all
+    events dated before it; flows inside the period are summed by kind.
+    """
+    if events.empty:
+        return pd.DataFrame()
+    first = events['event_date'].min().normalize()
+    if period == 'month':
+        anchor = first.replace(day=1)
+    else:
+        anchor = first - pd.Timedelta(days=first.weekday())
+    period_starts = pd.date_range(anchor, max(horizon, anchor), freq=PERIOD_FREQUENCIES[period])
+
+    def assign_period(dates: pd.Series) -> np.ndarray:
+        return np.searchsorted(period_starts.values, dates.values, side='right') - 1
+
+    customer_events = pd.concat([
+        pd.DataFrame({
+            'currency': customer_intervals['currency'],
+            'event_date': customer_intervals['interval_start'],
+            'customer_delta': 1,
+            'churned_customers': 0,
+        }),
+        pd.DataFrame({
+            'currency': customer_intervals.loc[~customer_intervals['is_open'], 'currency'],
+            'event_date': customer_intervals.loc[~customer_intervals['is_open'], 'interval_end'],
+            'customer_delta': -1,
+            'churned_customers': 1,
+        }),
+    ], ignore_index=True)
+
+    events = events.assign(period=assign_period(events['event_date']))
+    customer_events = customer_events.assign(period=assign_period(customer_events['event_date']))
+
+    flows = events.pivot_table(
+        index=['currency', 'period'], columns='kind', values='mrr_delta', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=MRR_EVENT_KINDS, fill_value=0.0)
+    customers = customer_events.groupby(['currency', 'period'])[['customer_delta', 'churned_customers']].sum()
+
+    full_index = pd.MultiIndex.from_product(
+        [sorted(events['currency'].unique()), range(len(period_starts))], names=['currency', 'period']
+    )
+    table = flows.join(customers, how='outer').reindex(full_index).fillna(0.0)
+
+    net_mrr = table[MRR_EVENT_KINDS].sum(axis=1)
+    table['starting_mrr'] = net_mrr.groupby(level='currency').cumsum() - net_mrr
+    table['starting_customers'] = table['customer_delta'].groupby(level='currency').cumsum() - table['customer_delta']
+
+    result = pd.DataFrame({
+        'period_start': period_starts[table.index.get_level_values('period')],
+        'currency': table.index.get_level_values('currency'),
+        'starting_mrr': table['starting_mrr'].to_numpy(),
+        'new_mrr': table['new'].to_numpy(),
+        'expansion_mrr': table['expansion'].to_numpy(),
+        'contraction_mrr': 0.0 - table['contraction'].to_numpy(),
+        'churned_mrr': 0.0 - table['churn'].to_numpy(),
+        'starting_customers': table['starting_customers'].to_numpy().astype(int),
+        'churned_customers': table['churned_customers'].to_numpy().astype(int),
+    })
+    starting_mrr = result['starting_mrr'].where(result['starting_mrr'] > 0)
+    starting_customers = result['starting_customers'].where(result['starting_customers'] > 0)
+    result['logo_churn_rate'] = result['churned_customers'] / starting_customers
+    result['gross_revenue_churn_rate'] = (result['churned_mrr'] + result['contraction_mrr']) / starting_mrr
+    result['net_revenue_churn_rate'] = (
+        result['churned_mrr'] + result['contraction_mrr'] - result['expansion_mrr']
+    ) / starting_mrr
+    return result.sort_values(['currency', 'period_start']).reset_index(drop=True)
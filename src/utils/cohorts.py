@@ -0,0 +1,294 @@
+import os
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from utils.fetch import fetch_dataframe
+from utils.incremental import get_commit_safe_watermark
+from utils.mrr_facts import DAYS_PER_MONTH
+
+COHORT_MATRIX_FILE = 'output/cohort_matrix.npz'
+
+COHORT_METRICS = ['mrr', 'active_customers', 'retention', 'revenue_retention']
+
+
+def get_cohort_sizes_query() -> str:
+    """Customers acquired per month, read through idx_customers_created_date"""
+    return """
+    SELECT
+        DATE_TRUNC('month', created_date)::date as cohort_month,
+        COUNT(*) as customers
+    FROM customers
+    WHERE created_date IS NOT NULL
+    AND created_date < :to_month
+    GROUP BY 1
+    ORDER BY 1;
+    """
+
+
+def get_cohort_activity_query() -> str:
+    """
+    Average MRR and active customers per cohort, activity month and currency.
+
+    Average MRR is the month's summed daily amounts expressed as a monthly rate,
+    so partial months of a subscription are weighted by the days they cover.
+    """
+    return f"""
+    SELECT
+        DATE_TRUNC('month', c.created_date)::date as cohort_month,
+        DATE_TRUNC('month', d.day)::date as activity_month,
+        d.currency,
+        SUM(d.daily_amount) * {DAYS_PER_MONTH}
+            / ((DATE_TRUNC('month', d.day) + INTERVAL '1 month')::date - DATE_TRUNC('month', d.day)::date) as mrr,
+        COUNT(DISTINCT d.customer_id) as active_customers
+    FROM mrr_daily d
+    JOIN customers c ON c.customer_id = d.customer_id
+    WHERE c.created_date IS NOT NULL
+    AND d.day >= :from_month
+    AND d.day < :to_month
+    GROUP BY 1, 2, 3;
+    """
+
+
+def _to_utc(value: Optional[datetime]) -> np.datetime64:
+    if value is None:
+        return np.datetime64('NaT', 'us')
+    return np.datetime64(pd.Timestamp(value).tz_convert('UTC').tz_localize(None), 'us')
+
+
+def _month_index(months, origin: np.datetime64) -> np.ndarray:
+    return (np.asarray(months, dtype='datetime64[M]') - origin).astype('int64')
+
+
+class CohortMatrix:
+    """
+    Dense cohort x months-since-join matrices, one plane per currency.
+
+    mrr[c, i, k] and active_customers[c, i, k] hold the cohort acquired in month
+    first_cohort + i, k months after it joined, in currencies[c]. cohort_sizes[i]
+    is the number of customers acquired in that month, in any currency. Months up
+    to closed_through have been read, from mrr_daily as of facts_through;
+    refreshes add the months after it and re-read the closed months whose facts
+    changed since.
+    """
+
+    def __init__(self) -> None:
+        self.first_cohort: Optional[np.datetime64] = None
+        self.closed_through: Optional[np.datetime64] = None
+        self.facts_through: Optional[datetime] = None
+        self.currencies: List[str] = []
+        self.cohort_sizes = np.zeros(0, dtype='int64')
+        self.mrr = np.zeros((0, 0, 0), dtype='float64')
+        self.active_customers = np.zeros((0, 0, 0), dtype='int64')
+
+    @property
+    def cohorts(self) -> np.ndarray:
+        if self.first_cohort is None:
+            return np.array([], dtype='datetime64[M]')
+        return self.first_cohort + np.arange(len(self.cohort_sizes))
+
+    def _resize(self, n_currencies: int, n_cohorts: int, n_offsets: int) -> None:
+        """Grow every array to at least the given shape, keeping existing cells"""
+        shape = (
+            max(n_currencies, self.mrr.shape[0]),
+            max(n_cohorts, self.mrr.shape[1]),
+            max(n_offsets, self.mrr.shape[2]),
+        )
+        if shape == self.mrr.shape:
+            return
+        mrr = np.zeros(shape, dtype='float64')
+        active = np.zeros(shape, dtype='int64')
+        old = tuple(slice(0, n) for n in self.mrr.shape)
+        mrr[old] = self.mrr
+        active[old] = self.active_customers
+        self.mrr, self.active_customers = mrr, active
+        sizes = np.zeros(shape[1], dtype='int64')
+        sizes[:len(self.cohort_sizes)] = self.cohort_sizes
+        self.cohort_sizes = sizes
+
+    def set_cohort_sizes(self, sizes: pd.DataFrame) -> None:
+        """Replace cohort sizes from rows of cohort_month, customers"""
+        if sizes.empty:
+            return
+        months = np.asarray(pd.to_datetime(sizes['cohort_month']), dtype='datetime64[M]')
+        if self.first_cohort is None:
+            self.first_cohort = months.min()
+        elif months.min() < self.first_cohort:
+            self._shift_origin(months.min())
+        index = _month_index(months, self.first_cohort)
+        self._resize(len(self.currencies), index.max() + 1, self.mrr.shape[2])
+        self.cohort_sizes[:] = 0
+        self.cohort_sizes[index] = sizes['customers'].to_numpy(dtype='int64')
+
+    def cohort_sizes_changed(self, sizes: pd.DataFrame) -> bool:
+        """Whether a cohort up to closed_through has another size in sizes, e.g. after customers were backfilled"""
+        if self.closed_through is None:
+            return False
+        months = np.asarray(pd.to_datetime(sizes['cohort_month']), dtype='datetime64[M]')
+        closed = months <= self.closed_through
+        new = pd.Series(sizes['customers'].to_numpy(dtype='int64')[closed], index=months[closed])
+        old = pd.Series(self.cohort_sizes, index=self.cohorts)
+        old = old[(old.index <= self.closed_through) & (old > 0)]
+        return not new[new > 0].sort_index().equals(old.sort_index())
+
+    def clear_activity(self, from_month: np.datetime64) -> None:
+        """Zero the cells of activity months from from_month on, before they are read again"""
+        if self.first_cohort is None:
+            return
+        first_offset = int(from_month - self.first_cohort) - np.arange(self.mrr.shape[1])
+        cleared = np.arange(self.mrr.shape[2])[None, :] >= first_offset[:, None]
+        self.mrr[:, cleared] = 0.0
+        self.active_customers[:, cleared] = 0
+
+    def _shift_origin(self, first_cohort: np.datetime64) -> None:
+        """
+        Move the first cohort earlier. The new cohorts' cells start at zero, so
+        their activity has to be written for every closed month, not only the
+        months after closed_through.
+        """
+        shift = int(self.first_cohort - first_cohort)
+        self.mrr = np.pad(self.mrr, ((0, 0), (shift, 0), (0, 0)))
+        self.active_customers = np.pad(self.active_customers, ((0, 0), (shift, 0), (0, 0)))
+        self.cohort_sizes = np.pad(self.cohort_sizes, (shift, 0))
+        self.first_cohort = first_cohort
+
+    def add_activity(self, activity: pd.DataFrame) -> None:
+        """Write rows of cohort_month, activity_month, currency, mrr, active_customers into the matrix"""
+        activity = activity[
+            pd.to_datetime(activity['activity_month']) >= pd.to_datetime(activity['cohort_month'])
+        ]
+        if activity.empty:
+            return
+        for currency in sorted(set(activity['currency']) - set(self.currencies)):
+            self.currencies.append(currency)
+
+        cohorts = np.asarray(pd.to_datetime(activity['cohort_month']), dtype='datetime64[M]')
+        if self.first_cohort is None:
+            self.first_cohort = cohorts.min()
+        elif cohorts.min() < self.first_cohort:
+            self._shift_origin(cohorts.min())
+        currency_index = pd.Index(self.currencies).get_indexer(activity['currency'])
+        cohort_index = _month_index(cohorts, self.first_cohort)
+        offsets = _month_index(pd.to_datetime(activity['activity_month']), self.first_cohort) - cohort_index
+
+        self._resize(len(self.currencies), cohort_index.max() + 1, offsets.max() + 1)
+        self.mrr[currency_index, cohort_index, offsets] = activity['mrr'].to_numpy(dtype='float64')
+        self.active_customers[currency_index, cohort_index, offsets] = activity['active_customers'].to_numpy(dtype='int64')
+
+    def retention(self) -> np.ndarray:
+        """Share of each cohort's customers active k months after joining"""
+        sizes = np.where(self.cohort_sizes > 0, self.cohort_sizes, np.nan)
+        return self.active_customers / sizes[None, :, None]
+
+    def revenue_retention(self) -> np.ndarray:
+        """MRR k months after joining relative to the cohort's first month"""
+        base = self.mrr[:, :, :1]
+        return self.mrr / np.where(base > 0, base, np.nan)
+
+    def observed_mask(self) -> np.ndarray:
+        """True for cohort/offset cells whose activity month has closed"""
+        if self.closed_through is None or self.first_cohort is None:
+            return np.zeros(self.mrr.shape[1:], dtype=bool)
+        last_offset = int(self.closed_through - self.first_cohort) - np.arange(self.mrr.shape[1])
+        return np.arange(self.mrr.shape[2])[None, :] <= last_offset[:, None]
+
+    def to_frame(self, metric: str, currency: str) -> pd.DataFrame:
+        """Pivot one metric and currency into a cohort_month x months_since_joined table"""
+        values = {
+            'mrr': self.mrr,
+            'active_customers': self.active_customers,
+            'retention': self.retention(),
+            'revenue_retention': self.revenue_retention(),
+        }[metric][self.currencies.index(currency)].astype('float64')
+        values = np.where(self.observed_mask(), values, np.nan)
+        frame = pd.DataFrame(
+            values,
+            index=pd.Index(self.cohorts.astype('datetime64[D]'), name='cohort_month'),
+            columns=pd.Index(range(values.shape[1]), name='months_since_joined'),
+        )
+        frame.insert(0, 'cohort_size', self.cohort_sizes)
+        return frame
+
+    def save(self, path: str = COHORT_MATRIX_FILE) -> None:
+        np.savez_compressed(
+            path,
+            first_cohort=np.array([self.first_cohort], dtype='datetime64[M]'),
+            closed_through=np.array([self.closed_through], dtype='datetime64[M]'),
+            facts_through=np.array([_to_utc(self.facts_through)], dtype='datetime64[us]'),
+            currencies=np.array(self.currencies, dtype='U3'),
+            cohort_sizes=self.cohort_sizes,
+            mrr=self.mrr,
+            active_customers=self.active_customers,
+        )
+
+    @classmethod
+    def load(cls, path: str = COHORT_MATRIX_FILE) -> 'CohortMatrix':
+        matrix = cls()
+        if not os.path.exists(path):
+            return matrix
+        with np.load(path) as data:
+            first_cohort, closed_through = data['first_cohort'][0], data['closed_through'][0]
+            matrix.first_cohort = None if np.isnat(first_cohort) else first_cohort
+            matrix.closed_through = None if np.isnat(closed_through) else closed_through
+            # Matrices saved before facts_through was tracked are rebuilt on the next refresh.
+            facts_through = data['facts_through'][0] if 'facts_through' in data.files else np.datetime64('NaT')
+            matrix.facts_through = None if np.isnat(facts_through) else pd.Timestamp(facts_through).tz_localize('UTC').to_pydatetime()
+            matrix.currencies = data['currencies'].tolist()
+            matrix.cohort_sizes = data['cohort_sizes']
+            matrix.mrr = data['mrr']
+            matrix.active_customers = data['active_customers']
+        return matrix
+
+
+def refresh_cohort_matrix(engine: create_engine, path: str = COHORT_MATRIX_FILE, full: bool = False) -> CohortMatrix:
+    """
+    Bring the persisted cohort matrix up to the last closed month.
+
+    A month closes once invoices have been created after it. An incremental
+    refresh reads the months closed since the previous run from mrr_daily, and
+    re-reads the closed months mrr_daily_months marks as changed since then,
+    e.g. by late or rewritten invoices. Cohort sizes are re-read every time as
+    they come from an index-only count; when a closed cohort's size changed,
+    customers were backfilled whose activity was never read, so the matrix is
+    rebuilt.
+    """
+    matrix = CohortMatrix() if full else CohortMatrix.load(path)
+    with engine.connect() as conn:
+        facts_through = get_commit_safe_watermark(conn)
+        latest = conn.execute(text("SELECT MAX(created_at) FROM invoices")).scalar()
+        if latest is None:
+            return matrix
+        to_month = np.datetime64(pd.Timestamp(latest).tz_localize(None), 'M')
+        sizes = fetch_dataframe(conn, get_cohort_sizes_query(), {'to_month': to_month.astype('datetime64[D]').item()})
+        if matrix.closed_through is not None and (matrix.facts_through is None or matrix.cohort_sizes_changed(sizes)):
+            matrix = CohortMatrix()
+
+        if matrix.closed_through is None:
+            from_month = np.datetime64('1970-01', 'M')
+        else:
+            from_month = matrix.closed_through + 1
+            changed = conn.execute(text("""
+                SELECT MIN(month)
+                FROM mrr_daily_months
+                WHERE changed_at >= :since
+                AND month <= :closed_through
+            """), {'since': matrix.facts_through, 'closed_through': matrix.closed_through.astype('datetime64[D]').item()}).scalar()
+            if changed is not None:
+                from_month = min(from_month, np.datetime64(changed, 'M'))
+
+        matrix.set_cohort_sizes(sizes)
+        if from_month < to_month:
+            matrix.clear_activity(from_month)
+            params = {
+                'from_month': from_month.astype('datetime64[D]').item(),
+                'to_month': to_month.astype('datetime64[D]').item(),
+            }
+            matrix.add_activity(fetch_dataframe(conn, get_cohort_activity_query(), params))
+
+    matrix.closed_through = to_month - 1
+    matrix.facts_through = facts_through
+    matrix.save(path)
+    return matrix
@@ -0,0 +1,6 @@
+import os
+
+
+def get_data_path(file_name: str) -> str:
+    """Path of an export file in DATA_DIR, which defaults to data/"""
+    return os.path.join(os.getenv('DATA_DIR', 'data'), file_name)
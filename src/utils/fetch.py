@@ -0,0 +1,157 @@
+import re
+import tempfile
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.instrumentation import record_query
+
+# COPY output is buffered in memory up to this size, then spilled to a temporary file.
+FETCH_SPOOL_BYTES = 64 * 1024 * 1024
+
+# :name bind parameters, but not the second colon of a ::type cast.
+BIND_PARAMETER = re.compile(r'(?<![:\w]):(\w+)')
+
+# Postgres type OIDs of result columns, as reported in cursor.description.
+BOOLEAN_TYPES = {16}
+INTEGER_TYPES = {20, 21, 23}
+FLOAT_TYPES = {700, 701}
+NUMERIC_TYPES = {1700}
+DATE_TYPES = {1082}
+TIMESTAMP_TYPES = {1114}
+TIMESTAMPTZ_TYPES = {1184}
+
+
+def to_cents(amounts) -> pd.Series:
+    """
+    Fixed-point int64 cents of amounts in currency units, <NA> where missing.
+
+    Decimal text, as COPY writes NUMERIC values, is converted digit by digit and
+    never goes through a float; further decimals round half away from zero.
+    """
+    amounts = pd.Series(amounts)
+    if pd.api.types.is_numeric_dtype(amounts.dtype):
+        amounts = amounts.astype('float64')
+        return pd.Series(np.round(amounts.to_numpy() * 100), index=amounts.index, name=amounts.name).astype('Int64')
+
+    text = amounts.astype('string').str.strip()
+    negative = text.str.startswith('-').fillna(False).astype(bool)
+    parts = text.str.lstrip('+-').str.partition('.')
+    fraction = parts[2].str.ljust(3, '0')
+    units = parts[0].replace('', '0').astype('Int64')
+    cents = units * 100 + fraction.str[:2].astype('Int64') + (fraction.str[2] >= '5').astype('Int64')
+    return cents.where(~negative, -cents).rename(amounts.name)
+
+
+def from_cents(cents) -> pd.Series:
+    """Currency units of int64 cents, as floats for output"""
+    cents = pd.Series(cents)
+    return cents.astype('float64') / 100
+
+
+def format_cents(cents) -> pd.Series:
+    """Exact two-decimal text of int64 cents, e.g. -1234 as '-12.34', empty where missing"""
+    cents = pd.Series(cents).astype('Int64')
+    units = (cents.abs() // 100).astype('string')
+    fraction = (cents.abs() % 100).astype('string').str.zfill(2)
+    text = (cents < 0).map({True: '-', False: ''}).astype('string') + units + '.' + fraction
+    return text.fillna('')
+
+
+def to_driver_parameters(query: str) -> str:
+    """Rewrite SQLAlchemy-style :name parameters as psycopg2's %(name)s"""
+    return BIND_PARAMETER.sub(r'%(\1)s', query.replace('%', '%%'))
+
+
+def get_read_options(description: Iterable[Tuple], cents: Iterable[str] = ()) -> dict:
+    """
+    read_csv arguments that parse COPY CSV output into the result's column types.
+
+    Dates and timestamps are read as strings, for parse_date_columns, and so
+    are NUMERIC columns named in cents, for an exact to_cents.
+    """
+    cents = set(cents)
+    dtype: Dict[str, str] = {}
+    for column in description:
+        name, type_code = column[0], column[1]
+        if type_code in BOOLEAN_TYPES:
+            dtype[name] = 'boolean'
+        elif type_code in INTEGER_TYPES:
+            dtype[name] = 'Int64'
+        elif type_code in NUMERIC_TYPES and name in cents:
+            dtype[name] = 'str'
+        elif type_code in FLOAT_TYPES or type_code in NUMERIC_TYPES:
+            dtype[name] = 'float64'
+        else:
+            dtype[name] = 'str'
+    numeric = {column[0] for column in description if column[1] in INTEGER_TYPES | FLOAT_TYPES | NUMERIC_TYPES}
+    unknown = cents - numeric
+    if unknown:
+        raise ValueError(f"cents columns must be numeric: {', '.join(sorted(unknown))}")
+    return {
+        'dtype': dtype,
+        'true_values': ['t'],
+        'false_values': ['f'],
+        # COPY writes NULL as an empty field; anything else, e.g. 'NA', is data.
+        'keep_default_na': False,
+        'na_values': [''],
+    }
+
+
+def parse_date_columns(df: pd.DataFrame, description: Iterable[Tuple]) -> pd.DataFrame:
+    """
+    Parse the DATE, TIMESTAMP and TIMESTAMPTZ columns of COPY CSV output.
+
+    Postgres omits zero fractional seconds and writes every TIMESTAMPTZ value with
+    its own UTC offset, so the format can change from row to row. Each column is
+    parsed as ISO 8601, and TIMESTAMPTZ columns are converted to UTC.
+    """
+    for column in description:
+        name, type_code = column[0], column[1]
+        if type_code in DATE_TYPES or type_code in TIMESTAMP_TYPES:
+            df[name] = pd.to_datetime(df[name], format='ISO8601')
+        elif type_code in TIMESTAMPTZ_TYPES:
+            df[name] = pd.to_datetime(df[name], format='ISO8601', utc=True)
+    return df
+
+
+def fetch_dataframe(conn, query: str, params: Optional[dict] = None, cents: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Run a query on an open connection and return its result as typed columns.
+
+    The result is streamed with COPY (query) TO STDOUT into a spooled buffer and
+    parsed by pandas' C reader, so no Python tuple or Decimal is built per row.
+    NUMERIC columns become float64, or fixed-point int64 cents for the columns
+    named in cents; integers become nullable Int64, booleans, dates and
+    timestamps keep their types, and TIMESTAMPTZ columns come back in UTC.
+    Column types come from planning the query once with LIMIT 0, which the
+    run report counts as a query of its own.
+    """
+    cents = tuple(cents)
+    statement = query.strip().rstrip(';')
+    cursor = conn.connection.cursor()
+    try:
+        if params:
+            statement = cursor.mogrify(to_driver_parameters(statement), params).decode()
+        start = time.perf_counter()
+        plan_statement = f"SELECT * FROM ({statement}) as result LIMIT 0"
+        cursor.execute(plan_statement)
+        record_query(time.perf_counter() - start, plan_statement)
+        description = cursor.description
+        options = get_read_options(description, cents)
+        with tempfile.SpooledTemporaryFile(max_size=FETCH_SPOOL_BYTES, mode='w+b') as buffer:
+            start = time.perf_counter()
+            cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+            buffer.seek(0)
+            seconds = time.perf_counter() - start
+            df = pd.read_csv(buffer, encoding='utf-8', **options)
+        record_query(seconds, statement, dbapi_connection=conn.connection)
+    finally:
+        cursor.close()
+
+    df = parse_date_columns(df, description)
+    for column in cents:
+        df[column] = to_cents(df[column])
+    return df
@@ -0,0 +1,145 @@
+from typing import Dict, List, NamedTuple
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from utils.bulk_load import copy_dataframe
+
+SERIES_TYPES = ['currency', 'cohort', 'segment']
+
+# Upper bounds of a customer's peak daily MRR per segment; above the last is 'large'.
+SEGMENT_BANDS = [(100, 'small'), (1000, 'medium')]
+
+MIN_HISTORY_DAYS = 30
+
+# Rows fetched per batch from the server-side cursor of a series query.
+SERIES_FETCH_ROWS = 100_000
+
+FORECAST_COLUMNS = [
+    'model', 'series_id', 'series_type', 'currency', 'series_key',
+    'ds', 'yhat', 'yhat_lower', 'yhat_upper'
+]
+
+
+class Series(NamedTuple):
+    """One daily MRR series, identified as '<series_type>:<currency>[:<series_key>]'"""
+    series_id: str
+    series_type: str
+    currency: str
+    series_key: str
+    history: pd.Series
+
+
+def get_segment_case() -> str:
+    bands = " ".join(f"WHEN peak_mrr < {limit} THEN '{name}'" for limit, name in SEGMENT_BANDS)
+    return f"CASE {bands} ELSE 'large' END"
+
+
+def get_series_query(series_type: str) -> str:
+    """
+    Daily MRR per currency and series key, read from mrr_daily.
+
+    cohort keys are the customers' signup month; segment keys band customers by
+    their peak daily MRR in the currency.
+    """
+    if series_type == 'currency':
+        return """
+        SELECT currency, '' as series_key, day, SUM(mrr) as mrr
+        FROM mrr_daily
+        GROUP BY 1, 2, 3;
+        """
+    if series_type == 'cohort':
+        return """
+        SELECT d.currency, TO_CHAR(c.created_date, 'YYYY-MM') as series_key, d.day, SUM(d.mrr) as mrr
+        FROM mrr_daily d
+        JOIN customers c ON c.customer_id = d.customer_id
+        WHERE c.created_date IS NOT NULL
+        GROUP BY 1, 2, 3;
+        """
+    if series_type == 'segment':
+        return f"""
+        WITH customer_days AS (
+            SELECT customer_id, currency, day, SUM(mrr) as mrr
+            FROM mrr_daily
+            GROUP BY 1, 2, 3
+        ),
+        segments AS (
+            SELECT customer_id, currency, {get_segment_case()} as series_key
+            FROM (
+                SELECT customer_id, currency, MAX(mrr) as peak_mrr
+                FROM customer_days
+                GROUP BY 1, 2
+            ) peaks
+        )
+        SELECT d.currency, s.series_key, d.day, SUM(d.mrr) as mrr
+        FROM customer_days d
+        JOIN segments s ON s.customer_id = d.customer_id AND s.currency = d.currency
+        GROUP BY 1, 2, 3;
+        """
+    raise ValueError(f"Unknown series type {series_type}, expected one of {SERIES_TYPES}")
+
+
+def to_series(series_type: str, df: pd.DataFrame, min_history_days: int = MIN_HISTORY_DAYS) -> List[Series]:
+    """
+    Split a long (currency, series_key, day, mrr) frame into daily series.
+
+    Days without MRR inside a series' span are filled with 0. Series with fewer
+    than min_history_days are left out, as they are too short to fit.
+    """
+    series = []
+    df = df.assign(day=pd.to_datetime(df['day']), mrr=df['mrr'].astype(float))
+    for (currency, key), group in df.groupby(['currency', 'series_key'], sort=True):
+        history = group.set_index('day')['mrr'].sort_index().asfreq('D', fill_value=0.0)
+        if len(history) < min_history_days:
+            continue
+        series_id = f"{series_type}:{currency}:{key}" if key else f"{series_type}:{currency}"
+        series.append(Series(series_id, series_type, currency, key, history))
+    return series
+
+
+def load_series(
+    engine: create_engine,
+    series_types: List[str] = SERIES_TYPES,
+    min_history_days: int = MIN_HISTORY_DAYS
+) -> List[Series]:
+    """
+    Read the daily MRR series of each requested type.
+
+    Cohort and segment queries return a row per key and day, so they are read
+    through a server-side cursor in batches rather than buffered whole by the
+    driver.
+    """
+    series = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=SERIES_FETCH_ROWS)
+        for series_type in series_types:
+            chunks = pd.read_sql(text(get_series_query(series_type)), conn, chunksize=SERIES_FETCH_ROWS)
+            df = pd.concat(chunks, ignore_index=True)
+            series.extend(to_series(series_type, df, min_history_days))
+    return series
+
+
+def save_forecasts(engine: create_engine, forecasts: pd.DataFrame, model: str) -> int:
+    """
+    Replace the stored forecasts of a model for the series in forecasts.
+
+    forecasts holds FORECAST_COLUMNS except model; series not in it keep their
+    previous forecast.
+    """
+    if forecasts.empty:
+        return 0
+    forecasts = forecasts.assign(model=model)
+    with engine.begin() as conn:
+        conn.execute(
+            text("DELETE FROM mrr_forecasts WHERE model = :model AND series_id = ANY(:series_ids)"),
+            {'model': model, 'series_ids': forecasts['series_id'].unique().tolist()}
+        )
+        copy_dataframe(conn, forecasts, 'mrr_forecasts', FORECAST_COLUMNS)
+    return len(forecasts)
+
+
+def summarize_forecasts(forecasts: pd.DataFrame) -> Dict[str, float]:
+    """Forecast MRR on the last forecast day per currency, for the run summary"""
+    totals = forecasts[forecasts['series_type'] == 'currency']
+    last = totals[totals['ds'] == totals.groupby('currency')['ds'].transform('max')]
+    return last.set_index('currency')['yhat'].round(2).to_dict()
@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from utils.bulk_load import copy_dataframe
+
+FX_RATES_FILE = 'data/fx_rates.csv'
+
+# Rates are quoted as units of currency per one unit of the reference currency.
+REFERENCE_CURRENCY = 'eur'
+
+# fx_rates_daily carries the last rate forward this far past the later of the
+# last rate and today, so billing periods running into the future still convert.
+DAILY_RATES_HORIZON_DAYS = 400
+
+# First day any invoice or billing period touches; fx_rates_daily starts no later,
+# so the fact builds convert the same days FxRates.per_eur does.
+EARLIEST_INVOICE_DAY_QUERY = """
+    SELECT CAST(LEAST(MIN(created_at), MIN(period_start), MIN(min_line_item_period_start)) AS DATE)
+    FROM invoices
+"""
+
+_rates_cache: Dict[tuple, 'FxRates'] = {}
+_rates_cache_lock = threading.Lock()
+
+
+def get_reporting_currency() -> str:
+    """Return the currency portfolio totals are reported in, from REPORTING_CURRENCY"""
+    currency = os.getenv('REPORTING_CURRENCY', REFERENCE_CURRENCY).lower()
+    if not re.fullmatch(r'[a-z]{3}', currency):
+        raise ValueError(f"REPORTING_CURRENCY must be a three-letter currency code, got {currency!r}")
+    return currency
+
+
+def get_fx_join(currency_column: str, day_expression: str, reporting_currency: Optional[str] = None) -> str:
+    """
+    Return LEFT JOINs of fx_rates_daily as fx, the rate of currency_column, and
+    rep, the rate of the reporting currency, on the day of day_expression.
+
+    Convert with amount / fx.per_eur * rep.per_eur; the result is NULL for
+    currencies or days without rates.
+    """
+    reporting_currency = reporting_currency or get_reporting_currency()
+    return (
+        f"LEFT JOIN fx_rates_daily fx ON fx.currency = {currency_column} AND fx.day = {day_expression}\n"
+        f"    LEFT JOIN fx_rates_daily rep ON rep.currency = '{reporting_currency}' AND rep.day = {day_expression}"
+    )
+
+
+def read_fx_rates_csv(path: str = FX_RATES_FILE) -> pd.DataFrame:
+    """Read dated rates as rate_date, currency, per_eur"""
+    rates = pd.read_csv(path, dtype={'currency': 'string'}, parse_dates=['date'])
+    rates = rates.rename(columns={'date': 'rate_date'})
+    rates['currency'] = rates['currency'].str.lower()
+    return rates[['rate_date', 'currency', 'per_eur']]
+
+
+class FxRates:
+    """
+    Dated FX rates with vectorized as-of lookups.
+
+    The rate of a currency on a day is its latest rate dated on or before that
+    day; days before a currency's first rate use that first rate. The reference
+    currency always has rate 1.
+    """
+
+    def __init__(self, rates: pd.DataFrame) -> None:
+        rates = rates.assign(
+            rate_date=pd.to_datetime(rates['rate_date']).astype('datetime64[ns]'),
+            currency=rates['currency'].astype(str).str.lower(),
+            per_eur=rates['per_eur'].astype(float),
+        )
+        rates = rates[rates['currency'] != REFERENCE_CURRENCY]
+        self.rates = rates.sort_values('rate_date').reset_index(drop=True)
+        self.currencies = sorted(set(self.rates['currency']) | {REFERENCE_CURRENCY})
+
+    @property
+    def empty(self) -> bool:
+        return self.rates.empty
+
+    def per_eur(self, currencies: pd.Series, days: pd.Series) -> np.ndarray:
+        """Rates of each (currency, day) pair, NaN for currencies without rates"""
+        lookup = pd.DataFrame({
+            'currency': pd.Series(currencies).astype(str).str.lower().to_numpy(),
+            'day': pd.to_datetime(pd.Series(days)).dt.tz_localize(None).astype('datetime64[ns]').to_numpy(),
+            'position': np.arange(len(currencies)),
+        }).sort_values('day')
+
+        matched = pd.merge_asof(
+            lookup, self.rates, left_on='day', right_on='rate_date', by='currency', direction='backward'
+        )
+        first = self.rates.groupby('currency')['per_eur'].first()
+        matched['per_eur'] = matched['per_eur'].fillna(matched['currency'].map(first))
+        matched.loc[matched['currency'] == REFERENCE_CURRENCY, 'per_eur'] = 1.0
+
+        result = np.empty(len(lookup))
+        result[matched['position'].to_numpy()] = matched['per_eur'].to_numpy()
+        return result
+
+    def convert(self, amounts: pd.Series, currencies: pd.Series, days: pd.Series, to_currency: str) -> np.ndarray:
+        """Convert amounts at each day's rate; amounts in currencies without rates become NaN"""
+        to_rates = self.per_eur(pd.Series([to_currency] * len(amounts)), days)
+        return np.asarray(amounts, dtype=float) / self.per_eur(currencies, days) * to_rates
+
+    def daily(self, start: date, end: date) -> pd.DataFrame:
+        """One row per currency and day in [start, end], for joins on exact days"""
+        days = pd.date_range(start, end, freq='D')
+        grid = pd.DataFrame({
+            'currency': np.repeat(self.currencies, len(days)),
+            'day': np.tile(days, len(self.currencies)),
+        })
+        grid['per_eur'] = self.per_eur(grid['currency'], grid['day'])
+        grid['day'] = grid['day'].dt.date
+        return grid
+
+    def daily_to_horizon(self, horizon_days: int = DAILY_RATES_HORIZON_DAYS, first_day: Optional[date] = None) -> pd.DataFrame:
+        """
+        daily() from the earlier of the first rate and first_day, typically the
+        earliest invoice day, to horizon_days past the later of the last rate and
+        today. Days before the first rate carry it, as in per_eur().
+        """
+        start = self.rates['rate_date'].min().date()
+        if first_day is not None:
+            start = min(start, first_day)
+        end = max(self.rates['rate_date'].max().date(), date.today()) + timedelta(days=horizon_days)
+        return self.daily(start, end)
+
+
+def load_fx_rates(engine: create_engine) -> FxRates:
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT rate_date, currency, per_eur FROM fx_rates"))
+        return FxRates(pd.DataFrame(result.fetchall(), columns=result.keys()))
+
+
+def get_fx_rates(engine: create_engine) -> FxRates:
+    """
+    Return this process's cached rates, reading fx_rates on first use.
+
+    Conversions then cost one vectorized as-of join per DataFrame and no
+    database round trip; clear_fx_cache() picks up reloaded rates.
+    """
+    key = (os.getpid(), str(engine.url))
+    with _rates_cache_lock:
+        rates = _rates_cache.get(key)
+        if rates is None:
+            rates = _rates_cache[key] = load_fx_rates(engine)
+        return rates
+
+
+def clear_fx_cache() -> None:
+    with _rates_cache_lock:
+        _rates_cache.clear()
+
+
+def save_fx_rates(engine: create_engine, rates: pd.DataFrame, horizon_days: int = DAILY_RATES_HORIZON_DAYS) -> int:
+    """
+    Replace fx_rates with rates and rebuild the dense fx_rates_daily table used
+    by the fact builds, from the earlier of the first rate and the earliest
+    invoice day to horizon_days past the later of the last rate and today.
+
+    Returns:
+        int: Rows written to fx_rates_daily.
+    """
+    with engine.begin() as conn:
+        daily = FxRates(rates).daily_to_horizon(horizon_days, conn.execute(text(EARLIEST_INVOICE_DAY_QUERY)).scalar())
+        conn.execute(text("TRUNCATE fx_rates, fx_rates_daily"))
+        copy_dataframe(conn, rates.assign(rate_date=rates['rate_date'].dt.date), 'fx_rates', ['rate_date', 'currency', 'per_eur'])
+        copy_dataframe(conn, daily, 'fx_rates_daily', ['day', 'currency', 'per_eur'])
+    clear_fx_cache()
+    return len(daily)
+
+
+def add_reporting_amounts(
+    df: Optional[pd.DataFrame],
+    fx: FxRates,
+    amount_column: str,
+    date_column: str,
+    reporting_currency: Optional[str] = None,
+) -> Optional[pd.DataFrame]:
+    """Add reporting_currency and <amount_column>_reporting, converted at each row's date"""
+    if df is None or df.empty or fx.empty:
+        return df
+    reporting_currency = reporting_currency or get_reporting_currency()
+    converted = fx.convert(df[amount_column], df['currency'], df[date_column], reporting_currency)
+    return df.assign(**{'reporting_currency': reporting_currency, f"{amount_column}_reporting": converted.round(2)})
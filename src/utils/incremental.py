@@ -0,0 +1,151 @@
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.bulk_load import copy_dataframe, get_merge_query, merge_dataframe
+
+ROW_HASH_COLUMNS = ['source', 'record_id', 'row_hash']
+
+INGESTION_CHANNEL = 'ingestion_complete'
+
+
+def compute_row_hashes(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """Return a stable 64-bit content hash per row, as a signed BIGINT-compatible series"""
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    return pd.Series(hashes.to_numpy().view('int64'), index=df.index)
+
+
+def get_watermark(conn, source: str) -> Optional[dict]:
+    """Return the stored ingestion watermark for a source, if any"""
+    result = conn.execute(
+        text("""
+            SELECT max_created_at, max_finalized_at, last_run_rows, updated_at
+            FROM ingestion_watermarks
+            WHERE source = :source
+        """),
+        {'source': source}
+    ).mappings().first()
+    return dict(result) if result else None
+
+
+def filter_changed_rows(conn, df: pd.DataFrame, source: str, key_column: str, columns: List[str]) -> pd.DataFrame:
+    """
+    Return only the rows that are new or whose content changed since the last load.
+
+    Rows created after the source watermark are new by definition and skip the
+    hash lookup; older rows are compared against their stored content hash in
+    the database, so a run only transfers the ids of the rows that changed.
+    The returned frame carries a row_hash column for save_row_hashes.
+    """
+    df = df.assign(row_hash=compute_row_hashes(df, columns))
+
+    watermark = get_watermark(conn, source)
+    if watermark is None or watermark['max_created_at'] is None:
+        return df
+
+    max_created_at = pd.Timestamp(watermark['max_created_at']).tz_convert(None)
+    is_new = df['created_at'] > max_created_at
+    candidates = df[~is_new]
+    if candidates.empty:
+        return df
+
+    # Compare in SQL against hashes staged with COPY, so only the ids of changed
+    # rows come back instead of every stored hash being sent over the wire.
+    staging_table = 'ingestion_row_hashes_candidates'
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {staging_table} (record_id VARCHAR(50), row_hash BIGINT)
+        ON COMMIT DROP
+    """))
+    copy_dataframe(
+        conn, pd.DataFrame({'record_id': candidates[key_column].to_numpy(), 'row_hash': candidates['row_hash'].to_numpy()}),
+        staging_table, ['record_id', 'row_hash']
+    )
+    result = conn.execute(
+        text(f"""
+            SELECT c.record_id
+            FROM {staging_table} c
+            LEFT JOIN ingestion_row_hashes h
+                ON h.source = :source
+                AND h.record_id = c.record_id
+            WHERE h.row_hash IS DISTINCT FROM c.row_hash
+        """),
+        {'source': source}
+    )
+    changed = {row[0] for row in result}
+    conn.execute(text(f"DROP TABLE {staging_table}"))
+
+    return df[is_new | df[key_column].isin(changed)]
+
+
+def save_row_hashes(conn, df: pd.DataFrame, source: str, key_column: str) -> None:
+    """Persist the content hashes of the rows just loaded"""
+    if df.empty:
+        return
+    hashes = pd.DataFrame({
+        'source': source,
+        'record_id': df[key_column].to_numpy(),
+        'row_hash': df['row_hash'].to_numpy(),
+    })
+    upsert_query = get_merge_query(
+        'ingestion_row_hashes', 'ingestion_row_hashes_staging', ROW_HASH_COLUMNS, ['source', 'record_id']
+    )
+    merge_dataframe(conn, hashes, 'ingestion_row_hashes', ROW_HASH_COLUMNS, ['source', 'record_id'], upsert_query)
+
+
+def update_watermark(conn, source: str, max_created_at, max_finalized_at, last_run_rows: int) -> None:
+    """Advance the source watermark past the rows just loaded"""
+    conn.execute(
+        text("""
+            INSERT INTO ingestion_watermarks (source, max_created_at, max_finalized_at, last_run_rows, updated_at)
+            VALUES (:source, :max_created_at, :max_finalized_at, :last_run_rows, NOW())
+            ON CONFLICT (source)
+            DO UPDATE SET
+                max_created_at = GREATEST(ingestion_watermarks.max_created_at, EXCLUDED.max_created_at),
+                max_finalized_at = GREATEST(ingestion_watermarks.max_finalized_at, EXCLUDED.max_finalized_at),
+                last_run_rows = EXCLUDED.last_run_rows,
+                updated_at = EXCLUDED.updated_at
+        """),
+        {
+            'source': source,
+            'max_created_at': max_created_at,
+            'max_finalized_at': max_finalized_at,
+            'last_run_rows': last_run_rows,
+        }
+    )
+
+
+def get_commit_safe_watermark(conn) -> Optional[datetime]:
+    """
+    Return an updated_at watermark that no row committed later can fall behind.
+
+    updated_at defaults to NOW(), the start of the writing transaction, so a long
+    load can commit rows older than the newest visible one. Any row not visible
+    yet belongs to a transaction open at this point, whose updated_at is at least
+    the earliest start of the open transactions, this one included. Reading
+    updated_at >= the watermark next time re-reads rows of that overlap instead
+    of skipping them. Take it before reading the changed rows; sessions of other
+    roles are only seen with pg_read_all_stats.
+    """
+    return conn.execute(text("""
+        SELECT MIN(xact_start)
+        FROM pg_stat_activity
+        WHERE xact_start IS NOT NULL
+        AND backend_type = 'client backend'
+    """)).scalar()
+
+
+def latest(current, candidate):
+    """Return the later of two optional timestamps as a datetime, ignoring missing values"""
+    if candidate is None or pd.isna(candidate):
+        return current
+    candidate = pd.Timestamp(candidate).to_pydatetime()
+    return candidate if current is None else max(current, candidate)
+
+
+def notify_ingestion_complete(engine, source: str) -> None:
+    """Announce a committed ingestion run to LISTENers such as the metrics service"""
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :source)"), {'channel': INGESTION_CHANNEL, 'source': source})
+        conn.commit()
@@ -0,0 +1,46 @@
+from typing import Dict, List
+
+# Access paths of the calculators. Every query filters is_forgiven = FALSE, so
+# the indexes are partial on that predicate and INCLUDE the columns the queries
+# aggregate, which lets them be answered from index-only scans.
+INVOICE_INDEXES: Dict[str, str] = {
+    # calculate_mrr.py (single and batch): per customer, by period_start month.
+    'idx_invoices_customer_period_active': """
+        ON invoices (customer_id, period_start)
+        INCLUDE (total, currency, subscription_id)
+        WHERE is_forgiven = FALSE
+    """,
+    # calculate_churn.py and calculate_biggest_customer.py: weekly buckets of created_at.
+    'idx_invoices_created_active': """
+        ON invoices (created_at)
+        INCLUDE (customer_id, currency, total)
+        WHERE is_forgiven = FALSE
+    """,
+    # calculate_subscription_churn.py: invoices of each subscription in period order.
+    'idx_invoices_subscription_period_active': """
+        ON invoices (subscription_id, period_start)
+        INCLUDE (customer_id, currency, period_end, max_line_item_period_end, total, created_at)
+        WHERE is_forgiven = FALSE AND subscription_id IS NOT NULL
+    """,
+}
+
+# Block-range indexes for time-ordered loads; tiny, but only useful while rows
+# arrive roughly in created_at order.
+INVOICE_BRIN_INDEXES: Dict[str, str] = {
+    'idx_invoices_created_at_brin': "ON invoices USING BRIN (created_at)",
+    'idx_invoices_period_start_brin': "ON invoices USING BRIN (period_start)",
+}
+
+
+def get_create_index_queries(indexes: Dict[str, str], concurrently: bool = False) -> List[str]:
+    """
+    Return idempotent CREATE INDEX statements.
+
+    CONCURRENTLY does not block writes to invoices but cannot run inside a
+    transaction, so those statements must be executed with autocommit.
+    """
+    mode = "CONCURRENTLY " if concurrently else ""
+    return [
+        f"CREATE INDEX {mode}IF NOT EXISTS {name} {definition.strip()}"
+        for name, definition in indexes.items()
+    ]
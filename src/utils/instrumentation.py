@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REPORTS_DIR = 'output/run_reports'
+
+# Stage that queries and rows are attributed to outside any timed() block.
+ROOT_STAGE = 'run'
+
+PROFILE_TOP_FUNCTIONS = 25
+
+_SELECT = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|TRUNCATE|ALTER)\b', re.IGNORECASE)
+
+_current: Optional['RunReport'] = None
+
+
+class RunReport:
+    """
+    Stage timings, row and query counts, EXPLAIN summaries and errors of one script run.
+
+    Stages nest per thread: a stage opened inside another is reported as
+    'outer/inner', and its time is also part of the outer stage's.
+    """
+
+    def __init__(self, script: str, explain: bool = False) -> None:
+        self.script = script
+        self.explain = explain
+        self.pid = os.getpid()
+        self.argv = sys.argv[1:]
+        self.started_at = datetime.now(timezone.utc)
+        self.seconds = 0.0
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.explains: List[dict] = []
+        self.errors: List[dict] = []
+        self.profile: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def stack(self) -> List[str]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @property
+    def current_stage(self) -> str:
+        stack = self.stack
+        return stack[-1] if stack else ROOT_STAGE
+
+    def _stage(self, name: str) -> Dict[str, float]:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {'calls': 0, 'seconds': 0.0, 'rows': 0, 'queries': 0, 'query_seconds': 0.0}
+        return stage
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self._stage(name)
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+
+    def add_rows(self, rows: int, name: Optional[str] = None) -> None:
+        with self._lock:
+            self._stage(name or self.current_stage)['rows'] += int(rows)
+
+    def add_query(self, seconds: float) -> None:
+        with self._lock:
+            stage = self._stage(self.current_stage)
+            stage['queries'] += 1
+            stage['query_seconds'] += seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def add_error(self, error: BaseException) -> None:
+        with self._lock:
+            self.errors.append({
+                'stage': self.current_stage,
+                'type': type(error).__name__,
+                'message': str(error),
+                'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+            })
+
+    def add_explain(self, summary: dict) -> None:
+        with self._lock:
+            self.explains.append({'stage': self.current_stage, **summary})
+
+    def merge(self, report: dict, prefix: str) -> None:
+        """Fold in the to_dict() of a report collected elsewhere, e.g. in a worker process, under prefix"""
+        with self._lock:
+            for name, stage in report['stages'].items():
+                target = self._stage(f"{prefix}/{name}")
+                for key, value in stage.items():
+                    target[key] += value
+            for name, value in report['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.explains.extend({**explain, 'stage': f"{prefix}/{explain['stage']}"} for explain in report['explains'])
+            self.errors.extend({**error, 'stage': f"{prefix}/{error['stage']}"} for error in report['errors'])
+
+    def to_dict(self) -> dict:
+        stages = {
+            name: {**stage, 'seconds': round(stage['seconds'], 6), 'query_seconds': round(stage['query_seconds'], 6)}
+            for name, stage in self.stages.items()
+        }
+        return {
+            'script': self.script,
+            'status': 'failed' if self.errors else 'ok',
+            'started_at': self.started_at.isoformat(),
+            'seconds': round(self.seconds, 6),
+            'pid': self.pid,
+            'argv': self.argv,
+            'queries': sum(stage['queries'] for stage in self.stages.values()),
+            'stages': stages,
+            'counters': self.counters,
+            'explains': self.explains,
+            'errors': self.errors,
+            'profile': self.profile,
+        }
+
+    def write(self, directory: str = REPORTS_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.script}_{self.started_at.strftime('%Y%m%dT%H%M%S')}_{self.pid}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        return path
+
+
+class timed:
+    """
+    Time a block or, as a decorator, every call of a function as a stage of the
+    current run report. Outside a run report it only costs two clock reads.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __call__(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self) -> 'timed':
+        report = _current
+        if report is not None:
+            stack = report.stack
+            stack.append(f"{stack[-1]}/{self.name}" if stack else self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        elapsed = time.perf_counter() - self._start
+        report = _current
+        if report is not None and report.stack:
+            report.add_time(report.stack.pop(), elapsed)
+        return False
+
+
+def get_current_report() -> Optional[RunReport]:
+    return _current
+
+
+def add_rows(rows: int) -> None:
+    """Count rows processed by the innermost open stage"""
+    if _current is not None:
+        _current.add_rows(rows)
+
+
+def count(name: str, value: int = 1) -> None:
+    if _current is not None:
+        _current.count(name, value)
+
+
+def record_error(error: BaseException) -> None:
+    """Keep an error a script handles itself in the run report, which is then marked failed"""
+    if _current is not None:
+        _current.add_error(error)
+
+
+def summarize_plan(plan: dict) -> dict:
+    """Root node, timings, buffer use and sequentially scanned relations of an EXPLAIN (FORMAT JSON) plan"""
+    root = plan['Plan']
+    nodes, seq_scans = [root], []
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            seq_scans.append(node.get('Relation Name'))
+        nodes.extend(node.get('Plans', []))
+    return {
+        'node_type': root.get('Node Type'),
+        'total_cost': root.get('Total Cost'),
+        'actual_rows': root.get('Actual Rows'),
+        'shared_hit_blocks': root.get('Shared Hit Blocks'),
+        'shared_read_blocks': root.get('Shared Read Blocks'),
+        'planning_ms': plan.get('Planning Time'),
+        'execution_ms': plan.get('Execution Time'),
+        'seq_scans': sorted(set(seq_scans)),
+    }
+
+
+def _explain(dbapi_connection, statement: str, parameters) -> dict:
+    """
+    EXPLAIN ANALYZE a read-only statement on the connection that just ran it.
+
+    Runs on a plain DBAPI cursor, so it is not counted as a query, and inside a
+    savepoint so a failing EXPLAIN does not abort the caller's transaction.
+    """
+    in_transaction = not getattr(dbapi_connection, 'autocommit', False)
+    cursor = dbapi_connection.cursor()
+    try:
+        if in_transaction:
+            cursor.execute("SAVEPOINT run_report_explain")
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters)
+            plan = cursor.fetchone()[0]
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            summary = summarize_plan(plan[0])
+        except Exception as e:
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT run_report_explain")
+            return {'error': str(e)}
+        if in_transaction:
+            cursor.execute("RELEASE SAVEPOINT run_report_explain")
+        return summary
+    finally:
+        cursor.close()
+
+
+def record_query(seconds: float, statement: str, parameters=None, dbapi_connection=None) -> None:
+    """
+    Count a query in the innermost open stage. With a DBAPI connection and an
+    --explain run, a read-only statement is also explained on it, which lets
+    queries run outside SQLAlchemy's cursor events, e.g. as a COPY, be included.
+    """
+    report = _current
+    if report is None:
+        return
+    report.add_query(seconds)
+    if report.explain and dbapi_connection is not None and _SELECT.match(statement) and not _WRITES.search(statement):
+        summary = _explain(dbapi_connection, statement, parameters)
+        report.add_explain({'statement': ' '.join(statement.split())[:200], **summary})
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current is not None:
+        conn.info.setdefault('run_report_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    starts = conn.info.get('run_report_query_start')
+    if _current is None or not starts:
+        return
+    record_query(time.perf_counter() - starts.pop(), statement, parameters, None if executemany else cursor.connection)
+
+
+# Listening on the Engine class covers every engine of the process, including the
+# cached ones from get_database_connection and connections set to stream_results.
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _top_functions(profile: cProfile.Profile, limit: int = PROFILE_TOP_FUNCTIONS) -> List[dict]:
+    stats = pstats.Stats(profile).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{os.path.relpath(filename) if filename.startswith('/') else filename}:{line}({name})",
+            'calls': calls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in ranked
+    ]
+
+
+@contextlib.contextmanager
+def run_report(
+    script: str,
+    profile: bool = False,
+    explain: bool = False,
+    directory: Optional[str] = REPORTS_DIR,
+) -> Iterator[RunReport]:
+    """
+    Collect a run report for the enclosed block and write it as JSON to directory.
+
+    With profile, the block also runs under cProfile: the full profile is dumped
+    next to the report (for snakeviz or pstats) and its top functions by
+    cumulative time are included in it. With explain, every read-only statement
+    is run a second time under EXPLAIN (ANALYZE, BUFFERS), so use it on
+    representative rather than nightly runs. Leave profile off when sampling the
+    process with py-spy; the report's pid is the one to attach to.
+    """
+    global _current
+    report = _current = RunReport(script, explain)
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield report
+    except BaseException as e:
+        report.add_error(e)
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        report.seconds = time.perf_counter() - start
+        _current = None
+        if directory:
+            if profiler is not None:
+                os.makedirs(directory, exist_ok=True)
+                profiler.dump_stats(os.path.join(directory, f"{script}_{report.started_at.strftime('%Y%m%dT%H%M%S')}_{report.pid}.prof"))
+                report.profile = _top_functions(profiler)
+            try:
+                print(f"Run report saved to {report.write(directory)}")
+            except OSError as e:
+                print(f"Error saving run report: {e}")
+
+
+def add_instrumentation_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--profile', action='store_true', help='Run under cProfile and add the top functions to the run report')
+    parser.add_argument('--explain', action='store_true', help='Capture EXPLAIN ANALYZE of every read-only query in the run report')
+    parser.add_argument('--report-dir', default=REPORTS_DIR, help='Directory for the JSON run report (empty to skip it)')
+
+
+def get_instrumentation_options(args: argparse.Namespace) -> dict:
+    return {'profile': args.profile, 'explain': args.explain, 'directory': args.report_dir or None}
@@ -0,0 +1,141 @@
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# Arbitrary key for the advisory lock that keeps two runners from migrating at once.
+MIGRATION_LOCK_KEY = 741_902_113
+
+
+class Migration(NamedTuple):
+    """
+    One schema change.
+
+    upgrade(conn, settings) must be idempotent (IF NOT EXISTS, guarded
+    backfills), so a step interrupted before it was recorded can be re-run.
+    Non-transactional steps run in autocommit, which CREATE INDEX CONCURRENTLY
+    and batched backfills need; each of their statements commits on its own.
+    """
+    version: int
+    name: str
+    upgrade: Callable
+    transactional: bool = True
+
+
+def get_applied_versions(conn) -> Dict[int, str]:
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(200),
+            applied_at TIMESTAMPTZ DEFAULT NOW(),
+            duration_seconds NUMERIC(12,3)
+        )
+    """))
+    result = conn.execute(text(f"SELECT version, name FROM {MIGRATIONS_TABLE}"))
+    return {version: name for version, name in result}
+
+
+def _record(conn, migration: Migration, elapsed: float) -> None:
+    conn.execute(text(f"""
+        INSERT INTO {MIGRATIONS_TABLE} (version, name, duration_seconds)
+        VALUES (:version, :name, :duration)
+    """), {'version': migration.version, 'name': migration.name, 'duration': round(elapsed, 3)})
+
+
+def run_migrations(
+    engine: create_engine,
+    migrations: Sequence[Migration],
+    settings: Optional[dict] = None,
+    target: Optional[int] = None,
+) -> List[int]:
+    """
+    Apply the pending migrations in version order, up to target if given.
+
+    Returns:
+        List[int]: Versions applied by this run.
+    """
+    versions = [m.version for m in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError("Migration versions must be unique and listed in ascending order")
+    settings = settings or {}
+
+    applied = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        try:
+            done = get_applied_versions(lock_conn)
+            for migration in migrations:
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+                start = time.perf_counter()
+                if migration.transactional:
+                    with engine.connect() as conn:
+                        migration.upgrade(conn, settings)
+                        _record(conn, migration, time.perf_counter() - start)
+                        conn.commit()
+                else:
+                    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                        migration.upgrade(conn, settings)
+                        _record(conn, migration, time.perf_counter() - start)
+                print(f"Applied migration {migration.version:04d} {migration.name} in {time.perf_counter() - start:.1f}s")
+                applied.append(migration.version)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_KEY})
+    return applied
+
+
+def create_index_online(conn, name: str, definition: str, concurrently: bool = True) -> None:
+    """
+    Create an index without blocking writes, on an autocommit connection.
+
+    An index left INVALID by an interrupted concurrent build is dropped and
+    rebuilt. Pass concurrently=False for partitioned parents, which cannot be
+    indexed concurrently.
+    """
+    invalid = conn.execute(text("""
+        SELECT 1
+        FROM pg_index i
+        WHERE i.indexrelid = to_regclass(:name)
+        AND NOT i.indisvalid
+    """), {'name': name}).scalar()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    mode = "CONCURRENTLY " if concurrently else ""
+    conn.execute(text(f"CREATE INDEX {mode}IF NOT EXISTS {name} {definition.strip()}"))
+
+
+def backfill_in_batches(
+    conn,
+    table: str,
+    key_column: str,
+    set_clause: str,
+    pending_condition: str,
+    batch_size: int = 10_000,
+) -> int:
+    """
+    Apply an UPDATE in short batches on an autocommit connection.
+
+    Each batch locks at most batch_size rows and commits, so loads keep running
+    while the backfill progresses. pending_condition must become false for an
+    updated row, e.g. "updated_at IS NULL" for "updated_at = NOW()".
+
+    Returns:
+        int: Number of rows updated.
+    """
+    total = 0
+    while True:
+        updated = conn.execute(text(f"""
+            UPDATE {table}
+            SET {set_clause}
+            WHERE {key_column} IN (
+                SELECT {key_column}
+                FROM {table}
+                WHERE {pending_condition}
+                LIMIT :batch_size
+            )
+        """), {'batch_size': batch_size}).rowcount
+        total += updated
+        if updated == 0:
+            return total
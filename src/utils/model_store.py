@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import re
+from typing import NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+MODEL_STORE_DIR = 'output/models'
+
+HIT = 'hit'
+WARM = 'warm'
+MISS = 'miss'
+
+
+class StoredModel(NamedTuple):
+    fingerprint: str
+    length: int
+    model_json: str
+
+
+def fingerprint(history: pd.Series) -> str:
+    """Hash of a series' days and values; equal series have equal fingerprints"""
+    hashed = pd.util.hash_pandas_object(history, index=True).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def hyperparameter_key(params: dict) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+class ModelStore:
+    """
+    Fitted models serialized on disk, keyed by series id, data fingerprint and hyperparameters.
+
+    Only the latest fit per series and hyperparameters is kept. lookup tells
+    whether the series is unchanged since that fit (HIT), only had days appended
+    (WARM, the stored fit is a good starting point), or changed otherwise (MISS).
+    """
+
+    def __init__(self, directory: str = MODEL_STORE_DIR) -> None:
+        self.directory = directory
+
+    def path(self, series_id: str, params: dict) -> str:
+        name = re.sub(r'[^A-Za-z0-9_-]+', '_', series_id)
+        return os.path.join(self.directory, f"{name}__{hyperparameter_key(params)}.json")
+
+    def load(self, series_id: str, params: dict) -> Optional[StoredModel]:
+        path = self.path(series_id, params)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return StoredModel(**json.load(f))
+
+    def lookup(self, series_id: str, history: pd.Series, params: dict) -> Tuple[str, Optional[str]]:
+        """
+        Returns:
+            Tuple[str, Optional[str]]: HIT, WARM or MISS, and the stored model for HIT and WARM.
+        """
+        stored = self.load(series_id, params)
+        if stored is None or stored.length > len(history):
+            return MISS, None
+        if stored.length == len(history) and stored.fingerprint == fingerprint(history):
+            return HIT, stored.model_json
+        if stored.fingerprint == fingerprint(history.iloc[:stored.length]):
+            return WARM, stored.model_json
+        return MISS, None
+
+    def save(self, series_id: str, history: pd.Series, params: dict, model_json: str) -> None:
+        """Write atomically, so concurrent workers never read a partial file"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(series_id, params)
+        stored = StoredModel(fingerprint(history), len(history), model_json)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(stored._asdict(), f)
+        os.replace(f"{path}.tmp", path)
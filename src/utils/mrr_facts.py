@@ -0,0 +1,194 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+
+from utils.fx import get_fx_join
+from utils.incremental import get_commit_safe_watermark
+from utils.instrumentation import timed
+
+FACTS_SOURCE = 'mrr_daily'
+
+# Average days per month, used to express a per-day amount as a monthly rate.
+DAYS_PER_MONTH = 365.25 / 12
+
+
+def get_mrr_daily_insert_query(customer_filter: str = "") -> str:
+    """
+    Return the SQL spreading each recurring invoice evenly over its billing period.
+
+    Every non-forgiven subscription invoice contributes total / period_days to
+    each day in [period_start, period_end). Invoices whose period is zero-length
+    (period_start == period_end, about one in eight in the export) bill their
+    line-item period instead, min_line_item_period_start to
+    max_line_item_period_end, as the subscriptions loader does. Periods still
+    shorter than a day count as one day.
+    The reporting columns convert each day's amount at that day's rate through
+    fx_rates_daily; they stay NULL for currencies without rates.
+    """
+    return f"""
+    INSERT INTO mrr_daily (
+        customer_id, subscription_id, currency, day, daily_amount, mrr, reporting_daily_amount, reporting_mrr
+    )
+    SELECT
+        i.customer_id,
+        i.subscription_id,
+        i.currency,
+        d.day::date,
+        SUM(i.total / p.period_days) as daily_amount,
+        ROUND(SUM(i.total / p.period_days) * {DAYS_PER_MONTH}, 2) as mrr,
+        SUM(i.total / p.period_days / fx.per_eur * rep.per_eur) as reporting_daily_amount,
+        ROUND(SUM(i.total / p.period_days / fx.per_eur * rep.per_eur) * {DAYS_PER_MONTH}, 2) as reporting_mrr
+    FROM invoices i
+    CROSS JOIN LATERAL (
+        SELECT
+            CASE WHEN i.period_end::date > i.period_start::date THEN i.period_start
+                ELSE COALESCE(i.min_line_item_period_start, i.period_start) END::date as start_day,
+            CASE WHEN i.period_end::date > i.period_start::date THEN i.period_end
+                ELSE COALESCE(i.max_line_item_period_end, i.period_end) END::date as end_day
+    ) b
+    CROSS JOIN LATERAL (
+        SELECT GREATEST(b.end_day - b.start_day, 1) as period_days
+    ) p
+    CROSS JOIN LATERAL generate_series(
+        b.start_day,
+        b.start_day + p.period_days - 1,
+        INTERVAL '1 day'
+    ) as d(day)
+    {get_fx_join('i.currency', 'd.day::date')}
+    WHERE i.is_forgiven = FALSE
+    AND i.subscription_id IS NOT NULL
+    AND i.period_start IS NOT NULL
+    AND i.period_end IS NOT NULL
+    {customer_filter}
+    GROUP BY i.customer_id, i.subscription_id, i.currency, d.day::date
+    """
+
+
+def get_summary_refresh_query(day_filter: str = "") -> str:
+    """Return the SQL rebuilding the per-day, per-currency portfolio summary"""
+    return f"""
+    INSERT INTO mrr_daily_summary (
+        day, currency, daily_amount, mrr, reporting_daily_amount, reporting_mrr, active_customers, active_subscriptions
+    )
+    SELECT
+        day,
+        currency,
+        SUM(daily_amount) as daily_amount,
+        SUM(mrr) as mrr,
+        SUM(reporting_daily_amount) as reporting_daily_amount,
+        SUM(reporting_mrr) as reporting_mrr,
+        COUNT(DISTINCT customer_id) as active_customers,
+        COUNT(DISTINCT subscription_id) as active_subscriptions
+    FROM mrr_daily
+    {day_filter}
+    GROUP BY day, currency
+    """
+
+
+def get_refreshed_through(conn) -> Optional[datetime]:
+    """Return the invoices.updated_at watermark of the last refresh, see get_commit_safe_watermark"""
+    return conn.execute(
+        text("SELECT updated_at FROM ingestion_watermarks WHERE source = :source"),
+        {'source': FACTS_SOURCE}
+    ).scalar()
+
+
+def _day_bounds(conn, all_customers: bool = False):
+    customer_filter = "" if all_customers else "WHERE customer_id IN (SELECT customer_id FROM mrr_refresh_customers)"
+    return conn.execute(text(f"""
+        SELECT MIN(day), MAX(day)
+        FROM mrr_daily
+        {customer_filter}
+    """)).one()
+
+
+def mark_months_changed(conn, first_day, last_day) -> None:
+    """Stamp the months from first_day to last_day as changed in mrr_daily_months"""
+    conn.execute(text("""
+        INSERT INTO mrr_daily_months (month, changed_at)
+        SELECT month::date, NOW()
+        FROM generate_series(DATE_TRUNC('month', CAST(:first_day AS DATE)), CAST(:last_day AS DATE), INTERVAL '1 month') as month
+        ON CONFLICT (month)
+        DO UPDATE SET changed_at = EXCLUDED.changed_at
+    """), {'first_day': first_day, 'last_day': last_day})
+
+
+@timed('refresh_mrr_daily')
+def refresh_mrr_daily(engine: create_engine, full: bool = False) -> int:
+    """
+    Bring mrr_daily and mrr_daily_summary up to date with the invoices table.
+
+    An incremental refresh only rebuilds the customers with invoices updated since
+    the previous refresh, and only the summary days their facts span. The
+    watermark is commit-safe, so invoices of loads still running during a refresh
+    are picked up by the next one. Customers still holding facts of a changed
+    invoice's subscription are rebuilt too, so an invoice moved to another
+    customer leaves nothing behind under the previous one. The months whose facts
+    may have changed are stamped in mrr_daily_months.
+
+    Returns:
+        int: Number of customers refreshed (all customers on a full refresh).
+    """
+    with engine.connect() as conn:
+        refreshed_through = get_commit_safe_watermark(conn)
+        since = None if full else get_refreshed_through(conn)
+
+        if since is None:
+            old_min, old_max = _day_bounds(conn, all_customers=True)
+            conn.execute(text("TRUNCATE mrr_daily, mrr_daily_summary"))
+            conn.execute(text(get_mrr_daily_insert_query()))
+            conn.execute(text(get_summary_refresh_query()))
+            customers = conn.execute(text("SELECT COUNT(DISTINCT customer_id) FROM mrr_daily")).scalar()
+            new_min, new_max = _day_bounds(conn, all_customers=True)
+        else:
+            conn.execute(text("""
+                CREATE TEMP TABLE mrr_refresh_customers ON COMMIT DROP AS
+                WITH changed AS (
+                    SELECT customer_id, subscription_id
+                    FROM invoices
+                    WHERE updated_at >= :since
+                )
+                SELECT customer_id FROM changed
+                UNION
+                SELECT d.customer_id
+                FROM mrr_daily d
+                WHERE d.subscription_id IN (SELECT subscription_id FROM changed)
+            """), {'since': since})
+            customers = conn.execute(text("SELECT COUNT(*) FROM mrr_refresh_customers")).scalar()
+
+            old_min, old_max = _day_bounds(conn)
+            conn.execute(text("""
+                DELETE FROM mrr_daily
+                WHERE customer_id IN (SELECT customer_id FROM mrr_refresh_customers)
+            """))
+            conn.execute(text(get_mrr_daily_insert_query(
+                "AND i.customer_id IN (SELECT customer_id FROM mrr_refresh_customers)"
+            )))
+            new_min, new_max = _day_bounds(conn)
+
+        days = [d for d in (old_min, old_max, new_min, new_max) if d is not None]
+        if days:
+            bounds = {'first_day': min(days), 'last_day': max(days)}
+            if since is not None:
+                conn.execute(text("""
+                    DELETE FROM mrr_daily_summary
+                    WHERE day BETWEEN :first_day AND :last_day
+                """), bounds)
+                conn.execute(
+                    text(get_summary_refresh_query("WHERE day BETWEEN :first_day AND :last_day")),
+                    bounds
+                )
+            mark_months_changed(conn, bounds['first_day'], bounds['last_day'])
+
+        conn.execute(text("""
+            INSERT INTO ingestion_watermarks (source, last_run_rows, updated_at)
+            VALUES (:source, :customers, :refreshed_through)
+            ON CONFLICT (source)
+            DO UPDATE SET
+                last_run_rows = EXCLUDED.last_run_rows,
+                updated_at = EXCLUDED.updated_at
+        """), {'source': FACTS_SOURCE, 'customers': customers, 'refreshed_through': refreshed_through})
+        conn.commit()
+
+    return customers
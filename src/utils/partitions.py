@@ -0,0 +1,148 @@
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+# Tables that setup_db.py --partitioned creates with monthly range partitions.
+PARTITIONED_TABLES: Dict[str, str] = {
+    'invoices': 'created_at',
+    'payments': 'created_at',
+}
+
+ARCHIVE_SCHEMA = 'archive'
+
+
+def month_start(value) -> date:
+    return pd.Timestamp(value).date().replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def get_default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def _bound(month: date) -> str:
+    # Bounds are UTC midnights so they do not depend on the session time zone.
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.oid = to_regclass(:table)
+        )
+    """), {'table': table}).scalar()
+
+
+def list_partitions(conn, table: str) -> Dict[date, str]:
+    """Return the monthly partitions of a table keyed by month, read from pg_inherits"""
+    result = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+    """), {'table': table})
+    prefix = f"{table}_p"
+    partitions = {}
+    for (name,) in result.fetchall():
+        if name.startswith(prefix):
+            partitions[datetime.strptime(name[len(prefix):], '%Y_%m').date()] = name
+    return partitions
+
+
+def create_partition(conn, table: str, month: date) -> str:
+    """
+    Create and attach the partition holding one month of a table.
+
+    Rows that already landed in the default partition for that month are moved
+    into the new partition first, since ATTACH rejects bounds the default
+    partition still has rows for.
+    """
+    column = PARTITIONED_TABLES[table]
+    name = get_partition_name(table, month)
+    start, end = _bound(month), _bound(add_months(month, 1))
+
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {get_default_partition_name(table)}
+            WHERE {column} >= {start} AND {column} < {end}
+            RETURNING *
+        )
+        INSERT INTO {name}
+        SELECT * FROM moved
+    """))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})"))
+    return name
+
+
+def ensure_partitions(conn, table: str, first_month: date, last_month: date) -> List[str]:
+    """Create the missing monthly partitions between two months, inclusive"""
+    existing = list_partitions(conn, table)
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            created.append(create_partition(conn, table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions_for(conn, table: str, timestamps: pd.Series) -> List[str]:
+    """Create the partitions a batch of rows will land in, if the table is partitioned"""
+    timestamps = timestamps.dropna()
+    if timestamps.empty or not is_partitioned(conn, table):
+        return []
+    return ensure_partitions(conn, table, month_start(timestamps.min()), month_start(timestamps.max()))
+
+
+def detach_partitions(
+    conn,
+    table: str,
+    before_month: date,
+    archive_schema: Optional[str] = ARCHIVE_SCHEMA,
+) -> List[str]:
+    """
+    Detach the partitions of months before before_month.
+
+    Detached partitions are moved to archive_schema, where they stay queryable
+    outside the table, or dropped when archive_schema is None.
+    """
+    detached = []
+    for month, name in sorted(list_partitions(conn, table).items()):
+        if month >= before_month:
+            continue
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if archive_schema is None:
+            conn.execute(text(f"DROP TABLE {name}"))
+        else:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+        detached.append(name)
+    return detached
+
+
+def get_recent_weeks_start(conn, weeks: int) -> Optional[datetime]:
+    """
+    Return the start of the last N weeks of invoices, counting the latest week.
+
+    Filtering created_at on this value lets a partitioned invoices table prune
+    every month before it.
+    """
+    return conn.execute(text("""
+        SELECT DATE_TRUNC('week', MAX(created_at)) - make_interval(weeks => :weeks - 1)
+        FROM invoices
+        WHERE is_forgiven = FALSE
+    """), {'weeks': weeks}).scalar()
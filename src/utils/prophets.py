@@ -2,27 +2,21 @@ from typing import Optional
 
 import pandas as pd
 from prophet import Prophet
+from prophet.serialize import model_to_json
 
-class InvalidTimeSeriesIndexException(Exception):
-    """Exception raised when the DataFrame does not have a timeseries index."""
+from utils.timeseries import InvalidTimeSeriesIndexException, check_timeseries_index
 
-    def __init__(self, message: str = "DataFrame does not have a timeseries index.") -> None:
-        self.message: str = message
-        super().__init__(self.message)
-
-
-def check_timeseries_index(transactions: pd.DataFrame) -> None:
+def warm_start_params(model: Prophet) -> dict:
     """
-    Check if the DataFrame has a time series index.
+    Fitted parameters of a model in the form Prophet.fit accepts as init.
 
-    Parameters:
-    - transactions (pd.DataFrame): The DataFrame to check.
-
-    Raises:
-    - InvalidTimeSeriesIndexException: If the DataFrame does not have a DatetimeIndex.
+    Returns:
+        dict: Trend 'k', 'm', 'delta', noise 'sigma_obs' and seasonal 'beta'.
     """
-    if not isinstance(transactions.index, pd.DatetimeIndex):
-        raise InvalidTimeSeriesIndexException()
+    params = model.params
+    init = {name: params[name][0][0] for name in ["k", "m", "sigma_obs"]}
+    init.update({name: params[name][0] for name in ["delta", "beta"]})
+    return init
 
 class ProphetModelBuilder:
     def __init__(
@@ -33,7 +27,15 @@ class ProphetModelBuilder:
         yearly_seasonality: bool = False,
         weekly_seasonality: bool = False,
         daily_seasonality: bool = False,
+        model: Optional[Prophet] = None,
+        init: Optional[dict] = None,
     ):
+        """
+        Fit a Prophet model on data, unless an already fitted model is given.
+
+        init holds starting values for the optimizer, e.g. warm_start_params() of a
+        previous fit on a shorter history, so refits converge in fewer iterations.
+        """
         check_timeseries_index(data)
         self.data = data
         self.target_column = target_column
@@ -41,7 +43,8 @@ class ProphetModelBuilder:
         self.yearly_seasonality = yearly_seasonality
         self.weekly_seasonality = weekly_seasonality
         self.daily_seasonality = daily_seasonality
-        self.model = self._build_model()
+        self._forecasts: dict[int, pd.DataFrame] = {}
+        self.model = model if model is not None else self._build_model(init)
         self.changepoints = self.model.changepoints
 
     def _prepare_data_for_prophet(self) -> pd.DataFrame:
@@ -60,10 +63,13 @@ class ProphetModelBuilder:
 
         return prophet_df
 
-    def _build_model(self) -> Prophet:
+    def _build_model(self, init: Optional[dict] = None) -> Prophet:
         """
         Build the Prophet model for forecasting.
 
+        Parameters:
+            init (Optional[dict]): Starting values for the optimizer.
+
         Returns:
             Prophet: Fitted Prophet model.
         """
@@ -78,10 +84,42 @@ class ProphetModelBuilder:
             for exog in self.exog_columns:
                 model.add_regressor(f"add_{exog}")
 
-        model.fit(prophet_df)
+        if init is not None:
+            model.fit(prophet_df, init=init)
+        else:
+            model.fit(prophet_df)
         self.changepoints = model.changepoints
         return model
 
+    def to_json(self) -> str:
+        """Serialize the fitted model, e.g. for a model store"""
+        return model_to_json(self.model)
+
+    def forecast(self, forecast_periods: int) -> pd.DataFrame:
+        """
+        Predict the history and the next forecast_periods in a single pass.
+
+        The result is kept per horizon, so point forecasts and intervals for the
+        same horizon share one predict call.
+
+        Parameters:
+            forecast_periods (int): Number of periods to forecast.
+
+        Returns:
+            pd.DataFrame: Prophet's forecast with 'ds', 'yhat', 'yhat_lower' and 'yhat_upper'.
+        """
+        if forecast_periods not in self._forecasts:
+            future = self.model.make_future_dataframe(
+                periods=forecast_periods, freq=self.data.index.freq or "D"
+            )
+
+            if self.exog_columns:
+                for exog in self.exog_columns:
+                    future[f"add_{exog}"] = self.data[exog].values[-1]
+
+            self._forecasts[forecast_periods] = self.model.predict(future)
+        return self._forecasts[forecast_periods]
+
     def generate_forecasts(self, forecast_periods: int) -> pd.DataFrame:
         """
         Generate forecasts using the stored model.
@@ -92,16 +130,7 @@ class ProphetModelBuilder:
         Returns:
             pd.DataFrame: Forecasted values.
         """
-        future = self.model.make_future_dataframe(
-            periods=forecast_periods, freq=self.data.index.freq or "D"
-        )
-
-        if self.exog_columns:
-            for exog in self.exog_columns:
-                future[f"add_{exog}"] = self.data[exog].values[-1]
-
-        forecast = self.model.predict(future)
-        return forecast[["ds", "yhat"]]
+        return self.forecast(forecast_periods)[["ds", "yhat"]]
 
     def generate_confidence_intervals(self, forecast_periods: int) -> pd.DataFrame:
         """
@@ -113,18 +142,9 @@ class ProphetModelBuilder:
         Returns:
             pd.DataFrame: DataFrame with 'lower_bound' and 'upper_bound' columns.
         """
-        future = self.model.make_future_dataframe(
-            periods=forecast_periods, freq=self.data.index.freq or "D"
-        )
-
-        if self.exog_columns:
-            for exog in self.exog_columns:
-                future[f"add_{exog}"] = self.data[exog].values[-1]
-
-        forecast = self.model.predict(future)
-        conf_int = forecast[["ds", "yhat_lower", "yhat_upper"]]
+        conf_int = self.forecast(forecast_periods)[["ds", "yhat_lower", "yhat_upper"]]
         conf_int = conf_int.rename(
             columns={"yhat_lower": "lower_bound", "yhat_upper": "upper_bound"}
         )
 
-        return conf_int
\ No newline at end of file
+        return conf_int
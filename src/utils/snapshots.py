@@ -0,0 +1,79 @@
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SNAPSHOT_DIR = 'output/snapshots'
+
+
+def get_snapshot_path(name: str, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(snapshot_dir, name)
+
+
+def get_snapshot_date() -> str:
+    """Return today's partition value, replacing the date tag of the CSV outputs"""
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def clear_snapshot(name: str, snapshot_dir: str = SNAPSHOT_DIR) -> None:
+    """Remove a snapshot dataset so it can be rewritten from scratch"""
+    shutil.rmtree(get_snapshot_path(name, snapshot_dir), ignore_errors=True)
+
+
+def write_snapshot(
+    df: pd.DataFrame,
+    name: str,
+    partition_cols: List[str],
+    snapshot_dir: str = SNAPSHOT_DIR,
+    part: Optional[str] = None,
+) -> str:
+    """
+    Write a DataFrame as a hive-partitioned Parquet dataset.
+
+    Partitions present in df replace the ones on disk, so re-running a calculator
+    for the same date overwrites its snapshot. When part is given the files are
+    appended under that name instead, which lets chunked exports write one batch
+    at a time after clear_snapshot().
+
+    Returns:
+        str: Path of the dataset.
+    """
+    path = get_snapshot_path(name, snapshot_dir)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if part is None:
+        pq.write_to_dataset(
+            table, path, partition_cols=partition_cols,
+            existing_data_behavior='delete_matching'
+        )
+    else:
+        pq.write_to_dataset(
+            table, path, partition_cols=partition_cols,
+            basename_template=f"{part}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore'
+        )
+    return path
+
+
+def read_snapshot(
+    name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[list] = None,
+    snapshot_dir: str = SNAPSHOT_DIR,
+) -> pd.DataFrame:
+    """
+    Read a snapshot dataset through memory-mapped Parquet files.
+
+    filters are pushed down to partition pruning, e.g.
+    read_snapshot('invoices', filters=[('currency', '=', 'eur')]).
+    """
+    table = pq.read_table(
+        get_snapshot_path(name, snapshot_dir),
+        columns=columns,
+        filters=filters,
+        memory_map=True,
+    )
+    return table.to_pandas()
@@ -0,0 +1,22 @@
+import pandas as pd
+
+class InvalidTimeSeriesIndexException(Exception):
+    """Exception raised when the DataFrame does not have a timeseries index."""
+
+    def __init__(self, message: str = "DataFrame does not have a timeseries index.") -> None:
+        self.message: str = message
+        super().__init__(self.message)
+
+
+def check_timeseries_index(transactions: pd.DataFrame) -> None:
+    """
+    Check if the DataFrame has a time series index.
+
+    Parameters:
+    - transactions (pd.DataFrame): The DataFrame to check.
+
+    Raises:
+    - InvalidTimeSeriesIndexException: If the DataFrame does not have a DatetimeIndex.
+    """
+    if not isinstance(transactions.index, pd.DatetimeIndex):
+        raise InvalidTimeSeriesIndexException()
@@ -0,0 +1,391 @@
+import heapq
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from utils.fetch import fetch_dataframe
+from utils.incremental import get_commit_safe_watermark
+
+TOP_K_STATE_FILE = 'output/top_k_state.npz'
+
+GRAINS = ['day', 'week', 'month']
+
+DEFAULT_K = 10
+DEFAULT_ROLLING_DAYS = (7, 30)
+
+
+# Invoices written since the watermark, read through idx_invoices_updated_at, with
+# what each now contributes: its total on its UTC day, or 0 once forgiven.
+CHANGED_INVOICES = """
+    SELECT
+        invoice_id,
+        customer_id,
+        currency,
+        CAST(created_at AT TIME ZONE 'UTC' AS DATE) as day,
+        CASE WHEN is_forgiven THEN 0 ELSE total END as amount
+    FROM invoices
+    WHERE CAST(:since AS TIMESTAMPTZ) IS NULL
+    OR updated_at >= CAST(:since AS TIMESTAMPTZ)
+"""
+
+
+def get_contribution_changes_query() -> str:
+    """
+    Net change per customer, currency and day of the invoices written since the
+    watermark: their new amounts less what top_k_contributions says they
+    contributed before.
+    """
+    return f"""
+    WITH changed AS ({CHANGED_INVOICES}),
+    changes AS (
+        SELECT customer_id, currency, day, amount
+        FROM changed
+        UNION ALL
+        SELECT c.customer_id, c.currency, c.day, -c.amount
+        FROM top_k_contributions c
+        JOIN changed USING (invoice_id)
+    )
+    SELECT customer_id, currency, day, SUM(amount) as amount
+    FROM changes
+    GROUP BY customer_id, currency, day;
+    """
+
+
+def get_contributions_upsert_query() -> str:
+    return f"""
+    INSERT INTO top_k_contributions (invoice_id, customer_id, currency, day, amount)
+    {CHANGED_INVOICES}
+    ON CONFLICT (invoice_id) DO UPDATE SET
+        customer_id = EXCLUDED.customer_id,
+        currency = EXCLUDED.currency,
+        day = EXCLUDED.day,
+        amount = EXCLUDED.amount;
+    """
+
+
+def bucket_start(day: date, grain: str) -> date:
+    """First day of the day, ISO week (Monday) or month containing day, as DATE_TRUNC does"""
+    if grain == 'day':
+        return day
+    if grain == 'week':
+        return day - timedelta(days=day.weekday())
+    if grain == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown grain {grain}, expected one of {GRAINS}")
+
+
+def bucket_starts(days: np.ndarray, grain: str) -> np.ndarray:
+    """bucket_start over an array of datetime64[D] days"""
+    if grain == 'day':
+        return days
+    if grain == 'week':
+        # 1970-01-01 was a Thursday, three days after a Monday.
+        return days - (days.astype('int64') + 3) % 7
+    if grain == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Unknown grain {grain}, expected one of {GRAINS}")
+
+
+class Leaderboard:
+    """
+    Running per-customer totals of one window, with a bounded min-heap of its top k.
+
+    Growing totals only ever push out the heap's smallest entry. A member's total
+    shrinking (credit notes, forgiven or corrected invoices) can let an outsider
+    overtake it, which the heap cannot see, so the board is marked dirty and the
+    heap is rebuilt from the totals on the next read.
+    """
+
+    __slots__ = ('k', 'totals', 'heap', 'dirty')
+
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self.totals: Dict[str, float] = {}
+        self.heap: List[Tuple[float, str]] = []
+        self.dirty = False
+
+    def add(self, customer_id: str, amount: float) -> None:
+        total = self.totals.get(customer_id, 0.0) + amount
+        self.totals[customer_id] = total
+        if self.dirty:
+            return
+
+        for i, (_, member) in enumerate(self.heap):
+            if member == customer_id:
+                if amount < 0:
+                    self.dirty = True
+                else:
+                    self.heap[i] = (total, customer_id)
+                    heapq.heapify(self.heap)
+                return
+
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (total, customer_id))
+        elif (total, customer_id) > self.heap[0]:
+            heapq.heapreplace(self.heap, (total, customer_id))
+
+    def rebuild(self) -> None:
+        self.heap = heapq.nlargest(self.k, ((total, customer) for customer, total in self.totals.items()))
+        heapq.heapify(self.heap)
+        self.dirty = False
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        The k largest customers, biggest first.
+
+        Up to the board's own k this reads the heap, O(k log k); a larger k ranks
+        all the window's totals.
+        """
+        k = self.k if k is None else k
+        if k > self.k:
+            ranked = heapq.nlargest(k, ((total, customer) for customer, total in self.totals.items()))
+        else:
+            if self.dirty:
+                self.rebuild()
+            ranked = sorted(self.heap, reverse=True)[:k]
+        return [(customer, total) for total, customer in ranked]
+
+
+class TopKEngine:
+    """
+    Top-k customers by invoiced total per currency over day, week and month
+    buckets and over the trailing rolling_days days.
+
+    The engine only holds the leaderboards. What each invoice contributed lives
+    in top_k_contributions, so refreshes fold in net changes per customer and
+    day, and a rewritten or forgiven invoice replaces its previous amount instead
+    of being counted twice. Rolling windows end on the latest day seen and are
+    recomputed from the day buckets when that day moves forward.
+    """
+
+    def __init__(self, k: int = DEFAULT_K, rolling_days: Sequence[int] = DEFAULT_ROLLING_DAYS) -> None:
+        self.k = k
+        self.rolling_days = sorted(set(rolling_days))
+        self.boards: Dict[Tuple[str, str, date], Leaderboard] = {}
+        self.rolling: Dict[Tuple[int, str], Leaderboard] = {}
+        self.last_day: Optional[date] = None
+        self.watermark: Optional[datetime] = None
+        self.refresh_id: Optional[str] = None
+
+    @property
+    def currencies(self) -> List[str]:
+        return sorted({currency for _, currency, _ in self.boards})
+
+    def buckets(self, grain: str, currency: str) -> List[date]:
+        return sorted(bucket for g, c, bucket in self.boards if g == grain and c == currency)
+
+    def _board(self, key: tuple, boards: dict) -> Leaderboard:
+        board = boards.get(key)
+        if board is None:
+            board = boards[key] = Leaderboard(self.k)
+        return board
+
+    def _add(self, customer_id: str, currency: str, day: date, amount: float, rolling: bool) -> None:
+        for grain in GRAINS:
+            self._board((grain, currency, bucket_start(day, grain)), self.boards).add(customer_id, amount)
+        if rolling:
+            for days in self.rolling_days:
+                if self.last_day - timedelta(days=days) < day <= self.last_day:
+                    self._board((days, currency), self.rolling).add(customer_id, amount)
+
+    def _rebuild_rolling(self) -> None:
+        self.rolling = {}
+        for days in self.rolling_days:
+            window = [self.last_day - timedelta(days=offset) for offset in range(days)]
+            for currency in self.currencies:
+                board = self._board((days, currency), self.rolling)
+                for day in window:
+                    day_board = self.boards.get(('day', currency, day))
+                    if day_board is not None:
+                        for customer_id, total in day_board.totals.items():
+                            board.totals[customer_id] = board.totals.get(customer_id, 0.0) + total
+                board.rebuild()
+
+    def apply(self, changes: pd.DataFrame) -> int:
+        """
+        Fold net changes into the boards.
+
+        changes holds customer_id, currency, day and amount, the change of a
+        customer's total on that day, e.g. from get_contribution_changes_query().
+
+        Returns:
+            int: Changes applied.
+        """
+        if changes.empty:
+            return 0
+        days = pd.to_datetime(changes['day']).dt.date
+        latest_day = days.max()
+        advanced = self.last_day is None or latest_day > self.last_day
+        if advanced:
+            self.last_day = latest_day
+
+        for customer_id, currency, day, amount in zip(
+            changes['customer_id'], changes['currency'], days, changes['amount'].astype(float)
+        ):
+            if amount != 0:
+                self._add(customer_id, currency, day, amount, rolling=not advanced)
+
+        if advanced:
+            self._rebuild_rolling()
+        return len(changes)
+
+    def top(
+        self,
+        currency: str,
+        grain: str = 'week',
+        bucket: Optional[date] = None,
+        days: Optional[int] = None,
+        k: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Leaderboard of one currency: the trailing days-day window when days is
+        given, otherwise the grain bucket containing bucket (default the latest).
+        """
+        if days is not None:
+            if days not in self.rolling_days:
+                raise ValueError(f"Rolling window of {days} days is not maintained, expected one of {self.rolling_days}")
+            board = self.rolling.get((days, currency))
+        else:
+            if bucket is None:
+                buckets = self.buckets(grain, currency)
+                if not buckets:
+                    return []
+                bucket = buckets[-1]
+            board = self.boards.get((grain, currency, bucket_start(bucket, grain)))
+        return board.top(k) if board is not None else []
+
+    def to_frame(
+        self,
+        grain: str = 'week',
+        days: Optional[int] = None,
+        currencies: Optional[Iterable[str]] = None,
+        k: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Ranked leaderboards of every bucket of a grain, or of a rolling window, per currency"""
+        rows = []
+        for currency in currencies or self.currencies:
+            if days is not None:
+                windows = [(self.last_day - timedelta(days=days - 1), None)]
+            else:
+                windows = [(bucket, bucket) for bucket in self.buckets(grain, currency)]
+            for window_start, bucket in windows:
+                ranked = self.top(currency, grain, bucket, days, k)
+                rows.extend(
+                    (window_start, currency, rank, customer_id, total)
+                    for rank, (customer_id, total) in enumerate(ranked, start=1)
+                )
+        return pd.DataFrame(rows, columns=['window_start', 'currency', 'rank', 'customer_id', 'total_spend'])
+
+    def save(self, path: str = TOP_K_STATE_FILE) -> None:
+        """
+        Write the day boards' totals as flat arrays; week, month and rolling
+        boards are sums of them and are rebuilt on load.
+        """
+        keys, customers, totals = [], [], []
+        for (grain, currency, bucket), board in self.boards.items():
+            if grain == 'day' and board.totals:
+                keys.extend([(currency, bucket)] * len(board.totals))
+                customers.extend(board.totals.keys())
+                totals.extend(board.totals.values())
+        with open(f"{path}.tmp", 'wb') as f:
+            np.savez_compressed(
+                f,
+                k=np.array([self.k]),
+                rolling_days=np.array(self.rolling_days, dtype='int64'),
+                last_day=np.array([self.last_day], dtype='datetime64[D]'),
+                watermark=np.array([_to_naive_utc(self.watermark)], dtype='datetime64[us]'),
+                refresh_id=np.array([self.refresh_id or ''], dtype='U32'),
+                currency=np.array([currency for currency, _ in keys], dtype='U3'),
+                day=np.array([bucket for _, bucket in keys], dtype='datetime64[D]'),
+                customer_id=np.array(customers, dtype='U'),
+                total=np.array(totals, dtype='float64'),
+            )
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str = TOP_K_STATE_FILE) -> Optional['TopKEngine']:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            top_k = cls(int(data['k'][0]), data['rolling_days'].tolist())
+            last_day, watermark = data['last_day'][0], data['watermark'][0]
+            top_k.last_day = None if np.isnat(last_day) else last_day.item()
+            top_k.watermark = None if np.isnat(watermark) else pd.Timestamp(watermark).tz_localize('UTC').to_pydatetime()
+            top_k.refresh_id = str(data['refresh_id'][0]) or None
+            day_totals = pd.DataFrame({
+                'currency': data['currency'],
+                'day': data['day'],
+                'customer_id': data['customer_id'],
+                'total': data['total'],
+            })
+        for grain in GRAINS:
+            bucketed = day_totals.assign(bucket=bucket_starts(day_totals['day'].to_numpy(dtype='datetime64[D]'), grain))
+            grouped = bucketed.groupby(['currency', 'bucket', 'customer_id'], sort=False)['total'].sum()
+            for (currency, bucket), board_totals in grouped.groupby(level=['currency', 'bucket'], sort=False):
+                board = top_k._board((grain, currency, pd.Timestamp(bucket).date()), top_k.boards)
+                board.totals = dict(zip(board_totals.index.get_level_values('customer_id'), board_totals.tolist()))
+                board.rebuild()
+        if top_k.last_day is not None:
+            top_k._rebuild_rolling()
+        return top_k
+
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return pd.Timestamp(value).tz_convert('UTC').tz_localize(None).to_pydatetime()
+
+
+def refresh_top_k(
+    engine: create_engine,
+    path: str = TOP_K_STATE_FILE,
+    full: bool = False,
+    k: int = DEFAULT_K,
+    rolling_days: Sequence[int] = DEFAULT_ROLLING_DAYS,
+) -> TopKEngine:
+    """
+    Bring the persisted leaderboards up to date with the invoices written since
+    the last refresh.
+
+    The state is rebuilt from scratch when full is given, when it keeps fewer
+    than k customers or lacks one of the rolling windows (it then keeps the
+    larger k and every rolling window asked for so far), or when it does not
+    belong to the refresh top_k_contributions was last written by.
+
+    The changes are read and the contributions updated in one REPEATABLE READ
+    transaction, so both see the same invoices. The state file is written just
+    before it commits; a file whose refresh never committed no longer matches
+    top_k_state and is rebuilt.
+    """
+    top_k = None if full else TopKEngine.load(path)
+    if top_k is not None and (top_k.k < k or not set(rolling_days) <= set(top_k.rolling_days)):
+        k, rolling_days = max(k, top_k.k), set(rolling_days) | set(top_k.rolling_days)
+        top_k = None
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='REPEATABLE READ')
+        refreshed_through = get_commit_safe_watermark(conn)
+        refresh_id = conn.execute(text("SELECT refresh_id FROM top_k_state")).scalar()
+        if top_k is None or top_k.refresh_id != refresh_id:
+            top_k = TopKEngine(k, rolling_days)
+            conn.execute(text("TRUNCATE top_k_contributions"))
+
+        params = {'since': top_k.watermark}
+        top_k.apply(fetch_dataframe(conn, get_contribution_changes_query(), params))
+        conn.execute(text(get_contributions_upsert_query()), params)
+
+        top_k.watermark = refreshed_through
+        top_k.refresh_id = uuid.uuid4().hex
+        conn.execute(text("""
+            INSERT INTO top_k_state (id, refresh_id, refreshed_at)
+            VALUES (TRUE, :refresh_id, NOW())
+            ON CONFLICT (id) DO UPDATE SET refresh_id = EXCLUDED.refresh_id, refreshed_at = EXCLUDED.refreshed_at
+        """), {'refresh_id': top_k.refresh_id})
+        top_k.save(path)
+        conn.commit()
+    return top_k
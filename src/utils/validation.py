@@ -0,0 +1,102 @@
+import json
+from typing import Callable, Collection, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.bulk_load import copy_dataframe
+
+QUARANTINE_COLUMNS = ['source', 'record_id', 'reasons', 'payload']
+
+
+class Rule(NamedTuple):
+    """
+    A named row check.
+
+    check(df, raw) returns a boolean Series that is True for rows that pass.
+    df is the parsed batch and raw the batch as read from the CSV, so parse
+    failures can be told apart from values that were missing in the first place.
+    """
+    name: str
+    check: Callable[[pd.DataFrame, pd.DataFrame], pd.Series]
+
+
+def required(column: str) -> Rule:
+    return Rule(f"missing_{column}", lambda df, raw: df[column].notna())
+
+
+def parsed(column: str) -> Rule:
+    """Values present in the CSV must survive type conversion"""
+    return Rule(f"malformed_{column}", lambda df, raw: ~(raw[column].notna() & df[column].isna()))
+
+
+def one_of(column: str, allowed: Collection) -> Rule:
+    allowed = list(allowed)
+    return Rule(f"unknown_{column}", lambda df, raw: df[column].isin(allowed) | df[column].isna())
+
+
+def between(column: str, low: float, high: float) -> Rule:
+    return Rule(f"out_of_range_{column}", lambda df, raw: df[column].between(low, high) | df[column].isna())
+
+
+def not_after(start_column: str, end_column: str) -> Rule:
+    return Rule(
+        f"{start_column}_after_{end_column}",
+        lambda df, raw: ~(df[start_column] > df[end_column]).fillna(False)
+    )
+
+
+def references(column: str, keys: Collection) -> Rule:
+    """Foreign-key existence against an in-memory key set"""
+    return Rule(f"unknown_{column}_reference", lambda df, raw: df[column].isin(keys) | df[column].isna())
+
+
+def parse_flags(series: pd.Series) -> pd.Series:
+    """Map TRUE/FALSE flags to a nullable boolean; missing and malformed flags become NA"""
+    return series.astype('string').str.upper().map({'TRUE': True, 'FALSE': False}).astype('boolean')
+
+
+def validate(
+    df: pd.DataFrame,
+    raw: pd.DataFrame,
+    rules: List[Rule],
+    key_column: str,
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Evaluate every rule as a column mask over the whole batch.
+
+    Only the failing rows, usually none, are turned into quarantine records
+    naming the rules they broke, with their raw CSV values as payload.
+
+    Returns:
+        Tuple[np.ndarray, pd.DataFrame]: Boolean mask of the valid rows, and the
+        rejected rows as record_id, reasons, payload.
+    """
+    if not rules or df.empty:
+        return np.ones(len(df), dtype=bool), pd.DataFrame(columns=QUARANTINE_COLUMNS[1:])
+
+    failures = np.column_stack([
+        ~rule.check(df, raw).fillna(False).to_numpy(dtype=bool) for rule in rules
+    ])
+    rejected = failures.any(axis=1)
+    if not rejected.any():
+        return ~rejected, pd.DataFrame(columns=QUARANTINE_COLUMNS[1:])
+
+    names = np.array([f"{rule.name};" for rule in rules], dtype=object)
+    reasons = (failures[rejected].astype(object) @ names)
+    bad_rows = raw[rejected].astype(object)
+    bad_rows = bad_rows.where(bad_rows.notna(), None)
+    quarantined = pd.DataFrame({
+        'record_id': raw.loc[rejected, key_column].to_numpy(),
+        'reasons': [reason.rstrip(';') for reason in reasons],
+        'payload': [json.dumps(record, default=str) for record in bad_rows.to_dict('records')],
+    })
+    return ~rejected, quarantined
+
+
+def save_quarantine(conn, quarantined: pd.DataFrame, source: str) -> int:
+    """Append rejected rows to ingestion_quarantine on an open connection"""
+    if quarantined.empty:
+        return 0
+    copy_dataframe(conn, quarantined.assign(source=source), 'ingestion_quarantine', QUARANTINE_COLUMNS)
+    return len(quarantined)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.baselines import BaselineModelBuilder, holt_winters, linear_trend, seasonal_naive, series_starts
+
+WEEK = np.array([10.0, 12.0, 14.0, 13.0, 11.0, 5.0, 4.0])
+
+
+def test_seasonal_naive_repeats_the_last_season():
+    values = np.tile(WEEK, 3)[None, :]
+    fitted, forecasts = seasonal_naive(values, 10, 7)
+
+    np.testing.assert_array_equal(forecasts[0], np.tile(WEEK, 2)[:10])
+    assert np.isnan(fitted[0, :7]).all()
+    np.testing.assert_array_equal(fitted[0, 7:], values[0, :-7])
+
+
+def test_linear_trend_fits_each_series_on_its_own_span():
+    line = 3.0 + 2.0 * np.arange(20)
+    late = np.where(np.arange(20) >= 8, 50.0 - np.arange(20), np.nan)
+    fitted, forecasts = linear_trend(np.vstack([line, late]), 3)
+
+    np.testing.assert_allclose(forecasts[0], 3.0 + 2.0 * np.arange(20, 23))
+    np.testing.assert_allclose(forecasts[1], 50.0 - np.arange(20, 23))
+    assert np.isnan(fitted[1, :8]).all()
+
+
+def test_holt_winters_tracks_a_trending_season():
+    t = np.arange(70)
+    values = (100 + 0.5 * t + np.tile(WEEK, 10))[None, :]
+    _, forecasts = holt_winters(values, 7, 7)
+
+    expected = 100 + 0.5 * np.arange(70, 77) + WEEK
+    np.testing.assert_allclose(forecasts[0], expected, rtol=0.02)
+
+
+def test_series_starts():
+    values = np.array([[1.0, 2.0, 3.0], [np.nan, np.nan, 4.0]])
+    assert series_starts(values).tolist() == [0, 2]
+
+
+def wide_frame(**columns):
+    index = pd.date_range('2024-01-01', periods=max(len(c) for c in columns.values()), freq='D')
+    return pd.DataFrame({name: pd.Series(values, index=index[:len(values)]) for name, values in columns.items()}, index=index)
+
+
+@pytest.mark.parametrize('method', ['seasonal_naive', 'holt_winters', 'linear_trend'])
+def test_builder_fits_mixed_spans_like_separate_fits(method):
+    rng = np.random.default_rng(0)
+    long = 100 + np.tile(WEEK, 8) + rng.normal(0, 1, 56)
+    short = np.concatenate([[np.nan] * 20, 50 + np.tile(WEEK, 5)[:30] + rng.normal(0, 1, 30)])
+    ended = 80 + np.tile(WEEK, 6)[:40]
+    data = wide_frame(long=long, short=short, ended=ended)
+
+    together = BaselineModelBuilder(data, method=method).generate_forecasts(14)
+    for name in data.columns:
+        alone = BaselineModelBuilder(data[[name]].dropna(), method=method).generate_forecasts(14)
+        mine = together[together['series'] == name].reset_index(drop=True)
+        pd.testing.assert_frame_equal(mine, alone.reset_index(drop=True), check_exact=False, rtol=1e-9)
+
+    # Each series is forecast from its own last day.
+    last_days = together.groupby('series')['ds'].max()
+    assert last_days['ended'] == pd.Timestamp('2024-01-01') + pd.Timedelta(days=39 + 14)
+    assert last_days['long'] == pd.Timestamp('2024-01-01') + pd.Timedelta(days=55 + 14)
+
+
+def test_builder_bounds_contain_the_forecast():
+    data = wide_frame(mrr=100 + np.tile(WEEK, 8) + np.random.default_rng(0).normal(0, 1, 56))
+    builder = BaselineModelBuilder(data, method='seasonal_naive')
+    forecast = builder.forecast(14).dropna()
+
+    # Seasonal naive has no fit for the first season.
+    assert len(forecast) == 56 - 7 + 14
+    assert (forecast['yhat_lower'] < forecast['yhat']).all()
+    assert (forecast['yhat'] < forecast['yhat_upper']).all()
+    # The forecast interval widens once per season ahead.
+    width = (forecast['yhat_upper'] - forecast['yhat_lower']).to_numpy()
+    assert width[-14] == pytest.approx(width[0])
+    assert width[-1] > width[-14]
+
+
+def test_builder_rejects_unknown_methods_and_empty_series():
+    data = wide_frame(mrr=np.arange(14.0), empty=[np.nan] * 14)
+    with pytest.raises(ValueError, match='Unknown method'):
+        BaselineModelBuilder(data[['mrr']], method='arima')
+    with pytest.raises(ValueError, match='empty'):
+        BaselineModelBuilder(data)
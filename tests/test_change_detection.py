@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.change_detection import ChangeDetector, _cusum, detect_changes
+
+SCORE_COLUMNS = ['delta', 'zscore', 'robust_z', 'cusum_pos', 'cusum_neg']
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    values = 1e6 + np.cumsum(rng.normal(0, 100, 200))
+    values[120] += 5000
+    values[160:] += np.arange(40) * 60
+    return values
+
+
+def test_cusum_matches_its_recursion():
+    x = np.random.default_rng(1).normal(0, 1, 100)
+    expected, s = [], 0.0
+    for value in x:
+        s = max(0.0, s + value)
+        expected.append(s)
+    np.testing.assert_allclose(_cusum(x), expected)
+
+
+def test_flags_a_spike_and_waits_for_min_periods(series):
+    scores = detect_changes(series, min_periods=7)
+
+    assert scores['is_significant'].iloc[120]
+    assert (scores[['zscore', 'robust_z']].iloc[:8] == 0).all().all()
+    assert not scores['is_significant'].iloc[:8].any()
+
+
+def test_flags_a_slow_drift_through_cusum(series):
+    scores = detect_changes(series)
+    assert (scores['cusum_pos'].iloc[160:] > scores['cusum_pos'].iloc[:120].max()).any()
+
+
+def test_detector_matches_batch_scores(series):
+    detector = ChangeDetector()
+    incremental = pd.DataFrame([detector.update(value) for value in series])
+
+    batch = detect_changes(series)
+    np.testing.assert_allclose(incremental[SCORE_COLUMNS], batch[SCORE_COLUMNS], rtol=1e-9, atol=1e-9)
+    assert incremental['is_significant'].tolist() == batch['is_significant'].tolist()
+
+
+def test_detector_resumes_from_scores_and_saved_state(series):
+    split = 150
+    detector = ChangeDetector.from_scores(series[:split], detect_changes(series[:split]), last_day='2024-05-29')
+    detector = ChangeDetector.from_dict(detector.to_dict())
+    resumed = pd.DataFrame([detector.update(value) for value in series[split:]])
+
+    batch = detect_changes(series).iloc[split:].reset_index(drop=True)
+    np.testing.assert_allclose(resumed[SCORE_COLUMNS], batch[SCORE_COLUMNS], rtol=1e-9, atol=1e-9)
+    assert len(detector.deltas) == detector.window
@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from utils.churn_engine import build_customer_intervals, build_subscription_intervals, compute_period_churn
+from utils.mrr_facts import DAYS_PER_MONTH
+
+HORIZON = pd.Timestamp('2024-04-01')
+
+
+def invoices(*rows):
+    return pd.DataFrame(rows, columns=['subscription_id', 'customer_id', 'currency', 'period_start', 'period_end', 'total'])
+
+
+def test_adjacent_periods_merge_into_one_interval_with_an_expansion():
+    intervals, events = build_subscription_intervals(invoices(
+        ('s1', 'c1', 'eur', '2024-01-01', '2024-02-01', 31.0),
+        ('s1', 'c1', 'eur', '2024-02-01', '2024-03-01', 58.0),
+        ('s1', 'c1', 'eur', '2024-03-01', '2024-04-01', 62.0),
+    ), HORIZON)
+
+    assert len(intervals) == 1
+    interval = intervals.iloc[0]
+    assert (interval['interval_start'], interval['interval_end']) == (pd.Timestamp('2024-01-01'), HORIZON)
+    assert interval['is_open']
+    # MRR is the total over the billed days, so February's and March's amounts are the same rate.
+    assert interval['start_mrr'] == pytest.approx(DAYS_PER_MONTH)
+    assert interval['end_mrr'] == pytest.approx(2 * DAYS_PER_MONTH)
+    assert events.sort_values('event_date')['kind'].tolist() == ['new', 'expansion']
+
+
+def test_a_gap_beyond_the_grace_period_churns_and_restarts():
+    intervals, events = build_subscription_intervals(invoices(
+        ('s2', 'c2', 'eur', '2024-01-15', '2024-02-15', 100.0),
+        ('s2', 'c2', 'eur', '2024-03-01', '2024-04-01', 100.0),
+    ), HORIZON)
+
+    assert intervals['is_open'].tolist() == [False, True]
+    churn = events[events['kind'] == 'churn']
+    assert churn['event_date'].tolist() == [pd.Timestamp('2024-02-15')]
+    assert churn['mrr_delta'].iloc[0] == pytest.approx(-intervals['end_mrr'].iloc[0])
+    assert (events['kind'] == 'new').sum() == 2
+
+
+def test_a_gap_within_the_grace_period_does_not_churn():
+    intervals, events = build_subscription_intervals(invoices(
+        ('s3', 'c3', 'eur', '2024-01-01', '2024-02-01', 31.0),
+        ('s3', 'c3', 'eur', '2024-02-03', '2024-03-03', 29.0),
+    ), HORIZON, grace_days=3)
+
+    assert len(intervals) == 1
+    # The interval only churns once it ends, well before the horizon.
+    assert events.loc[events['kind'] == 'churn', 'event_date'].tolist() == [pd.Timestamp('2024-03-03')]
+
+
+def test_zero_length_periods_bill_their_line_item_period():
+    df = invoices(('s4', 'c4', 'eur', '2024-01-01', '2024-01-01', 31.0)).assign(
+        min_line_item_period_start='2024-01-01', max_line_item_period_end='2024-02-01'
+    )
+    intervals, _ = build_subscription_intervals(df, HORIZON)
+
+    assert intervals['start_mrr'].iloc[0] == pytest.approx(DAYS_PER_MONTH)
+    assert intervals['interval_end'].iloc[0] == pd.Timestamp('2024-02-01')
+
+
+def test_period_churn_rolls_flows_into_the_next_period():
+    intervals, events = build_subscription_intervals(invoices(
+        ('s1', 'c1', 'eur', '2024-01-01', '2024-02-01', 31.0),
+        ('s1', 'c1', 'eur', '2024-02-01', '2024-03-01', 29.0),
+        ('s1', 'c1', 'eur', '2024-03-01', '2024-04-01', 31.0),
+        ('s2', 'c2', 'eur', '2024-01-01', '2024-02-01', 62.0),
+    ), HORIZON)
+    customers = build_customer_intervals(intervals, HORIZON)
+
+    churn = compute_period_churn(events, customers, HORIZON).set_index('period_start')
+
+    january, february = churn.loc['2024-01-01'], churn.loc['2024-02-01']
+    assert january['new_mrr'] == pytest.approx(3 * DAYS_PER_MONTH)
+    assert january['starting_customers'] == 0
+    assert february['starting_mrr'] == pytest.approx(3 * DAYS_PER_MONTH)
+    assert february['starting_customers'] == 2
+    assert february['churned_customers'] == 1
+    assert february['churned_mrr'] == pytest.approx(2 * DAYS_PER_MONTH)
+    assert february['logo_churn_rate'] == pytest.approx(0.5)
+    assert february['gross_revenue_churn_rate'] == pytest.approx(2 / 3)
+
+
+def test_customers_with_overlapping_subscriptions_count_once():
+    intervals, _ = build_subscription_intervals(invoices(
+        ('s1', 'c1', 'eur', '2024-01-01', '2024-02-01', 31.0),
+        ('s2', 'c1', 'eur', '2024-01-20', '2024-03-01', 40.0),
+    ), HORIZON)
+    customers = build_customer_intervals(intervals, HORIZON)
+
+    assert len(customers) == 1
+    assert customers['interval_end'].iloc[0] == pd.Timestamp('2024-03-01')
+    assert not customers['is_open'].iloc[0]
@@ -0,0 +1,97 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.top_k import GRAINS, Leaderboard, TopKEngine, bucket_start, bucket_starts
+
+
+def changes(*rows):
+    return pd.DataFrame(rows, columns=['customer_id', 'currency', 'day', 'amount'])
+
+
+def test_leaderboard_keeps_the_largest_totals():
+    board = Leaderboard(2)
+    for customer_id, amount in [('a', 5), ('b', 3), ('c', 4), ('b', 3)]:
+        board.add(customer_id, amount)
+    assert board.top() == [('b', 6.0), ('a', 5.0)]
+
+
+def test_leaderboard_lets_an_outsider_overtake_a_shrinking_member():
+    board = Leaderboard(1)
+    board.add('a', 10)
+    board.add('b', 8)
+    board.add('a', -5)
+    assert board.top() == [('b', 8.0)]
+    # Beyond its own k the board ranks every total.
+    assert board.top(2) == [('b', 8.0), ('a', 5.0)]
+
+
+@pytest.mark.parametrize('grain', GRAINS)
+def test_bucket_starts_matches_bucket_start(grain):
+    days = pd.date_range('2023-12-25', '2024-03-05').date
+    expected = [bucket_start(day, grain) for day in days]
+    starts = bucket_starts(np.array(days, dtype='datetime64[D]'), grain)
+    assert [day.item() for day in starts] == expected
+
+
+def test_week_buckets_start_on_monday():
+    assert bucket_start(date(2024, 1, 7), 'week') == date(2024, 1, 1)
+    assert bucket_start(date(2024, 1, 8), 'week') == date(2024, 1, 8)
+
+
+def test_engine_folds_net_changes_into_every_grain():
+    top_k = TopKEngine(k=2, rolling_days=(7,))
+    top_k.apply(changes(
+        ('a', 'USD', date(2024, 1, 1), 10.0),
+        ('b', 'USD', date(2024, 1, 3), 20.0),
+        ('c', 'EUR', date(2024, 1, 3), 5.0),
+    ))
+    # A rewritten invoice arrives as the difference to its earlier amount.
+    top_k.apply(changes(('b', 'USD', date(2024, 1, 3), -15.0)))
+
+    assert top_k.top('USD', 'day', date(2024, 1, 3)) == [('b', 5.0)]
+    assert top_k.top('USD', 'week') == [('a', 10.0), ('b', 5.0)]
+    assert top_k.top('USD', 'month', date(2024, 1, 31)) == [('a', 10.0), ('b', 5.0)]
+    assert top_k.top('EUR', days=7) == [('c', 5.0)]
+    assert top_k.currencies == ['EUR', 'USD']
+
+
+def test_rolling_windows_move_with_the_latest_day():
+    top_k = TopKEngine(k=3, rolling_days=(7,))
+    top_k.apply(changes(('a', 'USD', date(2024, 1, 1), 10.0)))
+    assert top_k.top('USD', days=7) == [('a', 10.0)]
+
+    top_k.apply(changes(('b', 'USD', date(2024, 1, 8), 4.0)))
+    assert top_k.last_day == date(2024, 1, 8)
+    assert top_k.top('USD', days=7) == [('b', 4.0)]
+    with pytest.raises(ValueError):
+        top_k.top('USD', days=30)
+
+
+def test_state_round_trips_through_the_npz_file(tmp_path):
+    top_k = TopKEngine(k=2, rolling_days=(7, 30))
+    top_k.apply(changes(
+        ('a', 'USD', date(2024, 1, 1), 10.0),
+        ('b', 'USD', date(2024, 1, 10), 20.0),
+        ('a', 'USD', date(2024, 2, 2), 7.5),
+        ('c', 'EUR', date(2024, 2, 1), 3.0),
+    ))
+    top_k.watermark = pd.Timestamp('2024-02-03 12:00', tz='UTC').to_pydatetime()
+    top_k.refresh_id = 'abc'
+    path = str(tmp_path / 'top_k_state.npz')
+    top_k.save(path)
+
+    loaded = TopKEngine.load(path)
+
+    assert (loaded.k, loaded.rolling_days, loaded.last_day) == (2, [7, 30], date(2024, 2, 2))
+    assert (loaded.watermark, loaded.refresh_id) == (top_k.watermark, 'abc')
+    for grain in GRAINS:
+        pd.testing.assert_frame_equal(loaded.to_frame(grain), top_k.to_frame(grain))
+    for days in (7, 30):
+        pd.testing.assert_frame_equal(loaded.to_frame(days=days), top_k.to_frame(days=days))
+
+
+def test_load_without_a_state_file(tmp_path):
+    assert TopKEngine.load(str(tmp_path / 'missing.npz')) is None
@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from update_invoices import read_invoice_chunks
+from utils.validation import between, not_after, one_of, parse_flags, parsed, references, required, validate
+
+SAMPLE_INVOICES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'invoices.csv')
+
+
+def test_rule_masks():
+    raw = pd.DataFrame({
+        'id': ['a', 'b', 'c', None],
+        'amount': ['1.5', 'x', None, '-2'],
+        'currency': ['eur', 'usd', 'jpy', None],
+    })
+    df = raw.assign(amount=pd.to_numeric(raw['amount'], errors='coerce'))
+
+    assert required('id').check(df, raw).tolist() == [True, True, True, False]
+    # A value that was missing in the CSV is not a parse failure.
+    assert parsed('amount').check(df, raw).tolist() == [True, False, True, True]
+    assert one_of('currency', ['eur', 'usd']).check(df, raw).tolist() == [True, True, False, True]
+    assert between('amount', 0, np.inf).check(df, raw).tolist() == [True, True, True, False]
+    assert references('id', {'a', 'c'}).check(df, raw).tolist() == [True, False, True, True]
+
+
+def test_not_after_passes_missing_ends():
+    df = pd.DataFrame({
+        'start': pd.to_datetime(['2024-01-02', '2024-01-01', '2024-01-01']),
+        'end': pd.to_datetime(['2024-01-01', '2024-01-02', None]),
+    })
+    assert not_after('start', 'end').check(df, df).tolist() == [False, True, True]
+
+
+def test_parse_flags():
+    flags = parse_flags(pd.Series(['TRUE', 'false', 'maybe', None]))
+    assert str(flags.dtype) == 'boolean'
+    assert flags.tolist()[:2] == [True, False]
+    assert flags.isna().tolist() == [False, False, True, True]
+
+
+def test_validate_quarantines_failing_rows_with_raw_payload():
+    raw = pd.DataFrame({'id': ['a', 'b', 'c'], 'amount': ['1', 'x', '-3']})
+    df = raw.assign(amount=pd.to_numeric(raw['amount'], errors='coerce'))
+    rules = [parsed('amount'), between('amount', 0, np.inf)]
+
+    valid, rejected = validate(df, raw, rules, 'id')
+
+    assert valid.tolist() == [True, False, False]
+    assert rejected['record_id'].tolist() == ['b', 'c']
+    assert rejected['reasons'].tolist() == ['malformed_amount', 'out_of_range_amount']
+    assert json.loads(rejected['payload'].iloc[0]) == {'id': 'b', 'amount': 'x'}
+
+
+def test_validate_without_failures_or_rules():
+    raw = pd.DataFrame({'id': ['a'], 'amount': ['1']})
+    valid, rejected = validate(raw, raw, [required('id')], 'id')
+    assert valid.tolist() == [True] and rejected.empty
+    valid, rejected = validate(raw, raw, [], 'id')
+    assert valid.tolist() == [True] and rejected.empty
+
+
+def test_read_invoice_chunks_quarantines_malformed_rows(tmp_path):
+    csv = pd.read_csv(SAMPLE_INVOICES, dtype=str, nrows=30)
+    csv.loc[3, 'Tax Percent'] = 'abc'
+    csv.loc[5, 'Paid'] = 'maybe'
+    csv.loc[7, 'Currency'] = 'jpy'
+    path = tmp_path / 'invoices.csv'
+    csv.to_csv(path, index=False)
+
+    rejected = []
+    chunks = list(read_invoice_chunks(str(path), chunksize=10, on_rejected=rejected.append))
+    rejected = pd.concat(rejected, ignore_index=True)
+
+    assert sum(len(chunk) for chunk in chunks) == 27
+    assert dict(zip(rejected['record_id'], rejected['reasons'])) == {
+        csv.loc[3, 'id']: 'malformed_tax_percent',
+        csv.loc[5, 'id']: 'malformed_is_paid',
+        csv.loc[7, 'id']: 'unknown_currency',
+    }
+    # Accepted rows have their optional flags defaulted once validated.
+    assert all(chunk['is_paid'].dtype == bool for chunk in chunks)